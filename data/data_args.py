@@ -76,6 +76,16 @@ def get_args():
                         default=512,
                         help='small batch limit in number of stories')
 
+    parser.add_argument('--num_workers',
+                        type=int,
+                        default=1,
+                        help='Worker processes for reading the CoreNLP output')
+
+    parser.add_argument('--cache_dir',
+                        type=str,
+                        default='',
+                        help='Directory for per story preprocessing cache, empty to disable')
+
     # MODEL INPUT INFO
 
     parser.add_argument('--single_doc_sample',
@@ -184,6 +194,13 @@ def get_args():
                         default="test.json",
                         help='Test Data')
 
+    parser.add_argument('--data_format',
+                        type=str,
+                        default='json',
+                        choices=['json', 'jsonl', 'columnar'],
+                        help='json: one document per split, jsonl: one record per article, streamed, '
+                             'columnar: memory mapped ragged arrays per field')
+
     parser.add_argument('--intermediate',
                         type=str,
                         default="stanford_nlp",
@@ -0,0 +1,52 @@
+def build_entity_trie(first_word_map):
+    '''
+        Token trie over every raw entity string in first_word_map.
+
+        A node is a dict from token to child node, the raw entity string
+        ending at a node is stored under the None key.
+    '''
+    trie = dict()
+
+    for first_word, originals in first_word_map.iteritems():
+        for raw_text_entity in originals:
+            text_ls = raw_text_entity.split(' ')
+
+            # entities are only tried from the lowercased word they are listed under
+            if text_ls[0].lower() != first_word:
+                continue
+
+            node = trie
+
+            for token in text_ls:
+                node = node.setdefault(token, dict())
+
+            node[None] = raw_text_entity
+
+    return trie
+
+
+def match_entities(trie, sent):
+    '''
+        Yields the longest raw entity string starting at each position of sent,
+        in order of position.
+    '''
+    sent_len = len(sent)
+
+    for w in xrange(sent_len):
+        node = trie.get(sent[w])
+        longest = None
+        l = w
+
+        while node is not None:
+            if None in node:
+                longest = node[None]
+
+            l += 1
+
+            if l >= sent_len:
+                break
+
+            node = node.get(sent[l])
+
+        if longest is not None:
+            yield longest
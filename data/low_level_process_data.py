@@ -2,269 +2,212 @@ import json
 import numpy as np
 
 import data_args
+import record_io
 
+# (dtype, depth) of the model ready record fields, for the columnar format
+MODEL_READY_FIELDS = {'x': ('int32', 1), 'y': ('int32', 2), 'e': ('int32', 1), 'valid_e': ('int32', 1),
+                      'clean_y': ('int32', 2), 'sha': ('str', 0), 'chunk': ('int32', 1), 'scut': ('int32', 1),
+                      'raw_x': ('str', 1)}
 
 def process_data(args):
-    train, dev, test = prune_hl(args)
-    write_model_ready(args, train, dev, test)
-
-
-def prune_hl(args):
-    train_x, train_y, train_e, train_ve, train_cly, train_sha, train_ch = load_json(args, args.train)
-    dev_x, dev_y, dev_e, dev_ve, dev_cly, dev_rx, dev_sha, dev_ch = load_json(args, args.dev)
-    test_x, test_y, test_e, test_cy, test_rx, test_sha, test_ch = load_json(args, args.test)
-
     entity_map = get_entities(args)
-    used_e = set()
+    splits = [(load_json(args, args.train), args.train_model), (load_json(args, args.dev), args.dev_model),
+              (load_json(args, args.test), args.test_model)]
 
-    usable_e = determine_usable_entities(args, train_e, dev_e, test_e, train_y, dev_y, test_y, entity_map, args.ent_cutoff)
+    # first pass : entity counts over every split, one article at a time
+    articles_e = (record['e'] for records, _ in splits for record in records)
+    usable_e = determine_usable_entities(args, articles_e, entity_map, args.ent_cutoff)
+
+    # second pass : prune and write, kept entities get their new id as they are first kept
+    used_e = dict()
     chunk_freq = [0]*5
 
-    updated_train_y, updated_train_e, updated_train_x, updated_train_ve, updated_train_cly, updated_train_sha, updated_train_ch, sent_cut_train = prune_type(
-        args, train_x, train_y, train_e, train_ve, train_cly, None, train_sha, train_ch, chunk_freq, used_e, usable_e)
-    updated_dev_y, updated_dev_e, updated_dev_x, updated_dev_ve, updated_dev_cly, updated_dev_rx, updated_dev_sha, updated_dev_ch, sent_cut_dev = prune_type(
-        args, dev_x, dev_y, dev_e, dev_ve, dev_cly, dev_rx, dev_sha, dev_ch, chunk_freq, used_e, usable_e)
-    updated_test_y, updated_test_e, updated_test_x, updated_test_cly, updated_test_rx, updated_test_sha, updated_test_ch, sent_cut_test = prune_type(
-        args, test_x, test_y, test_e, None, test_cy, test_rx, test_sha, test_ch, chunk_freq, used_e, usable_e)
+    for records, model_type in splits:
+        prune_type(args, records, model_type, chunk_freq, used_e, usable_e)
 
     print 'used/total entities = ', len(used_e) / float(len(entity_map))
     if not args.word_level_c:
         print_chunk_info(chunk_freq)
 
-    print 'pruning entities'
-    e_map_new = re_map(used_e)
-
-    re_map_entities(updated_train_e, e_map_new)
-    re_map_entities(updated_dev_e, e_map_new)
-    re_map_entities(updated_test_e, e_map_new)
-    # determine_usable_entities(args, updated_train_e, updated_dev_e, updated_test_e, updated_train_y, updated_dev_y,
-    #                           updated_test_y, e_map_new, args.ent_cutoff)
-    save_updated_e(args, e_map_new, entity_map)
-
-    return (updated_train_x, updated_train_y, updated_train_e, updated_train_ve, updated_train_cly, None, updated_train_sha, updated_train_ch, sent_cut_train), \
-           (updated_dev_x, updated_dev_y, updated_dev_e, updated_dev_ve, updated_dev_cly, updated_dev_rx, None, updated_dev_sha, updated_dev_ch, sent_cut_dev), \
-            (updated_test_x, updated_test_y, updated_test_e, updated_test_cly, updated_test_rx, updated_test_sha, None, updated_test_ch, sent_cut_test)
-
-
-def write_model_ready(args, train, dev, test):
-    filename_train = args.train_model if args.full_test else "small_" + args.train_model
-    filename_train = args.source + '_' + str(args.vocab_size) + '_' + filename_train
-
-    ofp_train = open(filename_train, 'w+')
-    final_json_train = dict()
-
-    final_json_train['x'] = train[0]
-    final_json_train['y'] = train[1]
-    final_json_train['e'] = train[2]
-    final_json_train['valid_e'] = train[3]
-    final_json_train['clean_y'] = train[4]
-    final_json_train['sha'] = train[6]
-    final_json_train['chunk'] = train[7]
-    final_json_train['scut'] = train[8]
-
-    json.dump(final_json_train, ofp_train)
-    ofp_train.close()
-
-    filename_dev = args.dev_model if args.full_test else "small_" + args.dev_model
-    filename_dev = args.source + '_' + str(args.vocab_size) + '_' + filename_dev
-
-    ofp_dev = open(filename_dev, 'w+')
-    final_json_dev = dict()
-
-    final_json_dev['x'] = dev[0]
-    final_json_dev['y'] = dev[1]
-    final_json_dev['e'] = dev[2]
-    final_json_dev['valid_e'] = dev[3]
-    final_json_dev['clean_y'] = dev[4]
-    final_json_dev['raw_x'] = dev[5]
-    final_json_dev['sha'] = dev[7]
-    final_json_dev['chunk'] = dev[8]
-    final_json_dev['scut'] = dev[9]
-
-    json.dump(final_json_dev, ofp_dev)
-    ofp_dev.close()
-
-    filename_test = args.test_model if args.full_test else "small_" + args.test_model
-    filename_test = args.source + '_' + str(args.vocab_size) + '_' + filename_test
-
-    ofp_test = open(filename_test, 'w+')
-    final_json_test = dict()
-
-    final_json_test['x'] = test[0]
-    final_json_test['y'] = test[1]
-    final_json_test['e'] = test[2]
-    final_json_test['clean_y'] = test[3]
-    final_json_test['raw_x'] = test[4]
-    final_json_test['sha'] = test[5]
-    final_json_test['chunk'] = test[7]
-    final_json_test['scut'] = test[8]
-
-    json.dump(final_json_test, ofp_test)
-    ofp_test.close()
-
-
-def prune_type(args, x, y, e, ve, cy, rx, sha, ch, chunk_freq, used_e, usable_e):
-    length = len(y)
-    updated_y = []
-    updated_cy = []
-    updated_e = []
-    updated_ve = []
-    updated_x = []
-    updated_raw_x = []
-    updated_sha = []
-    updated_ch = []
-    sentence_cutoffs = []
+    print len(used_e), 'TOTAL NEW E'
+    save_updated_e(args, used_e, entity_map)
+
+
+def prune_type(args, records, model_type, chunk_freq, used_e, usable_e):
+    filename = model_type if args.full_test else "small_" + model_type
+    filename = args.source + '_' + str(args.vocab_size) + '_' + filename
+
+    fields = dict((k, MODEL_READY_FIELDS[k]) for k in records.keys + ['scut'])
 
+    if 'valid_e' not in fields:
+        # test articles keep their sentences in raw_x
+        fields['raw_x'] = ('str', 2)
+
+    writer = record_io.open_writer(filename, args.data_format, fields)
+
+    length = 0
     invalid_articles = 0
 
-    for i in xrange(length):
+    for record in records:
+        length += 1
 
-        y_idx = 0
-        total_entries = 0
+        updated, no_usable_hl = prune_article(args, record, chunk_freq, used_e, usable_e)
 
-        updated_y_ls = []
-        updated_e_ls = []
+        if no_usable_hl:
+            invalid_articles += 1
 
-        no_usable_hl = True
+        if updated is None:
+            invalid_articles += 1
+            continue
 
-        for highlight in e[i]:
+        writer.write(updated)
 
-            if total_entries >= args.n:
-                break
+    writer.close()
 
-            num_perms = get_perms(highlight)
+    print invalid_articles, "Invalid Articles"
+    print length, "of Articles"
 
-            if args.use_root and highlight[0][0] in usable_e:
 
-                updated_y_ls.append(y[i][y_idx])
-                updated_e_ls.append(highlight[0][0])
+def keep_entity(used_e, e):
+    if e not in used_e:
+        used_e[e] = len(used_e)
 
-                used_e.add(highlight[0][0])
 
-                total_entries += 1
-                no_usable_hl = False
+def prune_article(args, record, chunk_freq, used_e, usable_e):
+    '''
+        The model ready record of an article, its entities mapped to their new
+        id in used_e, or None when no highlight is left. Also returns whether
+        none of its highlights had a usable entity.
+    '''
+    y_idx = 0
+    total_entries = 0
 
-            elif args.use_obj_subj:
-                index_offset = 1
+    updated_y_ls = []
+    updated_e_ls = []
 
-                flat_hl = [item for item in highlight[1]]
+    no_usable_hl = True
 
-                for j in xrange(len(flat_hl)):
+    for highlight in record['e']:
 
-                    if flat_hl[j] not in usable_e:
-                        continue
+        if total_entries >= args.n:
+            break
 
-                    updated_y_ls.append(y[i][y_idx + j + index_offset])
-                    updated_e_ls.append(flat_hl[j])
+        num_perms = get_perms(highlight)
 
-                    used_e.add(flat_hl[j])
-                    no_usable_hl = False
+        if args.use_root and highlight[0][0] in usable_e:
 
-                total_entries += 1
-            elif args.use_ner:
-                index_offset = 1 + len([item for item in highlight[1]])
+            updated_y_ls.append(record['y'][y_idx])
+            updated_e_ls.append(highlight[0][0])
 
-                flat_hl = [item for item in highlight[2]]
+            keep_entity(used_e, highlight[0][0])
 
-                for j in xrange(len(flat_hl)):
+            total_entries += 1
+            no_usable_hl = False
 
-                    if flat_hl[j] not in usable_e:
-                        continue
+        elif args.use_obj_subj:
+            index_offset = 1
 
-                    updated_y_ls.append(y[i][y_idx + j + index_offset])
-                    updated_e_ls.append(flat_hl[j])
+            flat_hl = [item for item in highlight[1]]
 
-                    used_e.add(flat_hl[j])
-                    no_usable_hl = False
+            for j in xrange(len(flat_hl)):
 
-                total_entries += 1
-            else: # USE all QA content
-                index_offset = 0
+                if flat_hl[j] not in usable_e:
+                    continue
 
-                flat_hl = [item for group in highlight for item in group]
+                updated_y_ls.append(record['y'][y_idx + j + index_offset])
+                updated_e_ls.append(flat_hl[j])
 
-                for j in xrange(len(flat_hl)):
+                keep_entity(used_e, flat_hl[j])
+                no_usable_hl = False
 
-                    if flat_hl[j] not in usable_e:
-                        continue
+            total_entries += 1
+        elif args.use_ner:
+            index_offset = 1 + len([item for item in highlight[1]])
 
-                    updated_y_ls.append(y[i][y_idx + j + index_offset])
-                    updated_e_ls.append(flat_hl[j])
+            flat_hl = [item for item in highlight[2]]
 
-                    used_e.add(flat_hl[j])
-                    no_usable_hl = False
+            for j in xrange(len(flat_hl)):
 
-                total_entries += 1
+                if flat_hl[j] not in usable_e:
+                    continue
 
-            y_idx += num_perms
+                updated_y_ls.append(record['y'][y_idx + j + index_offset])
+                updated_e_ls.append(flat_hl[j])
 
-        if no_usable_hl:
-            invalid_articles += 1
+                keep_entity(used_e, flat_hl[j])
+                no_usable_hl = False
 
-        if total_entries == 0:
-            invalid_articles += 1
-            continue
+            total_entries += 1
+        else: # USE all QA content
+            index_offset = 0
 
-        updated_e.append(updated_e_ls[:args.n])
-        updated_y.append(updated_y_ls[:args.n])
+            flat_hl = [item for group in highlight for item in group]
 
-        updated_cy.append(cy[i])
-        updated_sha.append(sha[i])
+            for j in xrange(len(flat_hl)):
 
-        updated_x.append([w for sent in x[i] for w in sent])
-        sentence_cutoffs.append([len(sent) for sent in x[i]])
+                if flat_hl[j] not in usable_e:
+                    continue
 
-        if args.word_level_c:
-            updated_ch.append([1 for sent in ch[i] for _ in sent])
-        else:
-            updated_chunks = []
+                updated_y_ls.append(record['y'][y_idx + j + index_offset])
+                updated_e_ls.append(flat_hl[j])
 
-            for sent in ch[i]:
-                for w in sent:
-                    updated_chunks.append(w)
-                    chunk_freq[w - 1] += 1
+                keep_entity(used_e, flat_hl[j])
+                no_usable_hl = False
 
-            updated_ch.append(updated_chunks)
+            total_entries += 1
 
-        if ve is not None:
-            updated_ve.append(ve[i])
-        if rx is not None and ve is not None:
-            updated_raw_x.append([w for sent in rx[i] for w in sent])
-        elif rx is not None:
-            updated_raw_x.append(rx[i])
+        y_idx += num_perms
 
-    print invalid_articles, "Invalid Articles"
-    print length, "of Articles"
+    if total_entries == 0:
+        return None, no_usable_hl
+
+    updated = dict()
 
-    if ve is None:
-        return updated_y, updated_e, updated_x, updated_cy, updated_raw_x, \
-               updated_sha, updated_ch, sentence_cutoffs
-    if rx is None:
-        return updated_y, updated_e, updated_x, updated_ve, updated_cy, \
-               updated_sha, updated_ch, sentence_cutoffs
+    updated['e'] = [used_e[e] for e in updated_e_ls[:args.n]]
+    updated['y'] = updated_y_ls[:args.n]
+
+    updated['clean_y'] = record['clean_y']
+    updated['sha'] = record['sha']
+
+    updated['x'] = [w for sent in record['x'] for w in sent]
+    updated['scut'] = [len(sent) for sent in record['x']]
+
+    if args.word_level_c:
+        updated['chunk'] = [1 for sent in record['chunk'] for _ in sent]
     else:
-        return updated_y, updated_e, updated_x, updated_ve, updated_cy, \
-               updated_raw_x, updated_sha, updated_ch, sentence_cutoffs
+        updated_chunks = []
+
+        for sent in record['chunk']:
+            for w in sent:
+                updated_chunks.append(w)
+                chunk_freq[w - 1] += 1
 
+        updated['chunk'] = updated_chunks
 
-def determine_usable_entities(args, train_e, dev_e, test_e, train_y, dev_y, test_y, entity_map, cutoff=5):
-    e = train_e + dev_e + test_e
-    y = train_y + dev_y + test_y
+    if 'valid_e' in record:
+        updated['valid_e'] = record['valid_e']
+    if 'raw_x' in record and 'valid_e' in record:
+        updated['raw_x'] = [w for sent in record['raw_x'] for w in sent]
+    elif 'raw_x' in record:
+        updated['raw_x'] = record['raw_x']
 
-    length = len(y)
+    return updated, no_usable_hl
+
+
+def determine_usable_entities(args, articles_e, entity_map, cutoff=5):
     used_e = dict()
     new_map = dict()
 
     empty_articles = 0
 
-    for i in xrange(length):
+    for article_e in articles_e:
 
         y_idx = 0
         total_entries = 0
 
         empty_article = True
 
-        for highlight in e[i]:
+        for highlight in article_e:
 
             num_perms = get_perms(highlight)
 
@@ -339,29 +282,24 @@ def determine_usable_entities(args, train_e, dev_e, test_e, train_y, dev_y, test
     return new_map
 
 
-def re_map_entities(e, new_map):
-    length = len(e)
-
-    for i in xrange(length):
-        for j in xrange(len(e[i])):
-            e[i][j] = new_map[e[i][j]]
+def split_keys(type):
+    if 'test' in type:
+        return ['x', 'y', 'e', 'clean_y', 'raw_x', 'sha', 'chunk']
+    elif 'dev' in type:
+        return ['x', 'y', 'e', 'valid_e', 'clean_y', 'raw_x', 'sha', 'chunk']
+    else:
+        return ['x', 'y', 'e', 'valid_e', 'clean_y', 'sha', 'chunk']
 
 
 def load_json(args, type):
+    '''
+        The records of a split, see record_io.open_records : json is loaded and
+        columnar mapped once for both passes, jsonl is streamed again by each.
+    '''
     f_name = type if args.full_test else "small_" + type
     f_name = args.source + '_' + str(args.vocab_size) + '_' + f_name
 
-    ifp = open(f_name, 'rb')
-
-    data = json.load(ifp)
-    ifp.close()
-
-    if 'test' in type:
-        return data['x'], data['y'], data['e'], data['clean_y'], data['raw_x'], data['sha'], data['chunk']
-    elif 'dev' in type:
-        return data['x'], data['y'], data['e'], data['valid_e'], data['clean_y'], data['raw_x'], data['sha'], data['chunk']
-    else:
-        return data['x'], data['y'], data['e'], data['valid_e'], data['clean_y'], data['sha'], data['chunk']
+    return record_io.open_records(f_name, args.data_format, split_keys(type))
 
 
 def get_entities(args):
@@ -396,17 +334,6 @@ def generate_valid_entity_types(args):
     return set(e_ls)
 
 
-def re_map(used_e):
-    new_e = dict()
-    counter = 0
-
-    for item in used_e:
-        new_e[item] = counter
-        counter += 1
-    print len(new_e), 'TOTAL NEW E'
-    return new_e
-
-
 def save_updated_e(args, e_map_new, entity_map):
     e_ls = []
 
@@ -5,6 +5,8 @@ import sys
 import hashlib
 
 import data_args
+from entity_trie import build_entity_trie, match_entities
+import vocab_io
 
 
 reload(sys)
@@ -192,7 +194,7 @@ def core_nlp(args, train, dev, test):
     ofp_test.close()
 
 
-def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, first_word_map, unk, return_r=False):
+def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, entity_trie, unk, return_r=False):
     inp_seqs = []
     inp_seqs_raw = []
     inp_ents = []
@@ -226,30 +228,10 @@ def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, first_word_map, u
                 if return_r:
                     single_inp_sent_raw.append(word)
 
-                # 2.) check if word starts NER
-                if word in first_word_map:
-
-                    originals = first_word_map[word]
-
-                    for raw_text_entity in originals:
-
-                        text_ls = raw_text_entity.split(' ')
-                        ent_len = len(text_ls)
-                        entity_found = True
-
-                        for i in xrange(ent_len):
-                            if w + i >= len(sent):
-                                entity_found = False
-                                break
-
-                            if sent[w + i] != text_ls[i]:
-                                entity_found = False
-                                break
-
-                        if entity_found:
-                            entity = entity_set[raw_entity_mapping[raw_text_entity]]
-                            entities_in_article.add(entity[0])
-                            break
+            # 2.) longest entity starting at each word
+            for raw_text_entity in match_entities(entity_trie, sent):
+                entity = entity_set[raw_entity_mapping[raw_text_entity]]
+                entities_in_article.add(entity[0])
 
             single_inp_seqs.append(single_inp_sent)
 
@@ -390,17 +372,17 @@ def machine_ready(args, train, dev, test, vocab, count, placeholder, unk):
     seqs_test_hl, seqs_test_e, seqs_clean_test, entity_counter = seqs_hl(args, test[0], vocab, entity_set, entity_counter, raw_entity_mapping,
                                         first_word_map, 'test', placeholder, unk)
 
-    sorted_first_word_map = sort_entries(first_word_map)
+    entity_trie = build_entity_trie(first_word_map)
 
     print 'Train data indexing..'
     seqs_train_articles, seq_train_art_ents = seqs_art(args, train[1], vocab, entity_set, raw_entity_mapping,
-                                                       sorted_first_word_map, unk)
+                                                       entity_trie, unk)
     print 'Dev data indexing..'
     seqs_dev_articles, seq_dev_art_ents, seq_dev_art_raw = seqs_art(args, dev[1], vocab, entity_set, raw_entity_mapping,
-                                                   sorted_first_word_map, unk, return_r=True)
+                                                   entity_trie, unk, return_r=True)
     print 'Test data indexing..'
     seqs_test_articles, seq_test_art_ents, seq_test_art_raw = seqs_art(args, test[1], vocab, entity_set, raw_entity_mapping,
-                                                     sorted_first_word_map, unk, return_r=True)
+                                                     entity_trie, unk, return_r=True)
 
     filename_train = args.train if args.full_test else "small_" + args.train
     filename_train = args.source + '_' + str(count) + '_' + filename_train
@@ -520,41 +502,16 @@ def tokenize(args, current_article, current_highlights, unique_w):
 
 
 def create_vocab_map(args, unique_w, count):
-    ofp = open(args.source + '_' + 'vocab_' + str(count) + '.txt', 'w+')
-    vocab_map = dict()
-    index = 0
+    top_words = vocab_io.top_k_words(unique_w, count)
+    vocab_io.write_vocab(args.source + '_' + 'vocab_' + str(count) + '.txt', top_words, count)
 
-    inv_map = dict()
-
-    for k, v in unique_w.iteritems():
-        if v in inv_map:
-            inv_map[v].append(k)
-        else:
-            inv_map[v] = [k]
-
-    for c in sorted(inv_map.iterkeys(), reverse=True):
-        words = inv_map[c]
-
-        if index >= count:
-            break
-
-        for w in words:
-            ofp.write(w + '\n')
-            vocab_map[w] = index
-            index += 1
-
-            if index >= count:
-                break
-
-    ofp.write('<padding>\n<unk>\n<placeholder>\n')
+    vocab_map = dict((w, index) for index, (w, _) in enumerate(top_words))
+    index = len(top_words)
 
     vocab_map['<padding>'] = index
     vocab_map['<unk>'] = unk = index + 1
     vocab_map['<placeholder>'] = placeholder = index + 2
 
-    index += 3
-
-    ofp.close()
     return vocab_map, placeholder, unk
 
 
@@ -625,27 +582,6 @@ def create_hl_vector(args, vocab, tokens_ls, unk):
     return vector
 
 
-def sort_entries(first_word_map):
-    new_first_word_map = dict()
-
-    for word, ls in first_word_map.iteritems():
-
-        new_ents = []
-        originals_as_ls = []
-
-        for entity in ls:
-            originals_as_ls.append(entity.split(' '))
-
-        sorted_ls = sorted(originals_as_ls, key=len, reverse=True)
-
-        for entity_ls in sorted_ls:
-            new_ents.append(' '.join(entity_ls))
-
-        new_first_word_map[word] = new_ents
-
-    return new_first_word_map
-
-
 def find_ner_tokens(tokens_ls, tag_ls):
     ner_set = set()
     current_ner = None
@@ -1,19 +1,39 @@
+import collections
 import json
+import multiprocessing
 import os
 import sys
 
 import hashlib
-from nltk import ParentedTree
+import re
 import time
 
 import data_args
+from entity_trie import build_entity_trie, match_entities
+import record_io
+import vocab_io
 
 
 reload(sys)
 sys.setdefaultencoding('utf8')
 
+# bump when extract_tokens changes, so cached stories are rebuilt
+STORY_CACHE_VERSION = 1
+
+# same tokens nltk's Tree.fromstring reads: open bracket with optional label, close bracket, leaf
+PARSE_TOKEN_RE = re.compile(r'\(\s*[^\s()]*|\)|[^\s()]+')
+
+# (dtype, depth) of the machine ready record fields, for the columnar format
+MACHINE_READY_FIELDS = {'x': ('int32', 2), 'y': ('int32', 2), 'e': ('int32', 3), 'sha': ('str', 0),
+                        'valid_e': ('int32', 1), 'clean_y': ('int32', 2), 'chunk': ('int32', 2),
+                        'raw_x': ('str', 2)}
+
 
 def process_data(args):
+    if args.data_format != 'json':
+        process_data_stream(args)
+        return
+
     train, dev, test, unique_w = split_data(args)
 
     prepare_rouge(args, test[0], 'test')
@@ -27,8 +47,24 @@ def process_data(args):
         machine_ready(args, train, dev, test, vocab, count, placeholder, unk)
 
 
+def process_data_stream(args):
+    spools, unique_w = spool_data(args)
+
+    prepare_rouge(args, (story['hl'] for story in record_io.iter_jsonl(spools[2])), 'test')
+    prepare_rouge(args, (story['hl'] for story in record_io.iter_jsonl(spools[1])), 'dev')
+
+    word_counts = [args.vocab_size]
+
+    for count in word_counts:
+        print 'Building dataset for vocab size : ' + str(count)
+        vocab, placeholder, unk = create_vocab_map(args, unique_w, count)
+        machine_ready_stream(args, spools, vocab, count, placeholder, unk)
+
+    for spool in spools:
+        os.remove(spool)
+
+
 def split_data(args):
-    small_size_counter = 0
     unique_words = dict()
 
     highlights_train = []
@@ -43,11 +79,74 @@ def split_data(args):
     articles_test = []
     hashes_test = []
 
-    sentence_lengths = []
+    for catg, cur_hl, current_article, sha in iter_split_stories(args, unique_words):
+
+        if catg == 1: #TRAIN
+            highlights_train.append(cur_hl)
+            articles_train.append(current_article)
+            hashes_train.append(sha)
+        elif catg == 2: #DEV
+            highlights_dev.append(cur_hl)
+            articles_dev.append(current_article)
+            hashes_dev.append(sha)
+        else:#TEST
+            highlights_test.append(cur_hl)
+            articles_test.append(current_article)
+            hashes_test.append(sha)
+
+    return (highlights_train, articles_train, hashes_train), \
+           (highlights_dev, articles_dev, hashes_dev), \
+           (highlights_test, articles_test, hashes_test), \
+           unique_words
+
 
-    train_urls, dev_urls, test_urls = get_url_sets(args)
+def spool_data(args):
+    # same split as split_data, but stories go to one JSONL file per split instead of staying in memory
+    unique_words = dict()
+    spools = []
+    writers = []
+
+    for type in ['train', 'dev', 'test']:
+        filename = args.source + '_' + type + '_stories.jsonl'
+        spools.append(filename if args.full_test else "small_" + filename)
+        writers.append(record_io.JsonlWriter(spools[-1]))
+
+    for catg, cur_hl, current_article, sha in iter_split_stories(args, unique_words):
+        writers[catg - 1].write({'hl': cur_hl, 'article': current_article, 'sha': sha})
+
+    for writer in writers:
+        writer.close()
+
+    return spools, unique_words
+
+
+def iter_split_stories(args, unique_words):
+    small_size_counter = 0
+
+    url_sets = get_url_sets(args)
 
     sha_ls = get_sha()
+
+    if args.cache_dir and not os.path.exists(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    # small runs stop early and count words only up to the limit, keep those serial
+    if args.num_workers > 1 and args.full_test:
+        stories = read_stories_parallel(args, sha_ls, url_sets, unique_words)
+    else:
+        stories = read_stories(args, sha_ls, url_sets, unique_words)
+
+    for story in stories:
+        yield story
+
+        small_size_counter += 1
+
+        if not args.full_test and small_size_counter >= args.small_limit:
+            break
+
+
+def read_stories(args, sha_ls, url_sets, unique_words):
+    train_urls, dev_urls, test_urls = url_sets
     item_total = len(sha_ls)
 
     counter = 1
@@ -62,25 +161,16 @@ def split_data(args):
 
         counter += 1
 
-        ifp_article = open(args.parsed_output_loc + '/articles_scnlp/' + sha + '.txt.json', 'rb')
-        ifp_hl = open(args.parsed_output_loc + '/highlights_scnlp/' + sha + '.txt.json', 'rb')
-
-        cur_hl = json.load(ifp_hl)['sentences']
-        document = json.load(ifp_article)['sentences']
-
-        ifp_article.close()
-        ifp_hl.close()
-
         # Here current_article is a list containing tuples (sentence, mask, chunk_ls)
-        current_article = extract_tokens(args, document, cur_hl, unique_words)
+        if args.cache_dir:
+            cur_hl, current_article = read_story_cached(args, sha, unique_words)
+        else:
+            cur_hl, current_article = read_story(args, sha, unique_words)
 
         if current_article is None:
             print sha
             continue
 
-        for c in current_article:
-            sentence_lengths.append(len(c[0]))
-
         if len(current_article) == 0:
             continue
 
@@ -91,31 +181,109 @@ def split_data(args):
             print 'Problem with : ' + str(sha)
             continue
 
-        if catg == 1: #TRAIN
-            highlights_train.append(cur_hl)
-            articles_train.append(current_article)
-            hashes_train.append(sha)
-        elif catg == 2: #DEV
-            highlights_dev.append(cur_hl)
-            articles_dev.append(current_article)
-            hashes_dev.append(sha)
-        else:#TEST
-            highlights_test.append(cur_hl)
-            articles_test.append(current_article)
-            hashes_test.append(sha)
+        yield catg, cur_hl, current_article, sha
 
-        small_size_counter += 1
 
-        if not args.full_test and small_size_counter >= args.small_limit:
-            return (highlights_train, articles_train, hashes_train), \
-                   (highlights_dev, articles_dev, hashes_dev), \
-                   (highlights_test, articles_test, hashes_test), \
-                   unique_words
+def read_story(args, sha, unique_words):
+    ifp_article = open(args.parsed_output_loc + '/articles_scnlp/' + sha + '.txt.json', 'rb')
+    ifp_hl = open(args.parsed_output_loc + '/highlights_scnlp/' + sha + '.txt.json', 'rb')
 
-    return (highlights_train, articles_train, hashes_train), \
-           (highlights_dev, articles_dev, hashes_dev), \
-           (highlights_test, articles_test, hashes_test), \
-           unique_words
+    cur_hl = json.load(ifp_hl)['sentences']
+    document = json.load(ifp_article)['sentences']
+
+    ifp_article.close()
+    ifp_hl.close()
+
+    return cur_hl, extract_tokens(args, document, cur_hl, unique_words)
+
+
+def read_story_cached(args, sha, unique_words):
+    ifp_article = open(args.parsed_output_loc + '/articles_scnlp/' + sha + '.txt.json', 'rb')
+    ifp_hl = open(args.parsed_output_loc + '/highlights_scnlp/' + sha + '.txt.json', 'rb')
+
+    article_json = ifp_article.read()
+    hl_json = ifp_hl.read()
+
+    ifp_article.close()
+    ifp_hl.close()
+
+    key = story_cache_key(args, article_json, hl_json)
+    cache_file = os.path.join(args.cache_dir, sha + '.json')
+    story = None
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as ifp:
+                story = json.load(ifp)
+        except ValueError:
+            story = None
+
+        if story is not None and story['key'] != key:
+            story = None
+
+    if story is None:
+        # word counts are kept per story, in first seen order, so a cache hit adds them back the same way
+        words = collections.OrderedDict()
+
+        cur_hl = json.loads(hl_json)['sentences']
+        document = json.loads(article_json)['sentences']
+
+        current_article = extract_tokens(args, document, cur_hl, words)
+
+        story = {'key': key, 'hl': cur_hl, 'article': current_article, 'words': words.items()}
+
+        with open(cache_file + '.tmp', 'w+') as ofp:
+            json.dump(story, ofp)
+
+        os.rename(cache_file + '.tmp', cache_file)
+
+    vocab_io.add_word_counts(unique_words, story['words'])
+
+    return story['hl'], story['article']
+
+
+def story_cache_key(args, article_json, hl_json):
+    # everything extract_tokens depends on
+    key = hashlib.sha1()
+
+    key.update('%d %d %d %d\n' % (STORY_CACHE_VERSION, args.chunk_threshold, len(article_json), len(hl_json)))
+    key.update(article_json)
+    key.update(hl_json)
+
+    return key.hexdigest()
+
+
+def read_stories_parallel(args, sha_ls, url_sets, unique_words, shard_size=1000):
+    shards = [sha_ls[i:i + shard_size] for i in xrange(0, len(sha_ls), shard_size)]
+
+    pool = multiprocessing.Pool(args.num_workers, init_shard_worker, (args, url_sets))
+
+    # imap hands shards back in order, so stories and first word occurrences
+    # reach the caller in the same order as the serial pass
+    for shard_idx, (stories, shard_words) in enumerate(pool.imap(read_shard, shards)):
+        print 'Merged shard', shard_idx + 1, '/', len(shards)
+
+        vocab_io.add_word_counts(unique_words, shard_words)
+
+        for story in stories:
+            yield story
+
+    pool.close()
+    pool.join()
+
+
+def init_shard_worker(args, url_sets):
+    global shard_args, shard_url_sets
+
+    shard_args = args
+    shard_url_sets = url_sets
+
+
+def read_shard(sha_ls):
+    shard_words = collections.OrderedDict()
+    stories = list(read_stories(shard_args, sha_ls, shard_url_sets, shard_words))
+
+    return stories, shard_words.items()
 
 
 def get_sha():
@@ -168,7 +336,7 @@ def extract_sentence(hl):
     return sentence
 
 
-def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, first_word_map, unk, return_r=False):
+def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, entity_trie, unk, return_r=False):
     inp_seqs = []
     inp_s_chunks = []
     inp_seqs_mask = []
@@ -185,77 +353,64 @@ def seqs_art(args, inp, vocab, entity_set, raw_entity_mapping, first_word_map, u
             print '..', counter
         counter += 1
 
-        single_inp_seqs = []
-        single_inp_s_chunks = []
-        single_inp_seqs_mask = []
-        single_inp_seqs_raw = []
-        entities_in_article = set()
-
-        for i in xrange(len(article)):
-
-            sent = article[i][0]
-            masks = article[i][1]
-            chunk_ls = article[i][2]
-
-            single_inp_sent = []
-            single_inp_sent_raw = []
-
-            for w in xrange(len(sent)):
+        single_inp_seqs, single_inp_ents, single_inp_seqs_raw, single_inp_seqs_mask, single_inp_s_chunks = index_article(
+            args, article, vocab, entity_set, raw_entity_mapping, entity_trie, unk, return_r)
 
-                # 1.) check if word in vocab or not
-                word = sent[w]
-                word_l = word.lower()
+        inp_ents.append(single_inp_ents)
+        inp_seqs.append(single_inp_seqs)
+        inp_s_chunks.append(single_inp_s_chunks)
+        inp_seqs_mask.append(single_inp_seqs_mask)
 
-                index = vocab[word_l] if word_l in vocab else unk
-                single_inp_sent.append(index)
+        if return_r:
+            inp_seqs_raw.append(single_inp_seqs_raw)
 
-                if return_r:
-                    single_inp_sent_raw.append(word)
+    if return_r:
+        return inp_seqs, inp_ents, inp_seqs_raw, inp_seqs_mask, inp_s_chunks
+    else:
+        return inp_seqs, inp_ents, inp_seqs_mask, inp_s_chunks
 
-                # 2.) check if word starts NER
-                if word_l in first_word_map:
 
-                    originals = first_word_map[word_l]
+def index_article(args, article, vocab, entity_set, raw_entity_mapping, entity_trie, unk, return_r=False):
+    single_inp_seqs = []
+    single_inp_s_chunks = []
+    single_inp_seqs_mask = []
+    single_inp_seqs_raw = []
+    entities_in_article = set()
 
-                    for raw_text_entity in originals:
+    for i in xrange(len(article)):
 
-                        text_ls = raw_text_entity.split(' ')
-                        ent_len = len(text_ls)
-                        entity_found = True
+        sent = article[i][0]
+        masks = article[i][1]
+        chunk_ls = article[i][2]
 
-                        for l in xrange(ent_len):
-                            if w + l >= len(sent):
-                                entity_found = False
-                                break
+        single_inp_sent = []
+        single_inp_sent_raw = []
 
-                            if sent[w + l] != text_ls[l]:
-                                entity_found = False
-                                break
+        for w in xrange(len(sent)):
 
-                        if entity_found:
-                            entity = entity_set[raw_entity_mapping[raw_text_entity]]
-                            entities_in_article.add(entity[0])
-                            break
+            # 1.) check if word in vocab or not
+            word = sent[w]
+            word_l = word.lower()
 
-            single_inp_seqs_mask.append(masks)
-            single_inp_s_chunks.append(chunk_ls)
-            single_inp_seqs.append(single_inp_sent)
+            index = vocab[word_l] if word_l in vocab else unk
+            single_inp_sent.append(index)
 
             if return_r:
-                single_inp_seqs_raw.append(single_inp_sent_raw)
+                single_inp_sent_raw.append(word)
 
-        inp_ents.append(list(entities_in_article))
-        inp_seqs.append(single_inp_seqs)
-        inp_s_chunks.append(single_inp_s_chunks)
-        inp_seqs_mask.append(single_inp_seqs_mask)
+        # 2.) longest entity starting at each word
+        for raw_text_entity in match_entities(entity_trie, sent):
+            entity = entity_set[raw_entity_mapping[raw_text_entity]]
+            entities_in_article.add(entity[0])
+
+        single_inp_seqs_mask.append(masks)
+        single_inp_s_chunks.append(chunk_ls)
+        single_inp_seqs.append(single_inp_sent)
 
         if return_r:
-            inp_seqs_raw.append(single_inp_seqs_raw)
+            single_inp_seqs_raw.append(single_inp_sent_raw)
 
-    if return_r:
-        return inp_seqs, inp_ents, inp_seqs_raw, inp_seqs_mask, inp_s_chunks
-    else:
-        return inp_seqs, inp_ents, inp_seqs_mask, inp_s_chunks
+    return single_inp_seqs, list(entities_in_article), single_inp_seqs_raw, single_inp_seqs_mask, single_inp_s_chunks
 
 
 def seqs_hl(args, inp, vocab, entity_set, entity_counter, raw_entity_mapping, first_word_map, type, placeholder, unk):
@@ -263,136 +418,142 @@ def seqs_hl(args, inp, vocab, entity_set, entity_counter, raw_entity_mapping, fi
     input_hl_entities = []
     input_hl_clean = []
 
-    tag_ls = ['PERSON', 'LOCATION', 'ORGANIZATION', 'MISC']
-
     total_samples = len(inp)
 
     for sample in xrange(total_samples):
         if (total_samples / 10) > 0 and sample % (total_samples / 10) == 0:
             print '..', sample
 
-        single_inp_hl = []
-        single_inp_clean = []
-        single_inp_hl_entity_ls = []
+        single_inp_hl, single_inp_hl_entity_ls, single_inp_clean, entity_counter = index_hl(
+            args, inp[sample], vocab, entity_set, entity_counter, raw_entity_mapping, first_word_map, placeholder, unk)
 
-        highlights = inp[sample]
-        num_sentences = len(highlights)
-        for h in xrange(num_sentences):
-            single_sent_hl_entity_ls = [[],[],[]]
-            used_idx = set()
+        input_hl_seqs.append(single_inp_hl)
+        input_hl_entities.append(single_inp_hl_entity_ls)
+        input_hl_clean.append(single_inp_clean)
 
-            # 1.) find sentence root
-            working_anno_hl = highlights[h]
+    return input_hl_seqs, input_hl_entities, input_hl_clean, entity_counter
 
-            basic_dep = working_anno_hl['basicDependencies']
-            enhanced_dep = working_anno_hl['enhancedDependencies']
-            tokens_ls = working_anno_hl['tokens']
 
-            root_basic_dep = basic_dep[0]
-            root_idx = root_basic_dep['dependent']
+def index_hl(args, highlights, vocab, entity_set, entity_counter, raw_entity_mapping, first_word_map, placeholder, unk):
+    tag_ls = ['PERSON', 'LOCATION', 'ORGANIZATION', 'MISC']
 
-            root_token = tokens_ls[root_idx - 1]
-            root_lemma = root_token['lemma'].lower()
-            root_org = root_token['originalText']
-            root_first_word = root_org.lower()
+    single_inp_hl = []
+    single_inp_clean = []
+    single_inp_hl_entity_ls = []
 
-            start_r = end_r = root_idx - 1
+    num_sentences = len(highlights)
+    for h in xrange(num_sentences):
+        single_sent_hl_entity_ls = [[],[],[]]
+        used_idx = set()
 
-            if root_lemma not in entity_set: # previously not found @entity
-                entity_info = [entity_counter, 'ROOT']
-                entity_set[root_lemma] = entity_info
-                entity_counter += 1
+        # 1.) find sentence root
+        working_anno_hl = highlights[h]
 
-            if root_org not in raw_entity_mapping:
-                raw_entity_mapping[root_org] = root_lemma
+        basic_dep = working_anno_hl['basicDependencies']
+        enhanced_dep = working_anno_hl['enhancedDependencies']
+        tokens_ls = working_anno_hl['tokens']
 
-            if root_first_word not in first_word_map:
-                first_word_map[root_first_word] = [root_org]
-            else:
-                originals = first_word_map[root_first_word]
+        root_basic_dep = basic_dep[0]
+        root_idx = root_basic_dep['dependent']
 
-                if root_org not in originals:
-                    first_word_map[root_first_word].append(root_org)
+        root_token = tokens_ls[root_idx - 1]
+        root_lemma = root_token['lemma'].lower()
+        root_org = root_token['originalText']
+        root_first_word = root_org.lower()
 
-            clean_hl_vec = create_hl_vector(args, vocab, tokens_ls, unk)
-            single_inp_clean.append(clean_hl_vec)
+        start_r = end_r = root_idx - 1
 
-            if start_r == end_r:
-                hl_vec = clean_hl_vec[:]
-                hl_vec[root_idx - 1] = placeholder
-                used_idx.add(root_idx - 1)
-            else:
-                hl_vec = clean_hl_vec[:start_r] + [placeholder] + clean_hl_vec[end_r + 1:]
+        if root_lemma not in entity_set: # previously not found @entity
+            entity_info = [entity_counter, 'ROOT']
+            entity_set[root_lemma] = entity_info
+            entity_counter += 1
 
-            single_inp_hl.append(hl_vec)
-            single_sent_hl_entity_ls[0].append(entity_set[root_lemma.lower()][0])
+        if root_org not in raw_entity_mapping:
+            raw_entity_mapping[root_org] = root_lemma
 
-            # 2.) find all xobj, xsubj
-            usable_question_dependencies = find_dependencies(basic_dep, tokens_ls)
+        if root_first_word not in first_word_map:
+            first_word_map[root_first_word] = [root_org]
+        else:
+            originals = first_word_map[root_first_word]
 
-            for (tok, type_, t_idx) in usable_question_dependencies:
-                tok_lemma = tok['lemma'].lower()
-                tok_org = tok['originalText']
-                first_word = tok_org.lower()
+            if root_org not in originals:
+                first_word_map[root_first_word].append(root_org)
 
-                if tok_lemma not in entity_set:  # previously not found @entity
-                    entity_info = [entity_counter, type_]
-                    entity_set[tok_lemma] = entity_info
-                    entity_counter += 1
+        clean_hl_vec = create_hl_vector(args, vocab, tokens_ls, unk)
+        single_inp_clean.append(clean_hl_vec)
 
-                if tok_org not in raw_entity_mapping:
-                    raw_entity_mapping[tok_org] = tok_lemma
+        if start_r == end_r:
+            hl_vec = clean_hl_vec[:]
+            hl_vec[root_idx - 1] = placeholder
+            used_idx.add(root_idx - 1)
+        else:
+            hl_vec = clean_hl_vec[:start_r] + [placeholder] + clean_hl_vec[end_r + 1:]
 
-                if first_word not in first_word_map:
-                    first_word_map[first_word] = [tok_org]
-                else:
-                    originals = first_word_map[first_word]
+        single_inp_hl.append(hl_vec)
+        single_sent_hl_entity_ls[0].append(entity_set[root_lemma.lower()][0])
 
-                    if tok_org not in originals:
-                        first_word_map[first_word].append(tok_org)
+        # 2.) find all xobj, xsubj
+        usable_question_dependencies = find_dependencies(basic_dep, tokens_ls)
 
-                hl_vec = clean_hl_vec[:]
-                hl_vec[t_idx] = placeholder
-                used_idx.add(t_idx)
+        for (tok, type_, t_idx) in usable_question_dependencies:
+            tok_lemma = tok['lemma'].lower()
+            tok_org = tok['originalText']
+            first_word = tok_org.lower()
 
-                single_inp_hl.append(hl_vec)
-                single_sent_hl_entity_ls[1].append(entity_set[tok_lemma.lower()][0])
+            if tok_lemma not in entity_set:  # previously not found @entity
+                entity_info = [entity_counter, type_]
+                entity_set[tok_lemma] = entity_info
+                entity_counter += 1
 
-            # 3.) find all instances of tags
-            # named entities in the form : (entity name, start, end, type, raw name, first word)
-            entities = find_ner_tokens(args, tokens_ls, tag_ls)
+            if tok_org not in raw_entity_mapping:
+                raw_entity_mapping[tok_org] = tok_lemma
 
-            for entity_name, start, end, e_type, raw_name, first_word in entities:
-                if start in used_idx:
-                    continue
-                if entity_name not in entity_set:
-                    entity_info = [entity_counter, e_type]
-                    entity_set[entity_name] = entity_info
-                    entity_counter += 1
+            if first_word not in first_word_map:
+                first_word_map[first_word] = [tok_org]
+            else:
+                originals = first_word_map[first_word]
 
-                hl_vec_complete = clean_hl_vec[:start] + [placeholder] + clean_hl_vec[end + 1:]
+                if tok_org not in originals:
+                    first_word_map[first_word].append(tok_org)
 
-                single_inp_hl.append(hl_vec_complete)
-                single_sent_hl_entity_ls[2].append(entity_set[entity_name][0])
+            hl_vec = clean_hl_vec[:]
+            hl_vec[t_idx] = placeholder
+            used_idx.add(t_idx)
 
-                if raw_name not in raw_entity_mapping:
-                    raw_entity_mapping[raw_name] = entity_name
+            single_inp_hl.append(hl_vec)
+            single_sent_hl_entity_ls[1].append(entity_set[tok_lemma.lower()][0])
 
-                if first_word not in first_word_map:
-                    first_word_map[first_word] = [raw_name]
-                else:
-                    originals = first_word_map[first_word]
+        # 3.) find all instances of tags
+        # named entities in the form : (entity name, start, end, type, raw name, first word)
+        entities = find_ner_tokens(args, tokens_ls, tag_ls)
 
-                    if raw_name not in originals:
-                        first_word_map[first_word].append(raw_name)
+        for entity_name, start, end, e_type, raw_name, first_word in entities:
+            if start in used_idx:
+                continue
+            if entity_name not in entity_set:
+                entity_info = [entity_counter, e_type]
+                entity_set[entity_name] = entity_info
+                entity_counter += 1
 
-            single_inp_hl_entity_ls.append(single_sent_hl_entity_ls)
+            hl_vec_complete = clean_hl_vec[:start] + [placeholder] + clean_hl_vec[end + 1:]
 
-        input_hl_seqs.append(single_inp_hl)
-        input_hl_entities.append(single_inp_hl_entity_ls)
-        input_hl_clean.append(single_inp_clean)
+            single_inp_hl.append(hl_vec_complete)
+            single_sent_hl_entity_ls[2].append(entity_set[entity_name][0])
 
-    return input_hl_seqs, input_hl_entities, input_hl_clean, entity_counter
+            if raw_name not in raw_entity_mapping:
+                raw_entity_mapping[raw_name] = entity_name
+
+            if first_word not in first_word_map:
+                first_word_map[first_word] = [raw_name]
+            else:
+                originals = first_word_map[first_word]
+
+                if raw_name not in originals:
+                    first_word_map[first_word].append(raw_name)
+
+        single_inp_hl_entity_ls.append(single_sent_hl_entity_ls)
+
+    return single_inp_hl, single_inp_hl_entity_ls, single_inp_clean, entity_counter
 
 
 def machine_ready(args, train, dev, test, vocab, count, placeholder, unk):
@@ -412,7 +573,7 @@ def machine_ready(args, train, dev, test, vocab, count, placeholder, unk):
     seqs_test_hl, seqs_test_e, seqs_clean_test, entity_counter = seqs_hl(args, test[0], vocab, entity_set, entity_counter, raw_entity_mapping,
                                         first_word_map, 'test', placeholder, unk)
 
-    sorted_first_word_map = sort_entries(first_word_map)
+    entity_trie = build_entity_trie(first_word_map)
 
     print 'Train data indexing..'
     seqs_train_articles, seq_train_art_ents, seq_train_art_m, seq_train_chunks = seqs_art(args,
@@ -420,16 +581,16 @@ def machine_ready(args, train, dev, test, vocab, count, placeholder, unk):
                                                                                           vocab,
                                                                                           entity_set,
                                                                                           raw_entity_mapping,
-                                                                                          sorted_first_word_map,
+                                                                                          entity_trie,
                                                                                           unk)
     print 'Dev data indexing..'
     seqs_dev_articles, seq_dev_art_ents, seq_dev_art_raw, seq_dev_art_m, seq_dev_chunks = seqs_art(
         args, dev[1], vocab, entity_set, raw_entity_mapping,
-        sorted_first_word_map, unk, return_r=True)
+        entity_trie, unk, return_r=True)
     print 'Test data indexing..'
     seqs_test_articles, seq_test_art_ents, seq_test_art_raw, seq_test_art_m, seq_test_chunks = seqs_art(
         args, test[1], vocab, entity_set, raw_entity_mapping,
-        sorted_first_word_map, unk, return_r=True)
+        entity_trie, unk, return_r=True)
 
     filename_train = args.train if args.full_test else "small_" + args.train
     filename_train = args.source + '_' + str(count) + '_' + filename_train
@@ -494,6 +655,76 @@ def machine_ready(args, train, dev, test, vocab, count, placeholder, unk):
     ofp_entities.close()
 
 
+def machine_ready_stream(args, spools, vocab, count, placeholder, unk):
+    entity_set = dict()
+    raw_entity_mapping = dict()
+    first_word_map = dict()
+
+    entity_counter = 0
+
+    # every highlight has to be seen before articles can be matched against the entity tables
+    for type, spool in zip(['Train', 'Dev', 'Test'], spools):
+        print type, 'data NER HL proc..'
+
+        for story in record_io.iter_jsonl(spool):
+            _, _, _, entity_counter = index_hl(args, story['hl'], vocab, entity_set, entity_counter,
+                                               raw_entity_mapping, first_word_map, placeholder, unk)
+
+    entity_trie = build_entity_trie(first_word_map)
+
+    for type, filename, spool in zip(['train', 'dev', 'test'], [args.train, args.dev, args.test], spools):
+        print type, 'data indexing..'
+
+        filename = filename if args.full_test else "small_" + filename
+        filename = args.source + '_' + str(count) + '_' + filename
+
+        return_r = type != 'train'
+
+        keys = ['x', 'y', 'e', 'sha', 'clean_y', 'chunk']
+
+        if type != 'test':
+            keys.append('valid_e')
+        if return_r:
+            keys.append('raw_x')
+
+        writer = record_io.open_writer(filename, args.data_format, dict((k, MACHINE_READY_FIELDS[k]) for k in keys))
+
+        for story in record_io.iter_jsonl(spool):
+            # entity tables are complete, so indexing a highlight again only looks ids up
+            hl, hl_e, clean_hl, _ = index_hl(args, story['hl'], vocab, entity_set, entity_counter,
+                                             raw_entity_mapping, first_word_map, placeholder, unk)
+            article, article_e, article_raw, _, chunks = index_article(args, story['article'], vocab, entity_set,
+                                                                       raw_entity_mapping, entity_trie,
+                                                                       unk, return_r)
+            record = dict()
+
+            record['x'] = article
+            record['y'] = hl
+            record['e'] = hl_e
+            record['sha'] = story['sha']
+            record['clean_y'] = clean_hl
+            record['chunk'] = chunks
+
+            if type != 'test':
+                record['valid_e'] = article_e
+            if return_r:
+                record['raw_x'] = article_raw
+
+            writer.write(record)
+
+        writer.close()
+
+    filename_entities = 'entities.json' if args.full_test else "small_entities.json"
+    filename_entities = args.source + '_' + str(count) + '_' + filename_entities
+
+    ofp_entities = open(filename_entities, 'w+')
+    final_json_entities = dict()
+    final_json_entities['entities'] = entity_set.items()
+
+    json.dump(final_json_entities, ofp_entities)
+    ofp_entities.close()
+
+
 def extract_tokens(args, document, hl, unique_words):
     article = []
 
@@ -501,7 +732,6 @@ def extract_tokens(args, document, hl, unique_words):
 
     for sent in document:
         tokens = sent['tokens']
-        tree = ParentedTree.fromstring(sent['parse'])
         s,  chunk_ls = [], []
 
         for token in tokens:
@@ -515,7 +745,7 @@ def extract_tokens(args, document, hl, unique_words):
             else:
                 unique_words[text_l] = 1
 
-        chunk_ls, num_l = dfs_nltk_tree(args, tree, args.chunk_threshold)
+        chunk_ls, num_l = chunk_parse(sent['parse'], args.chunk_threshold)
 
         if num_l != len(s):
             return None
@@ -563,29 +793,53 @@ def extract_tokens(args, document, hl, unique_words):
     return article
 
 
-def dfs_nltk_tree(args, tree, threshold=5):
+def chunk_parse(parse, threshold=5):
+    # pre-order list of the parse nodes: leaf count and end of subtree for brackets, text for leaves
+    counts, ends, leaves = [], [], []
     stack = []
-    subtrees = []
-    total = 0
-
-    stack.append(tree)
-
-    while len(stack) > 0:
 
-        item = stack.pop()
+    for token in PARSE_TOKEN_RE.findall(parse):
+        if token[0] == '(':
+            stack.append(len(counts))
+            counts.append(0)
+            ends.append(0)
+            leaves.append(None)
+        elif token == ')':
+            if len(stack) == 0:
+                raise ValueError('Unbalanced parse : ' + parse)
+
+            node = stack.pop()
+            ends[node] = len(counts)
+
+            if len(stack) > 0:
+                counts[stack[-1]] += counts[node]
+        else:
+            if len(stack) == 0:
+                raise ValueError('Leaf outside of parse : ' + parse)
 
-        if type(item) == ParentedTree:
-            num_l = len(item.leaves())
+            counts[stack[-1]] += 1
+            counts.append(None)
+            ends.append(None)
+            leaves.append(token)
 
-            if num_l <= threshold:
-                total += num_l
-                subtrees.append(num_l)
-                continue
+    if len(stack) > 0:
+        raise ValueError('Unbalanced parse : ' + parse)
 
-            for sub_t in item[::-1]:
-                stack.append(sub_t)
+    # same walk as a DFS over the tree: small enough subtrees become chunks, larger ones are opened up
+    subtrees = []
+    total = 0
+    i = 0
+
+    while i < len(counts):
+        if leaves[i] is not None:
+            subtrees.append(leaves[i])
+            i += 1
+        elif counts[i] <= threshold:
+            total += counts[i]
+            subtrees.append(counts[i])
+            i = ends[i]
         else:
-            subtrees.append(item)
+            i += 1
 
     return subtrees, total
 
@@ -618,41 +872,16 @@ def trim_chunk_ls(k, chunk_ls):
 
 
 def create_vocab_map(args, unique_w, count):
-    ofp = open(args.source + '_' + 'vocab_' + str(count) + '.txt', 'w+')
-    vocab_map = dict()
-    index = 0
-
-    inv_map = dict()
-
-    for k, v in unique_w.iteritems():
-        if v in inv_map:
-            inv_map[v].append(k)
-        else:
-            inv_map[v] = [k]
-
-    for c in sorted(inv_map.iterkeys(), reverse=True):
-        words = inv_map[c]
-
-        if index >= count:
-            break
+    top_words = vocab_io.top_k_words(unique_w, count)
+    vocab_io.write_vocab(args.source + '_' + 'vocab_' + str(count) + '.txt', top_words, count)
 
-        for w in words:
-            ofp.write(w + '\n')
-            vocab_map[w] = index
-            index += 1
-
-            if index >= count:
-                break
-
-    ofp.write('<padding>\n<unk>\n<placeholder>\n')
+    vocab_map = dict((w, index) for index, (w, _) in enumerate(top_words))
+    index = len(top_words)
 
     vocab_map['<padding>'] = index
     vocab_map['<unk>'] = unk = index + 1
     vocab_map['<placeholder>'] = placeholder = index + 2
 
-    index += 3
-
-    ofp.close()
     return vocab_map, placeholder, unk
 
 
@@ -730,27 +959,6 @@ def create_hl_vector(args, vocab, tokens_ls, unk):
     return vector
 
 
-def sort_entries(first_word_map):
-    new_first_word_map = dict()
-
-    for word, ls in first_word_map.iteritems():
-
-        new_ents = []
-        originals_as_ls = []
-
-        for entity in ls:
-            originals_as_ls.append(entity.split(' '))
-
-        sorted_ls = sorted(originals_as_ls, key=len, reverse=True)
-
-        for entity_ls in sorted_ls:
-            new_ents.append(' '.join(entity_ls))
-
-        new_first_word_map[word] = new_ents
-
-    return new_first_word_map
-
-
 def find_dependencies(basic_dep, tokens):
     found_ls = []
 
@@ -0,0 +1,335 @@
+import itertools
+import json
+import os
+
+import numpy as np
+
+
+FORMAT_EXTENSIONS = {'json': '.json', 'jsonl': '.jsonl', 'columnar': '.col'}
+
+# records buffered by a ColumnWriter before its arrays are appended to disk
+COLUMN_FLUSH_RECORDS = 1024
+
+
+def format_filename(filename, data_format):
+    if data_format == 'json':
+        return filename
+
+    return os.path.splitext(filename)[0] + FORMAT_EXTENSIONS[data_format]
+
+
+class JsonlWriter(object):
+    '''
+        Writes one JSON record per line, so records can be dumped as soon as
+        they are produced and read back one at a time.
+    '''
+
+    def __init__(self, filename):
+        self.ofp = open(filename, 'w+')
+
+    def write(self, record):
+        self.ofp.write(json.dumps(record))
+        self.ofp.write('\n')
+
+    def close(self):
+        self.ofp.close()
+
+
+def iter_jsonl(filename):
+    with open(filename, 'rb') as ifp:
+        for line in ifp:
+            yield json.loads(line)
+
+
+class JsonWriter(object):
+    '''
+        Gathers the records into one list per key, dumped as a single json
+        document on close, as the json format is read back by load_columns.
+    '''
+
+    def __init__(self, filename, keys):
+        self.filename = filename
+        self.columns = dict((k, []) for k in keys)
+
+    def write(self, record):
+        for k, column in self.columns.iteritems():
+            column.append(record[k])
+
+    def close(self):
+        with open(self.filename, 'w+') as ofp:
+            json.dump(self.columns, ofp)
+
+
+class JsonlRecords(object):
+    '''
+        The records of a jsonl file. Iterating streams the file again, indexing
+        seeks to the line of the record : only the byte offset of each line is
+        kept, scanned when first needed or with the lengths of len_key.
+    '''
+
+    def __init__(self, filename, keys, len_key=None):
+        self.filename = filename
+        self.keys = keys
+        self.offsets = None
+        self.lengths = None
+
+        self.ifp = None
+        self.pid = None
+
+        if len_key is not None:
+            self.index(len_key)
+
+    def index(self, len_key=None):
+        self.offsets = []
+        lengths = []
+
+        pos = 0
+
+        with open(self.filename, 'rb') as ifp:
+            for line in ifp:
+                self.offsets.append(pos)
+                pos += len(line)
+
+                if len_key is not None:
+                    lengths.append(len(json.loads(line)[len_key]))
+
+        if len_key is not None:
+            self.lengths = lengths
+
+    def __len__(self):
+        if self.offsets is None:
+            self.index()
+
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if self.offsets is None:
+            self.index()
+
+        # forked workers share the parent's file position, so each process seeks its own handle
+        if self.pid != os.getpid():
+            self.ifp = open(self.filename, 'rb')
+            self.pid = os.getpid()
+
+        self.ifp.seek(self.offsets[i])
+        record = json.loads(self.ifp.readline())
+
+        return dict((k, record[k]) for k in self.keys)
+
+    def __iter__(self):
+        for record in iter_jsonl(self.filename):
+            yield dict((k, record[k]) for k in self.keys)
+
+
+class ColumnRecords(object):
+    '''
+        Records of columns loaded or memory mapped whole by load_columns.
+    '''
+
+    def __init__(self, columns, keys, len_key=None):
+        self.columns = columns
+        self.keys = keys
+        self.lengths = None
+
+        if len_key is not None:
+            column = columns[len_key]
+
+            if isinstance(column, RaggedColumn):
+                self.lengths = np.diff(column.offsets[0]).tolist()
+            else:
+                self.lengths = [len(value) for value in column]
+
+    def __len__(self):
+        return len(self.columns[self.keys[0]])
+
+    def __getitem__(self, i):
+        return dict((k, self.columns[k][i]) for k in self.keys)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+def open_records(filename, data_format, keys, len_key=None):
+    '''
+        The records of a file, as dicts of keys, by index or in order. Only json
+        loads them all, columnar maps them and jsonl parses a record when it is
+        read. With len_key, lengths holds the length of that field per record.
+    '''
+    if data_format == 'jsonl':
+        return JsonlRecords(format_filename(filename, data_format), keys, len_key)
+
+    return ColumnRecords(load_columns(filename, data_format, keys), keys, len_key)
+
+
+def open_writer(filename, data_format, fields):
+    '''
+        Record writer for data_format, fields maps each record key to its
+        (dtype, depth) for the columnar format. json holds the records until
+        close, the other formats write them as they come.
+    '''
+    filename = format_filename(filename, data_format)
+
+    if data_format == 'columnar':
+        return ColumnWriter(filename, fields)
+    elif data_format == 'json':
+        return JsonWriter(filename, fields.keys())
+
+    return JsonlWriter(filename)
+
+
+def load_columns(filename, data_format, keys):
+    # json and columnar only, see open_records for jsonl
+    if data_format == 'columnar':
+        return read_column_dir(format_filename(filename, data_format), keys)
+
+    with open(filename, 'rb') as ifp:
+        return json.load(ifp)
+
+
+class RaggedColumnWriter(object):
+    '''
+        Appends the values of one field, nested depth lists deep, to flat arrays :
+        an int64 offset array per list level and the int32 leaf values. Strings
+        are one more level, of utf-8 bytes.
+    '''
+
+    def __init__(self, prefix, dtype, depth):
+        self.is_str = dtype == 'str'
+        self.levels = depth + 1 if self.is_str else depth
+
+        self.totals = [0] * self.levels
+        self.offsets = [[0] for _ in xrange(self.levels)]
+        self.values = []
+
+        self.offset_files = [open(prefix + '.off' + str(level) + '.bin', 'wb') for level in xrange(self.levels)]
+        self.values_file = open(prefix + '.values.bin', 'wb')
+
+    def append(self, value, level=0):
+        if level == self.levels - 1:
+            if self.is_str and isinstance(value, unicode):
+                value = value.encode('utf-8')
+
+            self.values.append(value)
+        else:
+            for child in value:
+                self.append(child, level + 1)
+
+        self.totals[level] += len(value)
+        self.offsets[level].append(self.totals[level])
+
+    def flush(self):
+        for ofp, offsets in zip(self.offset_files, self.offsets):
+            np.asarray(offsets, dtype='<i8').tofile(ofp)
+
+        if self.is_str:
+            self.values_file.write(''.join(self.values))
+        else:
+            np.fromiter(itertools.chain.from_iterable(self.values), dtype='<i4').tofile(self.values_file)
+
+        self.offsets = [[] for _ in xrange(self.levels)]
+        self.values = []
+
+    def close(self):
+        self.flush()
+
+        for ofp in self.offset_files:
+            ofp.close()
+
+        self.values_file.close()
+
+
+class ColumnWriter(object):
+    '''
+        Writes records to a directory holding one set of ragged arrays per field
+        (see RaggedColumnWriter) and a meta.json with the field layout, so the
+        reader can memory map them instead of parsing.
+    '''
+
+    def __init__(self, dirname, fields):
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.dirname = dirname
+        self.fields = fields
+        self.num_records = 0
+
+        self.columns = dict((name, RaggedColumnWriter(os.path.join(dirname, name), dtype, depth))
+                            for name, (dtype, depth) in fields.iteritems())
+
+    def write(self, record):
+        for name, column in self.columns.iteritems():
+            column.append(record[name])
+
+        self.num_records += 1
+
+        if self.num_records % COLUMN_FLUSH_RECORDS == 0:
+            for column in self.columns.itervalues():
+                column.flush()
+
+    def close(self):
+        for column in self.columns.itervalues():
+            column.close()
+
+        with open(os.path.join(self.dirname, 'meta.json'), 'w+') as ofp:
+            json.dump({'num_records': self.num_records, 'fields': self.fields}, ofp)
+
+
+def memmap_array(filename, dtype):
+    # np.memmap refuses empty files
+    if os.path.getsize(filename) == 0:
+        return np.zeros((0,), dtype=dtype)
+
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+
+class RaggedColumn(object):
+    '''
+        Read side of RaggedColumnWriter. Indexing a record gives nested lists
+        down to the last level, which is an int32 view into the memory mapped
+        values, or a unicode string.
+    '''
+
+    def __init__(self, prefix, dtype, depth):
+        self.is_str = dtype == 'str'
+        self.levels = depth + 1 if self.is_str else depth
+
+        self.offsets = [memmap_array(prefix + '.off' + str(level) + '.bin', '<i8') for level in xrange(self.levels)]
+        self.values = memmap_array(prefix + '.values.bin', 'u1' if self.is_str else '<i4')
+
+    def __len__(self):
+        return len(self.offsets[0]) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(0, j) for j in xrange(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError('Record index out of range')
+
+        return self.get(0, i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.get(0, i)
+
+    def get(self, level, i):
+        begin, end = self.offsets[level][i], self.offsets[level][i + 1]
+
+        if level < self.levels - 1:
+            return [self.get(level + 1, j) for j in xrange(begin, end)]
+
+        if self.is_str:
+            return self.values[begin:end].tostring().decode('utf-8')
+
+        return np.asarray(self.values[begin:end])
+
+
+def read_column_dir(dirname, keys):
+    with open(os.path.join(dirname, 'meta.json'), 'rb') as ifp:
+        meta = json.load(ifp)
+
+    return dict((k, RaggedColumn(os.path.join(dirname, k), *meta['fields'][k])) for k in keys)
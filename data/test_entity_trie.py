@@ -0,0 +1,76 @@
+import random
+import unittest
+
+from entity_trie import build_entity_trie, match_entities
+
+
+def scan_entities(first_word_map, sent):
+    '''
+        The article entity scan before the trie : the candidates listed under
+        each lowercased word, longest first, the first one found is kept.
+    '''
+    sorted_map = dict((word, sorted(ls, key=lambda e: len(e.split(' ')), reverse=True))
+                      for word, ls in first_word_map.iteritems())
+    found = []
+
+    for w in xrange(len(sent)):
+        word_l = sent[w].lower()
+
+        if word_l not in sorted_map:
+            continue
+
+        for raw_text_entity in sorted_map[word_l]:
+            text_ls = raw_text_entity.split(' ')
+            entity_found = True
+
+            for l in xrange(len(text_ls)):
+                if w + l >= len(sent) or sent[w + l] != text_ls[l]:
+                    entity_found = False
+                    break
+
+            if entity_found:
+                found.append(raw_text_entity)
+                break
+
+    return found
+
+
+class EntityTrieTest(unittest.TestCase):
+
+    def test_longest_match_at_each_position(self):
+        first_word_map = {'new': ['New', 'New York', 'New York Times'], 'york': ['York']}
+        trie = build_entity_trie(first_word_map)
+
+        sent = ['The', 'New', 'York', 'Times', 'and', 'New', 'York']
+
+        self.assertEqual(list(match_entities(trie, sent)), ['New York Times', 'York', 'New York', 'York'])
+
+    def test_case_and_key_must_match(self):
+        # listed under a key its first token does not lowercase to, as the scan never found it
+        first_word_map = {'paris': ['Paris'], 'london': ['Paris Hilton']}
+        trie = build_entity_trie(first_word_map)
+
+        self.assertEqual(list(match_entities(trie, ['paris', 'Paris', 'Hilton'])), ['Paris'])
+
+    def test_same_as_scan(self):
+        rng = random.Random(1234)
+        tokens = ['a', 'A', 'b', 'B', 'york', 'York', 'new', 'New', 'the']
+
+        for _ in xrange(300):
+            first_word_map = dict()
+
+            for _ in xrange(rng.randint(0, 12)):
+                entity = [rng.choice(tokens) for _ in xrange(rng.randint(1, 4))]
+                key = entity[0].lower() if rng.random() < 0.9 else rng.choice(tokens).lower()
+                first_word_map.setdefault(key, []).append(' '.join(entity))
+
+            trie = build_entity_trie(first_word_map)
+
+            for _ in xrange(10):
+                sent = [rng.choice(tokens) for _ in xrange(rng.randint(0, 15))]
+
+                self.assertEqual(list(match_entities(trie, sent)), scan_entities(first_word_map, sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
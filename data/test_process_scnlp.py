@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from nltk import ParentedTree
+
+from process_scnlp import chunk_parse
+
+
+PARSES = [
+    '(ROOT (S (NP (DT The) (NN cat)) (VP (VBD sat) (PP (IN on) (NP (DT the) (NN mat)))) (. .)))',
+    '(ROOT (NP (NNP Obama)))',
+    '(ROOT (S (NP (NNP Iraqi) (NNS forces)) (VP (VBD retook) (NP (NP (NNP Tikrit)) (, ,) (SBAR (WHNP (WDT which)) '
+    '(S (VP (VBD fell) (PP (IN in) (NP (CD 2014)))))))) (. .)))',
+    '(ROOT (S (-LRB- -LRB-) (NP (PRP it)) (-RRB- -RRB-) (VP (VBZ is) (ADJP (RB not) (JJ $5.00))) (: ;) (. !)))',
+]
+
+
+def dfs_nltk_tree(tree, threshold=5):
+    '''
+        The chunking of extract_tokens before chunk_parse, over an nltk tree.
+    '''
+    stack = [tree]
+    subtrees = []
+    total = 0
+
+    while len(stack) > 0:
+        item = stack.pop()
+
+        if type(item) == ParentedTree:
+            num_l = len(item.leaves())
+
+            if num_l <= threshold:
+                total += num_l
+                subtrees.append(num_l)
+                continue
+
+            for sub_t in item[::-1]:
+                stack.append(sub_t)
+        else:
+            subtrees.append(item)
+
+    return subtrees, total
+
+
+def random_parse(rng, depth=0):
+    if depth > 5 or rng.random() < 0.3:
+        return '(%s %s)' % (rng.choice(['NN', 'DT', 'VB', '.']), rng.choice(['a', 'cat', 'sat', '.', 'U.S.']))
+
+    children = ' '.join(random_parse(rng, depth + 1) for _ in xrange(rng.randint(1, 4)))
+
+    return '(%s %s)' % (rng.choice(['S', 'NP', 'VP', 'PP']), children)
+
+
+class ChunkParseTest(unittest.TestCase):
+
+    def assert_same_chunks(self, parse):
+        tree = ParentedTree.fromstring(parse)
+
+        for threshold in xrange(10):
+            self.assertEqual(chunk_parse(parse, threshold), dfs_nltk_tree(tree, threshold))
+
+    def test_corenlp_parses(self):
+        for parse in PARSES:
+            self.assert_same_chunks(parse)
+
+    def test_random_parses(self):
+        rng = random.Random(4321)
+
+        for _ in xrange(500):
+            self.assert_same_chunks('(ROOT %s)' % random_parse(rng))
+
+    def test_unbalanced_parse(self):
+        self.assertRaises(ValueError, chunk_parse, '(ROOT (NP (NN cat))')
+        self.assertRaises(ValueError, chunk_parse, '(ROOT (NN cat)))')
+
+
+if __name__ == '__main__':
+    unittest.main()
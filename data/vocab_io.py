@@ -0,0 +1,139 @@
+import heapq
+import os
+
+import numpy as np
+
+
+VOCAB_MAGIC = 'VOCABBN1'
+SPECIAL_WORDS = ['<padding>', '<unk>', '<placeholder>']
+
+
+def add_word_counts(word_counts, words):
+    for word, c in words:
+        if word in word_counts:
+            word_counts[word] += c
+        else:
+            word_counts[word] = c
+
+
+def top_k_words(word_counts, k):
+    # most frequent first, ties broken by the word itself
+    return heapq.nsmallest(k, word_counts.iteritems(), key=lambda (w, c): (-c, w))
+
+
+def vocab_bin_filename(filename):
+    return os.path.splitext(filename)[0] + '.bin'
+
+
+def normalize_word(word):
+    # as a line of the text vocab file is read
+    return word.rstrip()
+
+
+def write_vocab(filename, top_words, vocab_size):
+    '''
+        Writes the vocab as text, one word per line, followed by the special
+        tokens, plus a binary copy with the counts next to it (see read_vocab_bin).
+    '''
+    words = [w.encode('utf-8') if isinstance(w, unicode) else w for w, _ in top_words] + SPECIAL_WORDS
+    counts = np.asarray([c for _, c in top_words] + [0] * len(SPECIAL_WORDS), dtype='<i8')
+
+    ofp = open(filename, 'w+')
+    ofp.write(''.join(w + '\n' for w in words))
+    ofp.close()
+
+    # the words as the text reader gives them back
+    words = [normalize_word(w) for w in words]
+    blob = ''.join(w + '\n' for w in words)
+
+    # start of each word in the blob, and the end of the last one
+    offsets = np.cumsum([0] + [len(w) + 1 for w in words], dtype='<i8')
+
+    ofp = open(vocab_bin_filename(filename), 'wb')
+
+    ofp.write(VOCAB_MAGIC)
+    ofp.write(np.asarray([vocab_size, len(words), len(blob)], dtype='<i8').tostring())
+    ofp.write(counts.tostring())
+    ofp.write(offsets.tostring())
+    ofp.write(blob)
+
+    ofp.close()
+
+
+class MappedVocab(object):
+    '''
+        The words and counts of a binary vocab file, memory mapped. Indexing
+        slices one word out of the blob, iterating reads the blob once.
+    '''
+
+    def __init__(self, counts, offsets, blob):
+        self.counts = counts
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError('Vocab index out of range')
+
+        # without the newline
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1].tostring()
+
+    def __iter__(self):
+        text = self.blob.tostring()
+        offsets = self.offsets.tolist()
+
+        return (text[offsets[i]:offsets[i + 1] - 1] for i in xrange(len(self)))
+
+
+def read_vocab_bin(filename, vocab_size):
+    '''
+        Layout : magic, [vocab size, num words, blob length] int64, counts int64
+        x num words, offsets int64 x (num words + 1), newline terminated utf-8
+        words.
+
+        Returns the MappedVocab of the file, ValueError if it is not a binary
+        vocab of vocab_size words.
+    '''
+    mm = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    if mm[:len(VOCAB_MAGIC)].tostring() != VOCAB_MAGIC:
+        raise ValueError('Not a binary vocab file : ' + filename)
+
+    start = len(VOCAB_MAGIC)
+    file_vocab_size, num_words, blob_len = mm[start:start + 24].view('<i8')
+
+    if file_vocab_size != vocab_size:
+        raise ValueError('Binary vocab of ' + str(file_vocab_size) + ' words : ' + filename)
+
+    start += 24
+    counts = mm[start:start + 8 * num_words].view('<i8')
+
+    start += 8 * num_words
+    offsets = mm[start:start + 8 * (num_words + 1)].view('<i8')
+
+    start += 8 * (num_words + 1)
+
+    return MappedVocab(counts, offsets, mm[start:start + blob_len])
+
+
+def read_vocab(filename, vocab_size):
+    '''
+        Vocab words of the text vocab file, from its binary copy when there is
+        one for vocab_size words.
+    '''
+    bin_filename = vocab_bin_filename(filename)
+
+    if os.path.exists(bin_filename):
+        try:
+            return read_vocab_bin(bin_filename, vocab_size)
+        except ValueError:
+            pass
+
+    with open(filename, 'r') as ifp:
+        return [normalize_word(line) for line in ifp]
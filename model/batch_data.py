@@ -1,42 +1,38 @@
+import collections
 import json
+import multiprocessing
 from nltk.tokenize import RegexpTokenizer
 import numpy as np
 import random
 from datetime import datetime
 import os
+import shutil
 
+import shard_io
 import summarization_args
+from data import record_io
+from data import vocab_io
+
+# data for create_batch_file, set by create_batches before the worker pool is forked
+batch_job = None
 
 
 def read_docs(args, type_):
     filename = type_ + '_model.json' if args.full_test else "small_" + type_ + '_model.json'
     filename = '../data/'+ args.source + '_' + str(args.vocab_size) + '_' + filename
 
-    with open(filename, 'rb') as data_file:
-        data = json.load(data_file)
-
-    ret_data = [data['x'], data['y'], data['e'], data['clean_y'], data['sha'], None, data['chunk'], data['scut']]
+    keys = ['x', 'y', 'e', 'clean_y', 'sha', 'chunk', 'scut']
 
     if type_ != 'train':
-        ret_data.append(data['raw_x'])
-    else:
-        ret_data.append(None)
+        keys.append('raw_x')
 
-    return ret_data
+    # articles are read as batches need them, see record_io.open_records
+    return record_io.open_records(filename, args.data_format, keys, 'x')
 
 
 def create_vocab(args):
-    vocab_map = dict()
-    vocab_ls = []
-
-    ifp = open('../data/' + str(args.source) + '_vocab_' + str(args.vocab_size) + '.txt', 'r')
-
-    for line in ifp:
-        w = line.rstrip()
-        vocab_map[w] = len(vocab_map)
-        vocab_ls.append(w)
-
-    ifp.close()
+    vocab_ls = vocab_io.read_vocab('../data/' + str(args.source) + '_vocab_' + str(args.vocab_size) + '.txt', args.vocab_size)
+    vocab_map = dict((w, i) for i, w in enumerate(vocab_ls))
 
     return vocab_map, vocab_ls
 
@@ -58,110 +54,258 @@ def create_stopwords(args, vocab_map, lst_words):
     tokenizer = RegexpTokenizer(r'\w+')
 
     # add punctuation
-    for i in xrange(len(lst_words)):
-        w = lst_words[i]
+    for i, w in enumerate(lst_words):
 
         if len(tokenizer.tokenize(w)) == 0:
             punctuation.add(i)
 
     record_stopwords(stopwords, punctuation, lst_words)
 
-    return stopwords, punctuation
+    # lookup tables indexed by token id
+    stopword_table = np.zeros((len(lst_words),), dtype=bool)
+    stopword_table[list(stopwords)] = True
 
+    punctuation_table = np.zeros((len(lst_words),), dtype=bool)
+    punctuation_table[list(punctuation)] = True
 
-def create_batches(args, x, y, entities, sentence_sizes, clean_indexed_y, sha, chunk_sizes, raw_x, padding_id,
-                   stopwords, sort=True, model_type=''):
+    return stopword_table, punctuation_table
 
-    batch_size = args.batch
-    batches_x, batches_y, batches_entities, batches_overlap_mask, batches_sha = [], [], [], [], []
-    batches_raw_x, batches_fw_m, batches_chunk_sizes, batches_sentence_idx = [], [], [], []
 
-    N = len(x)
-    M = (N - 1) / batch_size + 1
-    num_batches = 0
-    num_files = 0
+def create_batches(args, records, padding_id, stopwords, sort=True, model_type=''):
+    global batch_job
 
-    if sort is not None:
-        if sort == 'sort':
-            perm = range(N)
-            perm = sorted(perm, key=lambda i: len(x[i]))
-        elif sort == 'shuffle':
-            random.seed(datetime.now())
+    lengths = records.lengths
+    perm = order_articles(lengths, sort)
+    bounds = plan_batches(args, [lengths[i] for i in perm])
+    num_files = (len(bounds) - 1) / args.online_batch_size + 1
 
-            perm = range(N)
-            random.shuffle(perm)
+    batch_job = (args, records, padding_id, stopwords, perm, bounds, args.batch_dir + args.source + model_type)
 
-        else:
-            raise NotImplementedError
-
-        x = [x[i] for i in perm]
-        y = [y[i] for i in perm]
-        entities = [entities[i] for i in perm]
-        sentence_sizes = [sentence_sizes[i] for i in perm]
-        clean_indexed_y = [clean_indexed_y[i] for i in perm]
-        chunk_sizes = [chunk_sizes[i] for i in perm]
-        sha = [sha[i] for i in perm]
-
-        if raw_x is not None:
-            raw_x = [raw_x[i] for i in perm]
-
-    for i in xrange(M):
-        single_batch_x, single_batch_y, single_batch_overlap_mask, single_batch_fw_m, single_batch_chunk_sizes, single_batch_sentence_idx = create_one_batch(
-            args,
-            x[i * batch_size:(i + 1) * batch_size],
-            y[i * batch_size:(i + 1) * batch_size],
-            sentence_sizes[i * batch_size:(i + 1) * batch_size],
-            clean_indexed_y[i * batch_size:(i + 1) * batch_size],
-            chunk_sizes[i * batch_size:(i + 1) * batch_size],
-            padding_id,
-            stopwords
-        )
-        single_batch_sha = sha[i * batch_size:(i + 1) * batch_size]
-        single_batch_entities = entities[i * batch_size:(i + 1) * batch_size]
-
-        batches_x.append(single_batch_x)
-        batches_y.append(single_batch_y)
-        batches_entities.append(single_batch_entities)
-        batches_overlap_mask.append(single_batch_overlap_mask)
-        batches_sha.append(single_batch_sha)
-        batches_fw_m.append(single_batch_fw_m)
-        batches_chunk_sizes.append(single_batch_chunk_sizes)
-        batches_sentence_idx.append(single_batch_sentence_idx)
-
-        if raw_x is not None:
-            single_batch_raw_x = raw_x[i * batch_size:(i + 1) * batch_size]
-            batches_raw_x.append(single_batch_raw_x)
-
-        num_batches += 1
-
-        if num_batches >= args.online_batch_size or i == M - 1:
-            fname = args.batch_dir + args.source + model_type
-            print 'Creating file #', str(num_files + 1)
-
-            data = [batches_x, batches_y, batches_entities, batches_overlap_mask, batches_sha]
-
-            if raw_x is not None:
-                data.append(batches_raw_x)
-
-            data.extend([batches_fw_m, batches_chunk_sizes, batches_sentence_idx])
-
-            with open(fname + str(num_files), 'w+') as ofp:
-                np.save(ofp, data)
-
-            batches_x, batches_y, batches_entities, batches_overlap_mask, batches_sha = [], [], [], [], []
-            batches_raw_x, batches_fw_m, batches_chunk_sizes, batches_sentence_idx = [], [], [], []
-
-            num_batches = 0
-            num_files += 1
+    if args.num_workers > 1:
+        # forked after batch_job is set, so the workers share the article index instead of pickling it
+        pool = multiprocessing.Pool(args.num_workers)
+
+        for _ in pool.imap_unordered(create_batch_file, xrange(num_files)):
+            pass
+
+        pool.close()
+        pool.join()
+    else:
+        for file_idx in xrange(num_files):
+            create_batch_file(file_idx)
+
+    batch_job = None
 
     print "Num Files :", num_files
 
 
-def create_one_batch(args, lst_x, lst_y, lst_sentence_sizes, lst_clean_y, lst_chunk_sizes, padding_id, stopwords):
-    max_len = args.inp_len
+def order_articles(lengths, sort):
+    N = len(lengths)
+
+    if sort is None:
+        return range(N)
+
+    if sort == 'sort':
+        perm = range(N)
+        perm = sorted(perm, key=lambda i: lengths[i])
+    elif sort == 'shuffle':
+        random.seed(datetime.now())
+
+        perm = range(N)
+        random.shuffle(perm)
+
+    else:
+        raise NotImplementedError
+
+    return perm
+
+
+def plan_batches(args, lengths):
+    '''
+        (start, end) of each batch over articles of the given lengths : args.batch
+        articles each, or with args.token_budget as many consecutive articles as
+        fit in the budget once padded (at least one).
+    '''
+    if args.token_budget <= 0:
+        return [(i, min(i + args.batch, len(lengths))) for i in xrange(0, len(lengths), args.batch)]
+
+    bounds = []
+    start = 0
+    max_len = 0
+
+    for i in xrange(len(lengths)):
+        # the length the article would be padded to, see create_one_batch
+        cur_len = min(args.inp_len, lengths[i]) if args.bucket else args.inp_len
+
+        if i > start and (i - start + 1) * max(max_len, cur_len) > args.token_budget:
+            bounds.append((start, i))
+            start = i
+            max_len = 0
+
+        max_len = max(max_len, cur_len)
+
+    if start < len(lengths):
+        bounds.append((start, len(lengths)))
+
+    return bounds
+
+
+def create_batch(job, idx):
+    '''
+        The batch of articles idx, with one entry per field of myio.load_batches.
+    '''
+    args, records, padding_id, stopwords = job[:4]
+
+    # only the articles of this batch are read
+    articles = [records[i] for i in idx]
+
+    single_batch_x, single_batch_y, single_batch_overlap_mask, single_batch_fw_m, single_batch_chunk_sizes, single_batch_sentence_idx = create_one_batch(
+        args,
+        [a['x'] for a in articles],
+        [a['y'] for a in articles],
+        [a['scut'] for a in articles],
+        [a['clean_y'] for a in articles],
+        [a['chunk'] for a in articles],
+        padding_id,
+        stopwords
+    )
+
+    batch = [single_batch_x, single_batch_y, [a['e'] for a in articles], single_batch_overlap_mask,
+             [a['sha'] for a in articles]]
+
+    if 'raw_x' in records.keys:
+        batch.append([a['raw_x'] for a in articles])
+
+    batch.extend([single_batch_fw_m, single_batch_chunk_sizes, single_batch_sentence_idx])
+
+    return batch
+
+
+def create_job_batch(idx):
+    return create_batch(batch_job, idx)
+
+
+def create_batch_file(file_idx):
+    args, records, perm, bounds, fname = batch_job[0], batch_job[1], batch_job[4], batch_job[5], batch_job[6]
+
+    batches = [create_batch(batch_job, perm[start:end])
+               for start, end in bounds[file_idx * args.online_batch_size:(file_idx + 1) * args.online_batch_size]]
+
+    # one list of batches per field
+    data = [list(field) for field in zip(*batches)]
+
+    print 'Creating file #', str(file_idx + 1)
+
+    if args.batch_format == 'shard':
+        names = ['x', 'y', 'e', 'bm', 'sha'] + (['raw_x'] if 'raw_x' in records.keys else []) + ['fw', 'csz', 'bpi']
+        fields = dict(zip(names, data))
+
+        arrays = dict((name, fields[name]) for name in ['x', 'y', 'bm', 'fw', 'csz', 'bpi'])
+        lists = dict((name, fields[name]) for name in ['e', 'sha', 'raw_x'] if name in fields)
+
+        shard_io.write_shard(fname + str(file_idx), arrays, lists)
+    else:
+        if os.path.isdir(fname + str(file_idx)):
+            shutil.rmtree(fname + str(file_idx))
+
+        with open(fname + str(file_idx), 'w+') as ofp:
+            np.save(ofp, data)
+
+
+class OnlineBatcher(object):
+    '''
+        The batches of one split built from the model ready data while training,
+        instead of read from batch files written by main. Same batches and layout
+        as the files, with args.num_workers > 1 they are built in worker processes.
+    '''
+
+    def __init__(self, args, type_, padding_id, stopwords, sort=None):
+        global batch_job
+
+        records = read_docs(args, type_)
+
+        self.args = args
+        self.lengths = records.lengths
+        self.perm = order_articles(self.lengths, sort)
+        self.bounds = plan_batches(args, [self.lengths[i] for i in self.perm])
+        self.num_files = (len(self.bounds) - 1) / args.online_batch_size + 1
+
+        self.job = (args, records, padding_id, stopwords)
+
+        self.pool = None
+
+        if args.num_workers > 1:
+            # the workers are forked with the article index of this split, only article indices are sent to them
+            batch_job = self.job
+            self.pool = multiprocessing.Pool(args.num_workers)
+            batch_job = None
+
+    def set_order(self, perm):
+        '''
+            Batches the articles in the order of perm instead, e.g. the order of a
+            training state saved with --sort shuffle.
+        '''
+        self.perm = perm
+        self.bounds = plan_batches(self.args, [self.lengths[i] for i in perm])
+        self.num_files = (len(self.bounds) - 1) / self.args.online_batch_size + 1
+
+    def iter_batches(self, shuffle=False, start=0):
+        '''
+            Yields (i, j, batch) as myio.iter_batches, for i, j the file and
+            position the batch would have in the batch files. The first start
+            batches are skipped, after the same shuffle.
+        '''
+        order = range(len(self.bounds))
+
+        if shuffle:
+            random.shuffle(order)
+
+        tasks = (self.perm[self.bounds[k][0]:self.bounds[k][1]] for k in order[start:])
+
+        if self.pool is not None:
+            batches = self.iter_pool_batches(tasks)
+        else:
+            batches = (create_batch(self.job, idx) for idx in tasks)
+
+        for k, batch in enumerate(batches, start):
+            yield k / self.args.online_batch_size, k % self.args.online_batch_size, batch
+
+    def iter_pool_batches(self, tasks):
+        '''
+            The batches of tasks built by the workers, in order, with at most about
+            args.prefetch of them sent ahead (Pool.imap would build them all).
+        '''
+        window = max(getattr(self.args, 'prefetch', 20), self.args.num_workers)
+        pending = collections.deque()
+
+        for idx in tasks:
+            pending.append(self.pool.apply_async(create_job_batch, (idx,)))
+
+            if len(pending) >= window:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def batch_inputs(args):
+    '''
+        The padding id and stopword tables create_one_batch needs.
+    '''
+    vocab_map, lst_words = create_vocab(args)
 
+    return vocab_map["<padding>"], create_stopwords(args, vocab_map, lst_words)
+
+
+def create_one_batch(args, lst_x, lst_y, lst_sentence_sizes, lst_clean_y, lst_chunk_sizes, padding_id, stopwords):
     assert min(len(x) for x in lst_x) > 0
 
+    # pad to the longest article of the batch only, the model is length agnostic
+    if args.bucket:
+        max_len = min(args.inp_len, max(len(x) for x in lst_x))
+    else:
+        max_len = args.inp_len
+
     single_batch_y, unigrams = process_hl(args, lst_y, padding_id, lst_clean_y)
     single_batch_y = np.column_stack([y for y in single_batch_y])
 
@@ -176,7 +320,7 @@ def create_one_batch(args, lst_x, lst_y, lst_sentence_sizes, lst_clean_y, lst_ch
     if not args.word_level_c:
         single_batch_overlap_mask = create_chunk_masks(single_batch_overlap_mask, single_batch_chunk_sizes, max_len)
 
-    single_batch_overlap_mask = np.column_stack([m for m in single_batch_overlap_mask])
+    single_batch_overlap_mask = np.ascontiguousarray(single_batch_overlap_mask.T)
 
     single_batch_sentence_idx = sentence_indexing(lst_sentence_sizes, max_len)
 
@@ -290,143 +434,129 @@ def stack_p_vec(max_x, sent_bounds, x, padding_id):
     return np.column_stack([j for j in position_idx_batch]).astype('int32')
 
 
-def create_chunk_mask(lstch, max_len):
-    fw_mask_ls = []
-    mask_chunk_sizes = []
+def flatten_lists(lst):
+    '''
+        Values of a list of int lists as one int64 array, with the index of the
+        list each value came from and its position in that list.
+    '''
+    lengths = np.asarray([len(l) for l in lst], dtype=np.int64)
+    values = np.concatenate([np.asarray(l, dtype=np.int64) for l in lst])
 
-    for article in lstch:
-        num_w = 0
-        fw_mask = []
-        mask_csz = []
+    rows = np.repeat(np.arange(len(lst)), lengths)
+    positions = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
 
-        for c in article:
-            if c == 0:
-                continue
+    return values, rows, positions
 
-            if num_w + c <= max_len:
-                fw_mask.extend([0]*(c-1))
-                fw_mask.append(1)
-                mask_csz.append(c)
 
-                num_w += c
-            else:
-                if num_w == max_len:
-                    break
-                elif num_w < max_len:
-                    fw_mask.extend([0] * (max_len - (num_w + 1)))
-                    fw_mask.append(1)
+def create_chunk_mask(lstch, max_len):
+    chunks, articles, _ = flatten_lists(lstch)
+
+    non_empty = chunks > 0
+    chunks, articles = chunks[non_empty], articles[non_empty]
 
-                    mask_csz.append(max_len - num_w)
-                    break
+    # chunk boundaries within each article
+    counts = np.bincount(articles, minlength=len(lstch))
+    firsts = np.cumsum(counts) - counts
 
-        if len(fw_mask) < max_len:
-            # left = max_len - len(fw_mask)
-            fw_mask.extend([0] * (max_len - (len(fw_mask) + 1)))
-            fw_mask.append(1)
+    ends = np.cumsum(chunks)
+    begins = ends - chunks
+    offsets = np.repeat(begins[firsts[counts > 0]], counts[counts > 0])
 
-            # mask_csz.append(left)
+    ends -= offsets
+    begins -= offsets
+    ranks = np.arange(len(chunks)) - np.repeat(firsts, counts)
 
-        mask_csz.extend([0]*(max_len - len(mask_csz)))
-        fw_mask_ls.append(fw_mask)
-        mask_chunk_sizes.append(mask_csz)
+    # chunks starting past max_len are dropped, the one crossing it is cut short
+    used = begins < max_len
+    ends = np.minimum(ends[used], max_len)
+    articles = articles[used]
 
-    fw_mask_ls = np.column_stack([x for x in fw_mask_ls]).astype('int32')
-    mask_chunk_sizes = np.column_stack([x for x in mask_chunk_sizes]).astype('int32')
+    fw_mask_ls = np.zeros((max_len, len(lstch)), dtype='int32')
+    fw_mask_ls[ends - 1, articles] = 1
+    fw_mask_ls[max_len - 1] = 1
+
+    mask_chunk_sizes = np.zeros((max_len, len(lstch)), dtype='int32')
+    mask_chunk_sizes[ranks[used], articles] = ends - begins[used]
 
     return fw_mask_ls, mask_chunk_sizes
 
 
 def sentence_indexing(lstsc, max_len):
-    indexed_x = []
+    sizes, articles, sentences = flatten_lists(lstsc)
 
-    for x in lstsc:
-        single_doc = []
-        total_w = 0
+    # every word gets the 1 based index of its sentence
+    word_articles = np.repeat(articles, sizes)
+    word_sentences = np.repeat(sentences + 1, sizes)
 
-        for i in xrange(len(x)):
-            single_doc.extend([i+1]*x[i])
-            total_w +=x[i]
+    words = np.bincount(word_articles, minlength=len(lstsc))
+    positions = np.arange(len(word_articles)) - np.repeat(np.cumsum(words) - words, words)
 
-            if total_w >= max_len:
-                break
+    in_range = positions < max_len
 
-        indexed_x.append(single_doc)
+    indexed_x = np.zeros((max_len, len(lstsc)), dtype='int32')
+    indexed_x[positions[in_range], word_articles[in_range]] = word_sentences[in_range]
 
-    return np.column_stack([np.pad(x[:max_len], (0, max_len - len(x) if len(x) <= max_len else 0), "constant",
-                                   constant_values=0).astype('int32') for x in indexed_x])
+    return indexed_x
 
 
 def create_unigram_masks(lstx, unigrams, max_len, stopwords, args):
-    masks = []
+    stopword_table, punctuation_table = stopwords
+    vocab_size = len(stopword_table)
+    num_articles = len(lstx)
 
-    for i in xrange(len(lstx)):
-        len_x = len(lstx[i])
-        m = np.zeros((max_len,), dtype='int32')
+    # first max_len + 1 tokens of every article, so the last bigram can end past max_len
+    tokens, articles, positions = flatten_lists([x[:max_len + 1] for x in lstx])
 
-        for j in xrange(len_x - 1):
-            if j >= max_len:
-                break
-            w1 = lstx[i][j]
-            w2 = lstx[i][j+1]
+    x = np.zeros((num_articles, max_len + 1), dtype=np.int64)
+    x[articles, positions] = tokens
 
-            if w1 in unigrams[i] and w2 in unigrams[i]:
-                if contains_single_valid_word(w1, w2, stopwords):
-                    try:
-                        m[j] = 1
-                        m[j+1] = 1
-                    except IndexError:
-                        continue
+    in_article = np.zeros((num_articles, max_len + 1), dtype=bool)
+    in_article[articles, positions] = True
 
-        masks.append(m)
+    # highlight unigrams as article * vocab_size + token keys, one lookup for the batch
+    hl_tokens, hl_articles, _ = flatten_lists([list(u) for u in unigrams])
+    in_hl = in_article & np.isin(np.arange(num_articles)[:, None] * vocab_size + x,
+                                 hl_articles * vocab_size + hl_tokens)
 
-    return masks
-
-
-def create_chunk_masks(word_level_bm, bsz, max_len):
-    masks = []
-
-    for i in xrange(len(word_level_bm)):
-        m = []
-        chunks = bsz[:, i]
-        gs_words = word_level_bm[i]
-        end = 0
+    w1, w2 = x[:, :-1], x[:, 1:]
 
-        for c in chunks:
-            begin = end
-            end = begin + c
+    # bigrams of highlight words, without punctuation and not both stopwords
+    bigrams = in_hl[:, :-1] & in_hl[:, 1:] & \
+              ~punctuation_table[w1] & ~punctuation_table[w2] & \
+              ~(stopword_table[w1] & stopword_table[w2])
 
-            use_cur_chunk = False
+    masks = bigrams.copy()
+    masks[:, 1:] |= bigrams[:, :-1]
 
-            for j in range(begin, end):
-                if gs_words[j] > 0:
-                    use_cur_chunk = True
-                    break
+    return masks.astype('int32')
 
-            if use_cur_chunk:
-                cur_chunk = [1] * c
-            else:
-                cur_chunk = [0] * c
-            m.extend(cur_chunk)
 
-        if len(m) < max_len:
-            m.extend([0]*(max_len - len(m)))
+def create_chunk_masks(word_level_bm, bsz, max_len):
+    sizes = bsz.T.astype(np.int64)
+    num_articles = sizes.shape[0]
 
-        masks.append(m)
+    ends = np.cumsum(sizes, axis=1)
+    begins = ends - sizes
 
-    return np.asarray(masks, dtype='int32')
+    # a zero sentinel column keeps every chunk end inside its own article for reduceat
+    words = np.zeros((num_articles, max_len + 1), dtype=np.int64)
+    words[:, :max_len] = word_level_bm > 0
 
+    offsets = np.arange(num_articles)[:, None] * (max_len + 1)
+    bounds = np.column_stack([(begins + offsets).ravel(), (ends + offsets).ravel()]).ravel()
 
-def contains_single_valid_word(w1, w2, stopwords):
-    sw = stopwords[0]
-    punct = stopwords[1]
+    # reduceat gives the element itself for empty chunks, they cover no words anyway
+    use_chunk = np.add.reduceat(words.ravel(), bounds)[::2] > 0
 
-    if w1 in punct or w2 in punct:
-        return False
+    # every covered word takes its chunk's value
+    covered = ends[:, -1]
+    word_articles = np.repeat(np.arange(num_articles), covered)
+    positions = np.arange(len(word_articles)) - np.repeat(np.cumsum(covered) - covered, covered)
 
-    if w1 in sw and w2 in sw:
-        return False
+    masks = np.zeros((num_articles, max_len), dtype='int32')
+    masks[word_articles, positions] = np.repeat(use_chunk, sizes.ravel())
 
-    return True
+    return masks
 
 
 def process_ent(n_classes, lste):
@@ -498,41 +628,28 @@ def flatten_data(args, cur_data):
 
 
 def main(args):
-    vocab_map, lst_words = create_vocab(args)
-    stopwords = create_stopwords(args, vocab_map, lst_words)
+    pad_id, stopwords = batch_inputs(args)
 
     if not os.path.exists(args.batch_dir):
         os.makedirs(args.batch_dir)
 
-    pad_id = vocab_map["<padding>"]
-
-    del vocab_map
-    del lst_words
-
     type_ls = ['train', 'dev', 'test']
     sort_ls = [args.sort, None, None]
 
     for type_, sort in zip(type_ls, sort_ls):
         print type_, ':'
         print '  Read JSON..'
-        cur_data = read_docs(args, type_)
+        records = read_docs(args, type_)
 
         create_batches(args=args,
-                       x=cur_data[0],
-                       y=cur_data[1],
-                       entities=cur_data[2],
-                       sentence_sizes=cur_data[7],
-                       clean_indexed_y=cur_data[3],
-                       sha=cur_data[4],
-                       chunk_sizes=cur_data[6],
-                       raw_x=cur_data[8],
+                       records=records,
                        padding_id=pad_id,
                        stopwords=stopwords,
                        sort=sort,
                        model_type=type_)
 
         print '  Purge references..'
-        del cur_data
+        del records
         print '  Finished', type_
 
 
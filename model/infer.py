@@ -0,0 +1,65 @@
+import time
+
+import myio
+import summarization_args
+
+from nn.numpy_generator import load_generator
+from util import say
+
+
+def iter_test_batches(args):
+    '''
+        (num_files, batches) of the test split, as Model.iter_batches.
+    '''
+    if getattr(args, 'online', False):
+        import batch_data
+
+        padding_id, stopwords = batch_data.batch_inputs(args)
+        batcher = batch_data.OnlineBatcher(args, 'test', padding_id, stopwords)
+
+        return batcher.num_files, batcher.iter_batches(shuffle=False)
+
+    return args.num_files_test, myio.iter_batches(args.batch_dir + args.source + 'test', args.num_files_test)
+
+
+def main():
+    '''
+        main.py --test with the NumPy generator : no theano graph to build, the
+        saved args of the model are used as in Model.load_model.
+    '''
+    start_time = time.time()
+    generator, model_args = load_generator(args.save_model + args.load_model)
+    say("Generator loaded in {:.2f}s\n".format(time.time() - start_time))
+
+    test_z = []
+    x = []
+    y = []
+    e = []
+    sha_ls = []
+    chunk_ls = []
+
+    num_files, batches = iter_test_batches(model_args)
+
+    for i, j, batch in batches:
+        if j == 0:
+            print i, 'out of', num_files
+
+        bx, by, be, bm, sha, rx, bfw, bsc, bpi = batch
+        be, _ = myio.create_1h(be, model_args.n)
+
+        x.append(rx)
+        y.append(by)
+        e.append(be)
+        chunk_ls.append(bsc)
+
+        test_z.append(generator.forward(bx, bpi, bfw, bsc))
+        sha_ls.append(sha)
+
+    say("Test set scored in {:.2f}s\n".format(time.time() - start_time))
+
+    myio.save_test_results_rouge(model_args, test_z, x, y, e, sha_ls, None, chunk_ls)
+
+
+if __name__ == "__main__":
+    args = summarization_args.get_args()
+    main()
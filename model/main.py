@@ -1,9 +1,9 @@
-import cPickle as pickle
-import gzip
+import copy
 import json
 import os
 import time
 import random
+from collections import OrderedDict
 from datetime import datetime
 
 import numpy as np
@@ -11,13 +11,16 @@ import sklearn.metrics as sk
 import theano
 import theano.tensor as T
 
+import batch_data
 import myio
 import summarization_args
 
-from nn.optimization import create_optimization_updates
+from nn import initialization
+from nn.optimization import create_optimization_updates, get_shared
 from nn.generator import Generator
 from nn.encoder import Encoder
 from util import say
+from util import checkpoint_io
 
 
 class Model(object):
@@ -26,6 +29,46 @@ class Model(object):
         self.embedding_layer = embedding_layer
         self.embedding_layer_posit = embedding_layer_posit
         self.nclasses = nclasses
+        self.online_batchers = dict()
+
+    def online_batcher(self, type_):
+        # built on first use, before any prefetch thread, as the batcher may fork its workers
+        if type_ not in self.online_batchers:
+            if not self.online_batchers:
+                self.batch_inputs = batch_data.batch_inputs(self.args)
+
+            padding_id, stopwords = self.batch_inputs
+            sort = self.args.sort if type_ == 'train' else None
+
+            self.online_batchers[type_] = batch_data.OnlineBatcher(self.args, type_, padding_id, stopwords, sort)
+
+        return self.online_batchers[type_]
+
+    def num_files(self, type_):
+        if self.args.online:
+            return self.online_batcher(type_).num_files
+
+        return getattr(self.args, 'num_files_' + type_)
+
+    def iter_batches(self, type_, shuffle=False, n=None, start=0):
+        '''
+            (i, j, batch) over a split as myio.iter_batches, from args.batch_dir or
+            with --online built from the model ready data.
+        '''
+        if not self.args.online:
+            return myio.iter_batches(self.args.batch_dir + self.args.source + type_, self.num_files(type_),
+                                     shuffle=shuffle, n=n, start=start)
+
+        batches = self.online_batcher(type_).iter_batches(shuffle=shuffle, start=start)
+
+        if n is None:
+            return batches
+
+        return ((i, j, batch[:2] + [myio.create_1h(batch[2], n)] + batch[3:]) for i, j, batch in batches)
+
+    def batch_weight(self, bx):
+        # batches filled to --token_budget vary in size and count by their articles, fixed size ones once each
+        return bx.shape[1] if getattr(self.args, 'token_budget', 0) > 0 else 1
 
     def ready(self, inference=False):
         args, embedding_layer, embedding_layer_posit, nclasses = self.args, self.embedding_layer, self.embedding_layer_posit, self.nclasses
@@ -100,70 +143,40 @@ class Model(object):
         self.z = self.generator.non_sampled_zpred
         self.params = self.generator.params
 
-    def save_model(self, path, args, pretrain=False):
-        # append file suffix
-        if not path.endswith(".pkl.gz"):
-            if path.endswith(".pkl"):
-                path += ".gz"
-            else:
-                path += ".pkl.gz"
-
-        # output to path
-        with gzip.open(path, "wb") as fout:
-
-            if pretrain:
-                pickle.dump(
-                    ([x.get_value() for x in self.generator.params],  # generator
-                     args  # training configuration
-                     ),
-                    fout,
-                    protocol=pickle.HIGHEST_PROTOCOL
-                )
-            else:
-                pickle.dump(
-                    ([x.get_value() for x in self.encoder.params],  # encoder
-                     [x.get_value() for x in self.generator.params],  # generator
-                     args  # training configuration
-                     ),
-                    fout,
-                    protocol=pickle.HIGHEST_PROTOCOL
-                )
+    def save_model(self, path, args, pretrain=False, writer=None):
+        # get_value copies the params, the writer saves them while training goes on
+        generator = ('generator', [get_shared(x).get_value() for x in self.generator.params])
 
-    def load_model(self, path, test=False):
-        if not os.path.exists(path):
-            if path.endswith(".pkl"):
-                path += ".gz"
-            else:
-                path += ".pkl.gz"
+        if pretrain:
+            groups = [generator]
+        else:
+            groups = [('encoder', [get_shared(x).get_value() for x in self.encoder.params]), generator]
 
-        with gzip.open(path, "rb") as fin:
-            loaded = pickle.load(fin)
+        checkpoint_format = getattr(args, 'checkpoint_format', 'pkl')
 
-            eparams = loaded[0]
-            gparams = loaded[1]
-            args = loaded[2]
+        if writer is not None:
+            writer.submit(checkpoint_io.save_model, path, groups, args, checkpoint_format)
+            return checkpoint_io.model_path(path, checkpoint_format)
 
-            self.args = args
+        return checkpoint_io.save_model(path, groups, args, checkpoint_format)
+
+    def load_model(self, path, test=False):
+        eparams, gparams, args = checkpoint_io.load_model(path)
+
+        self.args = args
 
         if test:
             self.ready_test()
         else:
             self.ready(inference=True)
             for x, v in zip(self.encoder.params, eparams):
-                x.set_value(v)
+                get_shared(x).set_value(v)
 
         for x, v in zip(self.generator.params, gparams):
-            x.set_value(v)
+            get_shared(x).set_value(v)
 
     def load_model_pretrain(self, path, inference):
-        if not os.path.exists(path):
-            if path.endswith(".pkl"):
-                path += ".gz"
-            else:
-                path += ".pkl.gz"
-
-        with gzip.open(path, "rb") as fin:
-            gparams, args = pickle.load(fin)
+        gparams, args = checkpoint_io.load_model(path)
 
         if self.args.pretrain:
             self.nclasses = self.args.nclasses
@@ -183,7 +196,62 @@ class Model(object):
                 print len(self.generator.params), len(gparams)
                 gparams = gparams[:len(self.generator.params) - 2] + gparams[-2:]
             for x, v in zip(self.generator.params, gparams):
-                x.set_value(v)
+                get_shared(x).set_value(v)
+
+    def state_vars(self, *updates):
+        '''
+            The shared variables the training functions update (params, optimizer
+            accumulators and step counters, the rng of the sampler) and the rng of
+            the dropout masks.
+        '''
+        state_vars = OrderedDict()
+
+        for u in updates:
+            state_vars.update(u)
+
+        for update in initialization.default_srng.state_updates:
+            state_vars[update[0]] = update[1]
+
+        return state_vars.keys()
+
+    def save_state(self, path, state_vars, writer, **progress):
+        '''
+            Hands the values of state_vars, the progress of the training loop and
+            the article order of --online to writer.
+        '''
+        # the loop goes on filling its lists and dicts while the writer pickles them
+        state = dict((k, copy.copy(v)) for k, v in progress.iteritems())
+        state['stats'] = [copy.copy(v) for v in progress['stats']]
+
+        state['values'] = [v.get_value() for v in state_vars]
+        state['article_order'] = self.online_batcher('train').perm if self.args.online else None
+
+        writer.submit(checkpoint_io.save_state, path, state)
+
+    def resume_state(self, path, state_vars):
+        '''
+            Sets state_vars from a state of save_state and returns the rest of it,
+            None when there is no state to resume from.
+        '''
+        if not os.path.exists(path):
+            say("No training state {}, starting from the first epoch\n".format(path))
+            return None
+
+        state = checkpoint_io.load_state(path)
+
+        values = state.pop('values')
+        assert len(values) == len(state_vars), path + ' is the training state of another model'
+
+        for v, value in zip(state_vars, values):
+            v.set_value(value)
+
+        article_order = state.pop('article_order')
+        if article_order is not None:
+            self.online_batcher('train').set_order(article_order)
+
+        say("Resuming epoch {} after {} batches\n".format(state['epoch'] + 1, state['batches']))
+
+        return state
 
     def test(self):
         args = self.args
@@ -191,6 +259,7 @@ class Model(object):
 
         test_generator = theano.function(
             inputs=inputs_d,
+            givens=self.embedding_layer.givens(),
             outputs=self.generator.non_sampled_zpred,
             on_unused_input='ignore'
         )
@@ -206,6 +275,7 @@ class Model(object):
 
         eval_generator = theano.function(
             inputs=inputs_d,
+            givens=self.embedding_layer.givens(),
             outputs=[self.generator.non_sampled_zpred, self.encoder.obj, self.encoder.loss, self.encoder.preds_clipped],
             on_unused_input='ignore'
         )
@@ -251,6 +321,7 @@ class Model(object):
 
         eval_generator = theano.function(
             inputs=inputs_d,
+            givens=self.embedding_layer.givens(),
             outputs=outputs_d,
             updates=self.generator.sample_updates,
             on_unused_input='ignore'
@@ -258,6 +329,7 @@ class Model(object):
 
         train_generator = theano.function(
             inputs=inputs_t,
+            givens=self.embedding_layer.givens(),
             outputs=outputs_t,
             updates=updates_e.items() + updates_g.items() + self.generator.sample_updates,
             on_unused_input='ignore'
@@ -281,7 +353,24 @@ class Model(object):
 
         random.seed(datetime.now())
 
-        for epoch in xrange(args.max_epochs):
+        writer = myio.AsyncWriter(args.pending_saves)
+
+        state_vars = self.state_vars(updates_e, updates_g, self.generator.sample_updates) + [lr_e, lr_g]
+        state_file = args.save_model + myio.create_fname_identifier(args) + '.state'
+
+        resume = self.resume_state(state_file, state_vars) if args.resume else None
+        start_epoch = 0
+
+        if resume is not None:
+            start_epoch = resume['epoch']
+            # counted again as the epoch starts
+            unchanged = resume['unchanged'] - 1
+            best_dev = resume['best_dev']
+            last_train_avg_cost = resume['last_train_avg_cost']
+            last_dev_avg_cost = resume['last_dev_avg_cost']
+            json_train = resume['json_train']
+
+        for epoch in xrange(start_epoch, args.max_epochs):
             unchanged += 1
             more_count = 0
 
@@ -292,11 +381,12 @@ class Model(object):
 
             more = True
             if args.decay_lr:
-                param_bak = [p.get_value(borrow=False) for p in self.params]
+                param_bak = [get_shared(p).get_value(borrow=False) for p in self.params]
 
             while more:
                 train_cost = 0.0
                 train_loss = 0.0
+                num_batches = 0
                 p1 = 0.0
                 more_count += 1
 
@@ -318,63 +408,86 @@ class Model(object):
                 l2_generator = []
                 l2_encoder = []
 
-                num_files = args.num_files_train
+                num_files = self.num_files('train')
                 N = args.online_batch_size * num_files
 
-                for i in xrange(num_files):
-
-                    train_batches_x, train_batches_y, train_batches_e, train_batches_bm, _, train_batches_fw, train_batches_csz, train_batches_bpi = myio.load_batches(
-                        args.batch_dir + args.source + 'train', i)
-
-                    cur_len = len(train_batches_x)
-
-                    perm2 = range(cur_len)
-                    random.shuffle(perm2)
-
-                    train_batches_x = [train_batches_x[k] for k in perm2]
-                    train_batches_y = [train_batches_y[k] for k in perm2]
-                    train_batches_e = [train_batches_e[k] for k in perm2]
-                    train_batches_bm = [train_batches_bm[k] for k in perm2]
-                    train_batches_fw = [train_batches_fw[k] for k in perm2]
-                    train_batches_csz = [train_batches_csz[k] for k in perm2]
-                    train_batches_bpi = [train_batches_bpi[k] for k in perm2]
-
-                    for j in xrange(cur_len):
-                        if args.full_test:
-                            if (i* args.online_batch_size + j + 1) % 10 == 0:
-                                say("\r{}/{} {:.2f}       ".format(i* args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
-                        elif (i* args.online_batch_size + j + 1) % 10 == 0:
-                                say("\r{}/{} {:.2f}       ".format(i* args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
-
-                        bx, by, be, bm, bfw, bcsz, bpi = train_batches_x[j], train_batches_y[j], train_batches_e[j], \
-                                                  train_batches_bm[j], train_batches_fw[j], train_batches_csz[j], train_batches_bpi[j]
-                        be, blm = myio.create_1h(be, args.n)
-
-                        cost, loss, z, zsum, zdiff, bigram_loss, loss_vec, cost_logpz, logpz, cost_vec, preds_tr, cost_g, l2_enc, l2_gen, soft_mask = train_generator(
-                                bx, bpi, by, bm, be, bfw, bcsz, blm)
-
-                        mask = bx != padding_id
-
-                        obj_all.append(cost)
-                        loss_all.append(loss)
-                        zsum_all.append(np.mean(zsum))
-                        loss_vec_all.append(np.mean(loss_vec))
-                        z_diff_all.append(np.mean(zdiff))
-                        cost_logpz_all.append(np.mean(cost_logpz))
-                        logpz_all.append(np.mean(logpz))
-                        z_pred_all.append(np.mean(np.sum(z, axis=0)))
-                        cost_vec_all.append(np.mean(cost_vec))
-                        bigram_loss_all.append(np.mean(bigram_loss))
-                        l2_encoder.append(l2_enc)
-                        l2_generator.append(l2_gen)
-                        cost_generator_ls.append(cost_g)
-
-                        train_cost += cost
-                        train_loss += loss
-
-                        p1 += np.sum(z * mask) / (np.sum(mask) + 1e-8)
-
-                cur_train_avg_cost = train_cost / N
+                # the shuffles of the pass follow from it, a resumed pass replays them
+                pass_random_state = random.getstate()
+                start = 0
+
+                if resume is not None:
+                    more_count = resume['more_count']
+                    param_bak = resume['param_bak']
+                    pass_random_state = resume['random_state']
+                    start = resume['batches']
+
+                    (train_cost, train_loss, num_batches, p1, loss_all, obj_all, zsum_all, bigram_loss_all,
+                     loss_vec_all, z_diff_all, cost_logpz_all, cost_generator_ls, logpz_all, z_pred_all,
+                     cost_vec_all, l2_generator, l2_encoder) = resume['stats']
+
+                    random.setstate(pass_random_state)
+                    resume = None
+
+                train_batches = self.iter_batches('train', shuffle=True, n=args.n, start=start)
+                batches = start
+
+                for i, j, batch in myio.prefetch(train_batches, args.prefetch):
+                    if args.full_test:
+                        if (i* args.online_batch_size + j + 1) % 10 == 0:
+                            say("\r{}/{} {:.2f}       ".format(i* args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
+                    elif (i* args.online_batch_size + j + 1) % 10 == 0:
+                            say("\r{}/{} {:.2f}       ".format(i* args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
+
+                    bx, by, (be, blm), bm, _, bfw, bcsz, bpi = batch
+
+                    cost, loss, z, zsum, zdiff, bigram_loss, loss_vec, cost_logpz, logpz, cost_vec, preds_tr, cost_g, l2_enc, l2_gen, soft_mask = train_generator(
+                            bx, bpi, by, bm, be, bfw, bcsz, blm)
+
+                    mask = bx != padding_id
+
+                    obj_all.append(cost)
+                    loss_all.append(loss)
+                    zsum_all.append(np.mean(zsum))
+                    loss_vec_all.append(np.mean(loss_vec))
+                    z_diff_all.append(np.mean(zdiff))
+                    cost_logpz_all.append(np.mean(cost_logpz))
+                    logpz_all.append(np.mean(logpz))
+                    z_pred_all.append(np.mean(np.sum(z, axis=0)))
+                    cost_vec_all.append(np.mean(cost_vec))
+                    bigram_loss_all.append(np.mean(bigram_loss))
+                    l2_encoder.append(l2_enc)
+                    l2_generator.append(l2_gen)
+                    cost_generator_ls.append(cost_g)
+
+                    w = self.batch_weight(bx)
+
+                    train_cost += cost * w
+                    train_loss += loss * w
+                    num_batches += w
+
+                    p1 += np.sum(z * mask) / (np.sum(mask) + 1e-8)
+
+                    batches += 1
+
+                    if args.state_every > 0 and batches % args.state_every == 0:
+                        self.save_state(
+                            state_file, state_vars, writer,
+                            epoch=epoch,
+                            batches=batches,
+                            more_count=more_count,
+                            unchanged=unchanged,
+                            best_dev=best_dev,
+                            last_train_avg_cost=last_train_avg_cost,
+                            last_dev_avg_cost=last_dev_avg_cost,
+                            json_train=json_train,
+                            param_bak=param_bak if args.decay_lr else None,
+                            random_state=pass_random_state,
+                            stats=[train_cost, train_loss, num_batches, p1, loss_all, obj_all, zsum_all,
+                                   bigram_loss_all, loss_vec_all, z_diff_all, cost_logpz_all, cost_generator_ls,
+                                   logpz_all, z_pred_all, cost_vec_all, l2_generator, l2_encoder]
+                        )
+
+                cur_train_avg_cost = train_cost / num_batches
 
                 if args.dev:
                     self.dropout.set_value(0.0)
@@ -403,7 +516,7 @@ class Model(object):
                     lr_e.set_value(lr_val)
                     say("Decrease learning rate to {}\n".format(float(lr_val)))
                     for p, v in zip(self.params, param_bak):
-                        p.set_value(v)
+                        get_shared(p).set_value(v)
                     continue
 
                 myio.record_observations_verbose(json_train, epoch + 1, loss_all, obj_all, zsum_all, loss_vec_all,
@@ -416,10 +529,10 @@ class Model(object):
                 say(("Generator Epoch {:.2f}  costg={:.4f}  lossg={:.4f}  " +
                      "\t[{:.2f}m / {:.2f}m]\n").format(
                     epoch + 1,
-                    train_cost / N,
-                    train_loss / N,
+                    train_cost / num_batches,
+                    train_loss / num_batches,
                     (time.time() - start_time) / 60.0,
-                    (time.time() - start_time) / 60.0 / (i * args.online_batch_size + j + 1) * N
+                    (time.time() - start_time) / 60.0 / max(batches - start, 1) * N
                 ))
 
                 if args.dev:
@@ -429,17 +542,20 @@ class Model(object):
                         unchanged = 0
                         if args.save_model:
                             filename = args.save_model + myio.create_fname_identifier(args)
-                            self.save_model(filename, args)
+                            self.save_model(filename, args, writer=writer)
                             json_train['BEST_DEV_EPOCH'] = epoch
 
-                            myio.save_dev_results(self.args, None, dev_z, dev_x, dev_sha)
+                            writer.submit(myio.save_dev_results, self.args, None, dev_z, dev_x, dev_sha)
 
             if more_count > 5:
+                writer.close()
                 json_train['ERROR'] = 'Stuck reducing error rate, at epoch ' + str(epoch + 1) + '. LR = ' + str(lr_val)
                 json.dump(json_train, ofp_train)
                 ofp_train.close()
                 return
 
+        writer.close()
+
         if unchanged > 20:
             json_train['UNCHANGED'] = unchanged
 
@@ -469,11 +585,13 @@ class Model(object):
 
         eval_generator = theano.function(
             inputs=inputs_d,
+            givens=self.embedding_layer.givens(),
             outputs=outputs_d
         )
 
         train_generator = theano.function(
             inputs=inputs_t,
+            givens=self.embedding_layer.givens(),
             outputs=outputs_t,
             updates=updates_g.items()
         )
@@ -490,7 +608,26 @@ class Model(object):
         ofp_train = open(filename, 'w+')
         json_train = dict()
 
-        for epoch in xrange(args.max_epochs):
+        random.seed(datetime.now())
+
+        writer = myio.AsyncWriter(args.pending_saves)
+
+        state_vars = self.state_vars(updates_g) + [lr_g]
+        state_file = self.args.save_model + 'pretrain/' + myio.create_fname_identifier(self.args) + '.state'
+
+        resume = self.resume_state(state_file, state_vars) if args.resume else None
+        start_epoch = 0
+
+        if resume is not None:
+            start_epoch = resume['epoch']
+            # counted again as the epoch starts
+            unchanged = resume['unchanged'] - 1
+            best_dev = resume['best_dev']
+            last_train_avg_cost = resume['last_train_avg_cost']
+            last_dev_avg_cost = resume['last_dev_avg_cost']
+            json_train = resume['json_train']
+
+        for epoch in xrange(start_epoch, args.max_epochs):
             unchanged += 1
             more_count = 0
 
@@ -501,11 +638,12 @@ class Model(object):
 
             more = True
             if args.decay_lr:
-                param_bak = [p.get_value(borrow=False) for p in self.params]
+                param_bak = [get_shared(p).get_value(borrow=False) for p in self.params]
 
             while more:
                 train_cost = 0.0
                 train_loss = 0.0
+                num_batches = 0
                 p1 = 0.0
                 more_count += 1
 
@@ -518,47 +656,71 @@ class Model(object):
                 z_diff_all = []
                 z_pred_all = []
 
-                num_files = args.num_files_train
+                num_files = self.num_files('train')
                 N = args.online_batch_size * num_files
 
-                for i in xrange(num_files):
-                    train_batches_x, _, _, train_batches_bm, _, train_batches_fw, train_batches_cz, train_batches_bpi = myio.load_batches(args.batch_dir + args.source + 'train', i)
+                # the shuffles of the pass follow from it, a resumed pass replays them
+                pass_random_state = random.getstate()
+                start = 0
+
+                if resume is not None:
+                    more_count = resume['more_count']
+                    param_bak = resume['param_bak']
+                    pass_random_state = resume['random_state']
+                    start = resume['batches']
+
+                    train_cost, train_loss, num_batches, p1, obj_all, zsum_all, z_diff_all, z_pred_all = resume['stats']
+
+                    random.setstate(pass_random_state)
+                    resume = None
 
-                    random.seed(datetime.now())
-                    perm2 = range(len(train_batches_x))
-                    random.shuffle(perm2)
+                train_batches = self.iter_batches('train', shuffle=True, start=start)
+                batches = start
 
-                    train_batches_x = [train_batches_x[k] for k in perm2]
-                    train_batches_bm = [train_batches_bm[k] for k in perm2]
-                    train_batches_fw = [train_batches_fw[k] for k in perm2]
-                    train_batches_bpi = [train_batches_bpi[k] for k in perm2]
-                    train_batches_cz = [train_batches_cz[k] for k in perm2]
+                for i, j, batch in myio.prefetch(train_batches, args.prefetch):
+                    if args.full_test:
+                        if (i * args.online_batch_size + j + 1) % 10 == 0:
+                            say("\r{}/{} {:.2f}       ".format(i * args.online_batch_size + j + 1, N, p1))
+                    elif (i * args.online_batch_size + j + 1) % 10 == 0:
+                        say("\r{}/{} {:.2f}       ".format(i * args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
 
-                    cur_len = len(train_batches_x)
+                    bx, _, _, bm, _, bfw, bcz, bpi = batch
 
-                    for j in xrange(cur_len):
-                        if args.full_test:
-                            if (i * args.online_batch_size + j + 1) % 10 == 0:
-                                say("\r{}/{} {:.2f}       ".format(i * args.online_batch_size + j + 1, N, p1))
-                        elif (i * args.online_batch_size + j + 1) % 10 == 0:
-                            say("\r{}/{} {:.2f}       ".format(i * args.online_batch_size + j + 1, N, p1 / (i * args.online_batch_size + j + 1)))
+                    mask = bx != padding_id
 
-                        bx, bm, bfw, bpi, bcz = train_batches_x[j], train_batches_bm[j], train_batches_fw[j], train_batches_bpi[j], train_batches_cz[j]
+                    obj, z, zsum, zdiff,cost_g = train_generator(bx, bpi, bm, bfw, bcz)
 
-                        mask = bx != padding_id
+                    zsum_all.append(np.mean(zsum))
+                    z_diff_all.append(np.mean(zdiff))
+                    z_pred_all.append(np.mean(np.sum(z, axis=0)))
+                    obj_all.append(np.mean(obj))
 
-                        obj, z, zsum, zdiff,cost_g = train_generator(bx, bpi, bm, bfw, bcz)
+                    w = self.batch_weight(bx)
 
-                        zsum_all.append(np.mean(zsum))
-                        z_diff_all.append(np.mean(zdiff))
-                        z_pred_all.append(np.mean(np.sum(z, axis=0)))
-                        obj_all.append(np.mean(obj))
+                    train_cost += obj * w
+                    num_batches += w
 
-                        train_cost += obj
+                    p1 = np.sum(z * mask) / (np.sum(mask) + 1e-8)
 
-                        p1 = np.sum(z * mask) / (np.sum(mask) + 1e-8)
+                    batches += 1
 
-                cur_train_avg_cost = train_cost / N
+                    if args.state_every > 0 and batches % args.state_every == 0:
+                        self.save_state(
+                            state_file, state_vars, writer,
+                            epoch=epoch,
+                            batches=batches,
+                            more_count=more_count,
+                            unchanged=unchanged,
+                            best_dev=best_dev,
+                            last_train_avg_cost=last_train_avg_cost,
+                            last_dev_avg_cost=last_dev_avg_cost,
+                            json_train=json_train,
+                            param_bak=param_bak if args.decay_lr else None,
+                            random_state=pass_random_state,
+                            stats=[train_cost, train_loss, num_batches, p1, obj_all, zsum_all, z_diff_all, z_pred_all]
+                        )
+
+                cur_train_avg_cost = train_cost / num_batches
 
                 if args.dev:
                     self.dropout.set_value(0.0)
@@ -586,7 +748,7 @@ class Model(object):
                     lr_g.set_value(lr_val)
                     say("Decrease learning rate to {}\n".format(float(lr_val)))
                     for p, v in zip(self.params, param_bak):
-                        p.set_value(v)
+                        get_shared(p).set_value(v)
                     continue
 
                 myio.record_observations_pretrain(json_train, epoch + 1, obj_all, zsum_all, z_diff_all, z_pred_all)
@@ -597,10 +759,10 @@ class Model(object):
                 say(("Generator Epoch {:.2f}  costg={:.4f}  lossg={:.4f}  " +
                      "\t[{:.2f}m / {:.2f}m]\n").format(
                     epoch + 1,
-                    train_cost / N,
-                    train_loss / N,
+                    train_cost / num_batches,
+                    train_loss / num_batches,
                     (time.time() - start_time) / 60.0,
-                    (time.time() - start_time) / 60.0 / (i * args.online_batch_size + j + 1) * N
+                    (time.time() - start_time) / 60.0 / max(batches - start, 1) * N
                 ))
 
                 if args.dev:
@@ -610,17 +772,20 @@ class Model(object):
                         unchanged = 0
                         if args.save_model:
                             filename = self.args.save_model + 'pretrain/' + myio.create_fname_identifier(self.args)
-                            self.save_model(filename, self.args, pretrain=True)
+                            self.save_model(filename, self.args, pretrain=True, writer=writer)
                             json_train['BEST_DEV_EPOCH'] = epoch
 
-                            myio.save_dev_results(self.args, None, dev_z, x, sha_ls)
+                            writer.submit(myio.save_dev_results, self.args, None, dev_z, x, sha_ls)
 
             if more_count > 5:
+                writer.close()
                 json_train['ERROR'] = 'Stuck reducing error rate, at epoch ' + str(epoch + 1) + '. LR = ' + str(lr_val)
                 json.dump(json_train, ofp_train)
                 ofp_train.close()
                 return
 
+        writer.close()
+
         if unchanged > 20:
             json_train['UNCHANGED'] = unchanged
 
@@ -635,25 +800,18 @@ class Model(object):
         x = []
         sha_ls = []
 
-        num_files = self.args.num_files_dev
-
-        for i in xrange(num_files):
-
-            batches_x, _, _, batches_bm, batches_sha, batches_rx, batches_fw, batches_cs, batches_bpi = myio.load_batches(
-                self.args.batch_dir + self.args.source + 'dev', i)
+        for i, j, batch in self.iter_batches('dev'):
+            bx, _, _, bm, sha, rx, bfw, bsc, bpi = batch
 
-            cur_len = len(batches_x)
+            bz, l, o = eval_func(bx, bpi, bm, bfw, bsc)
+            w = self.batch_weight(bx)
 
-            for j in xrange(cur_len):
-                bx, bm, sha, rx, bfw, bpi, bsc = batches_x[j], batches_bm[j], batches_sha[j], batches_rx[j], batches_fw[j], batches_bpi[j], batches_cs[j]
+            tot_obj += o * w
+            N += len(bx) * w
 
-                bz, l, o = eval_func(bx, bpi, bm, bfw, bsc)
-                tot_obj += o
-                N += len(bx)
-
-                x.append(rx)
-                dev_z.append(bz)
-                sha_ls.append(sha)
+            x.append(rx)
+            dev_z.append(bz)
+            sha_ls.append(sha)
 
         return tot_obj / float(N), dev_z, x, sha_ls
 
@@ -666,37 +824,26 @@ class Model(object):
         sha_ls = []
         chunks = []
 
-        num_files = self.args.num_files_dev
-
-        for i in xrange(num_files):
-
-            batches_x, batches_y, batches_e, batches_bm,  batches_sha, batches_rx, batches_fw, batches_csz, batches_bpi = myio.load_batches(
-                    self.args.batch_dir + self.args.source + 'dev', i)
-
-            cur_len = len(batches_x)
+        for i, j, batch in self.iter_batches('dev'):
+            bx, by, be, bm, sha, rx, fw, csz, bpi = batch
 
-            for j in xrange(cur_len):
+            be, ble = myio.create_1h(be, args.n)
+            bz, o, e, preds = eval_func(bx, bpi, by, bm, be, fw, csz, ble)
 
-                bx, by, be, bm, sha, rx, fw, csz, bpi = batches_x[j], batches_y[j], batches_e[j], batches_bm[j], \
-                                                        batches_sha[j], batches_rx[j], batches_fw[j], \
-                                                        batches_csz[j], batches_bpi[j]
-                be, ble = myio.create_1h(be, args.n)
-                bz, o, e, preds = eval_func(bx, bpi, by, bm, be, fw, csz, ble)
+            w = self.batch_weight(bx)
 
-                tot_obj += o
+            tot_obj += o * w
+            N += w
 
-                x.append(rx)
-                dev_z.append(bz)
-                sha_ls.append(sha)
-                chunks.append(csz)
+            x.append(rx)
+            dev_z.append(bz)
+            sha_ls.append(sha)
+            chunks.append(csz)
 
-            N += cur_len
         # dev_obj, dev_z, dev_x, dev_sha, dev_acc, dev_f1
         return tot_obj / float(N), dev_z, x, sha_ls, chunks
 
     def evaluate_test_data(self, eval_func):
-        N = 0
-
         test_z = []
         x = []
         y = []
@@ -704,29 +851,23 @@ class Model(object):
         sha_ls = []
         chunk_ls= []
 
-        num_files = self.args.num_files_test
-
-        for i in xrange(num_files):
-            print i, 'out of', num_files
-            batches_x, batches_y, batches_e, batches_bm, batches_sha, batches_rx, batches_fw, batches_cs, batches_bpi = myio.load_batches(
-                self.args.batch_dir + self.args.source + 'test', i)
-
-            cur_len = len(batches_x)
+        num_files = self.num_files('test')
 
-            for j in xrange(cur_len):
-                bx, bm, sha, rx, bfw, bpi, bsc, by, be = batches_x[j], batches_bm[j], batches_sha[j], batches_rx[j], batches_fw[j], batches_bpi[j], batches_cs[j],batches_y[j],batches_e[j]
-                be, _ = myio.create_1h(be, self.args.n)
-                bz = eval_func(bx, bpi, bm, bfw, bsc)
+        for i, j, batch in self.iter_batches('test'):
+            if j == 0:
+                print i, 'out of', num_files
 
-                x.append(rx)
-                y.append(by)
-                e.append(be)
-                chunk_ls.append(bsc)
+            bx, by, be, bm, sha, rx, bfw, bsc, bpi = batch
+            be, _ = myio.create_1h(be, self.args.n)
+            bz = eval_func(bx, bpi, bm, bfw, bsc)
 
-                test_z.append(bz)
-                sha_ls.append(sha)
+            x.append(rx)
+            y.append(by)
+            e.append(be)
+            chunk_ls.append(bsc)
 
-            N += len(batches_x)
+            test_z.append(bz)
+            sha_ls.append(sha)
 
         return test_z, x, y, e, sha_ls, chunk_ls
 
@@ -1,14 +1,20 @@
 import os
 import json
+import random
+import sys
 import tempfile
+import threading
+import Queue
 
 import numpy as np
 try:
     from pyrouge import Rouge155
 except ImportError:
     print 'Not for eval'
-from nn.basic import EmbeddingLayer, PositionEmbeddingLayer
 from util import load_embedding_iterator
+from util.checkpoint_io import atomic_open
+from data import vocab_io
+import shard_io
 import shutil
 
 
@@ -28,30 +34,26 @@ def read_docs(args, type):
 
 
 def get_vocab(args):
-    ifp = open('../data/'+ str(args.source) + '_vocab_' + str(args.vocab_size) + '.txt', 'r')
-
-    vocab = []
-
-    for line in ifp:
-        vocab.append(line.rstrip())
-    ifp.close()
-
-    return vocab
+    return vocab_io.read_vocab('../data/'+ str(args.source) + '_vocab_' + str(args.vocab_size) + '.txt', args.vocab_size)
 
 
 def create_embedding_layer(args, path, vocab, embedding_dim, oov=None):
+    # imported here, the rest of myio is also used without theano (infer.py)
+    from nn.basic import EmbeddingLayer
 
     embedding_layer = EmbeddingLayer(
         n_d=embedding_dim,
         vocab=vocab,
         embs=load_embedding_iterator(path) if path is not None else None,
         oov=oov,
-        fix_init_embs=False
+        fix_init_embs=False,
+        sparse=args.sparse_updates
     )
     return embedding_layer
 
 
 def create_posit_embedding_layer(vocab, embedding_dim):
+    from nn.basic import PositionEmbeddingLayer
 
     embedding_layer = PositionEmbeddingLayer(
         n_d=embedding_dim,
@@ -62,9 +64,21 @@ def create_posit_embedding_layer(vocab, embedding_dim):
 
 
 def load_batches(name, iteration):
-    ifp = open(name + str(iteration), 'rb')
-    data = np.load(ifp)
-    ifp.close()
+    filename = name + str(iteration)
+
+    if os.path.isdir(filename):
+        arrays, lists = shard_io.read_shard(filename)
+
+        data = [arrays['x'], arrays['y'], lists['e'], arrays['bm'], lists['sha']]
+
+        if 'raw_x' in lists:
+            data.append(lists['raw_x'])
+
+        data.extend([arrays['fw'], arrays['csz'], arrays['bpi']])
+    else:
+        ifp = open(filename, 'rb')
+        data = np.load(ifp)
+        ifp.close()
 
     if len(data) == 4:
         return data[0], data[1], data[2], data[3]
@@ -76,6 +90,155 @@ def load_batches(name, iteration):
         return data[0], data[1], data[2], data[3], data[4], data[5], data[6], data[7], data[8], data[9]
 
 
+def iter_batches(name, num_files, shuffle=False, n=None, start=0):
+    '''
+        Yields (i, j, batch) for the j-th batch of file i, batch holding one entry
+        per load_batches field. Batches are shuffled within their file, and when n
+        is given the entities are replaced by their create_1h (be, loss mask) pair.
+        The first start batches are skipped, after the same shuffles.
+    '''
+    for i in xrange(num_files):
+        data = load_batches(name, i)
+
+        perm = range(len(data[0]))
+
+        if shuffle:
+            random.shuffle(perm)
+
+        for j, k in enumerate(perm):
+            if start > 0:
+                start -= 1
+                continue
+
+            batch = [field[k] for field in data]
+
+            if n is not None:
+                batch[2] = create_1h(batch[2], n)
+
+            yield i, j, batch
+
+
+def prefetch(iterable, size):
+    '''
+        Runs iterable in a background thread, keeping up to size items ready.
+        Exceptions are raised again in the consumer. When the consumer stops
+        early (break, exception, close), the thread stops and closes iterable.
+    '''
+    if size <= 0:
+        for item in iterable:
+            yield item
+        return
+
+    queue = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        # gives up once the consumer is gone, instead of waiting on a full queue forever
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((None, item)):
+                    return
+        except Exception:
+            put((sys.exc_info(), None))
+            return
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+        put((None, done))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            exc_info, item = queue.get()
+
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            if item is done:
+                break
+
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class AsyncWriter(object):
+    '''
+        Runs the submitted writes in order in a background thread, with at most
+        size of them pending : submit waits for the oldest one to be written.
+        Exceptions are raised again in the next submit or in close. With size 0
+        the writes are made in submit.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.exc_info = None
+
+        if size > 0:
+            self.pending = threading.BoundedSemaphore(size)
+            self.queue = Queue.Queue()
+
+            self.thread = threading.Thread(target=self.consume)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def consume(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            func, args = job
+            if self.exc_info is None:
+                try:
+                    func(*args)
+                except Exception:
+                    self.exc_info = sys.exc_info()
+
+            self.pending.release()
+
+    def check(self):
+        if self.exc_info is not None:
+            exc_info, self.exc_info = self.exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def submit(self, func, *args):
+        self.check()
+
+        if self.size <= 0:
+            func(*args)
+            return
+
+        self.pending.acquire()
+        self.queue.put((func, args))
+
+    def close(self):
+        '''
+            Waits for the pending writes.
+        '''
+        if self.size > 0 and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.check()
+
+
 def create_fname_identifier(args):
     if args.word_level_c:
         chunk_typ = 'word'
@@ -177,9 +340,6 @@ def save_dev_results(args, epoch, dev_z, dev_batches_x, dev_sha, dev_chunks=None
     filename_ = get_readable_file(args, epoch)
     filename_m = get_mask_file(args, epoch)
 
-    ofp_samples = open(filename_, 'w+')
-    ofp_samples_m = open(filename_m, 'w+')
-
     ofp_samples_system = []
     ofp_m = dict()
     ofp_samples_sha = []
@@ -195,7 +355,6 @@ def save_dev_results(args, epoch, dev_z, dev_batches_x, dev_sha, dev_chunks=None
         for j in xrange(len(dev_z[i][0])):
             filename = rouge_fname + 'sum.' + str(s_num).zfill(6) + '.txt'
 
-            ofp_for_rouge = open(filename, 'w+')
             ofp_system_output = []
             post_proc = set()
 
@@ -228,9 +387,11 @@ def save_dev_results(args, epoch, dev_z, dev_batches_x, dev_sha, dev_chunks=None
                 if skip_word:
                     continue
 
-                ofp_for_rouge.write(word + ' ')
                 ofp_system_output.append(word)
 
+            with atomic_open(filename, 'w') as ofp_for_rouge:
+                ofp_for_rouge.write(''.join(word + ' ' for word in ofp_system_output))
+
             raw_and_mask = dict()
             raw_and_mask['m'] = dev_z[i][:, j].tolist()
             raw_and_mask['r'] = dev_batches_x[i][j][:]
@@ -239,24 +400,22 @@ def save_dev_results(args, epoch, dev_z, dev_batches_x, dev_sha, dev_chunks=None
 
             ofp_samples_system.append(' '.join(ofp_system_output))
             ofp_samples_sha.append(dev_sha[i][j])
-            ofp_for_rouge.close()
             s_num += 1
 
-    for i in xrange(len(ofp_samples_system)):
-        ofp_samples.write(str(ofp_samples_sha[i]))
-        ofp_samples.write('\nSystem Summary : ')
+    with atomic_open(filename_, 'w') as ofp_samples:
+        for i in xrange(len(ofp_samples_system)):
+            ofp_samples.write(str(ofp_samples_sha[i]))
+            ofp_samples.write('\nSystem Summary : ')
 
-        if len(ofp_samples_system[i]) == 0:
-            ofp_samples.write('**No Summary**')
-        else:
-            ofp_samples.write(ofp_samples_system[i])
+            if len(ofp_samples_system[i]) == 0:
+                ofp_samples.write('**No Summary**')
+            else:
+                ofp_samples.write(ofp_samples_system[i])
 
-        ofp_samples.write('\n\n')
+            ofp_samples.write('\n\n')
 
-    json.dump(ofp_m, ofp_samples_m)
-
-    ofp_samples_m.close()
-    ofp_samples.close()
+    with atomic_open(filename_m, 'w') as ofp_samples_m:
+        json.dump(ofp_m, ofp_samples_m)
 
 
 def retrieve_chunk(x, begin, end):
@@ -271,9 +430,6 @@ def save_test_results_rouge(args, z, x, y, e, sha, embedding_layer, chunks=None)
     filename_ = get_readable_file(args, epoch, test=True)
     filename_m = get_mask_file(args, epoch, test=True)
 
-    ofp_samples = open(filename_, 'w+')
-    ofp_samples_m = open(filename_m, 'w+')
-
     ofp_samples_system = []
     ofp_samples_sha = []
 
@@ -0,0 +1,82 @@
+import json
+import os
+
+import numpy as np
+
+
+def to_builtin(obj):
+    # json.dump hook for values read back as numpy arrays
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.integer):
+        return int(obj)
+
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
+def write_shard(dirname, arrays, lists):
+    '''
+        One file of batches as a directory : every field in arrays (name -> list
+        of 2d batches) is flattened into a single int32 .npy, with the offset and
+        shape of each batch in index.json. Fields in lists (entities, SHAs, raw
+        text) go to ragged.json.
+    '''
+    # replaces a batch file left from the npy format
+    if os.path.isfile(dirname):
+        os.remove(dirname)
+
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    index = dict()
+
+    for name, batches in arrays.iteritems():
+        bounds = []
+        offset = 0
+
+        for batch in batches:
+            rows, cols = batch.shape
+            bounds.append([offset, rows, cols])
+            offset += rows * cols
+
+        np.save(os.path.join(dirname, name + '.npy'),
+                np.concatenate([np.ascontiguousarray(batch, dtype='int32').ravel() for batch in batches]))
+
+        index[name] = bounds
+
+    with open(os.path.join(dirname, 'index.json'), 'w+') as ofp:
+        json.dump(index, ofp)
+
+    with open(os.path.join(dirname, 'ragged.json'), 'w+') as ofp:
+        json.dump(lists, ofp, default=to_builtin)
+
+
+class ShardField(object):
+    '''
+        Batches of one field, as views into the memory mapped .npy.
+    '''
+
+    def __init__(self, values, bounds):
+        self.values = values
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __getitem__(self, j):
+        offset, rows, cols = self.bounds[j]
+
+        return np.asarray(self.values[offset:offset + rows * cols]).reshape(rows, cols)
+
+
+def read_shard(dirname):
+    with open(os.path.join(dirname, 'index.json'), 'rb') as ifp:
+        index = json.load(ifp)
+
+    arrays = dict((name, ShardField(np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r'), bounds))
+                  for name, bounds in index.iteritems())
+
+    with open(os.path.join(dirname, 'ragged.json'), 'rb') as ifp:
+        lists = json.load(ifp)
+
+    return arrays, lists
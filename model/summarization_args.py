@@ -1,9 +1,5 @@
 import argparse
 
-import theano
-
-_floatX = theano.config.floatX
-
 
 def str2bool(v):
     return v.lower() in ('yes', 'true', 'True', 't', '1', 'y')
@@ -194,18 +190,82 @@ def get_args():
                         help="path to save model parameters"
                         )
 
+    parser.add_argument("--checkpoint_format",
+                        type=str,
+                        default="pkl",
+                        choices=["pkl", "ckpt", "ckpt16"],
+                        help="pkl: gzipped pickle, ckpt: uncompressed file memory mapped when loaded, "
+                             "ckpt16: ckpt with float16 weights"
+                        )
+
+    parser.add_argument('--pending_saves',
+                        type=int,
+                        default=2,
+                        help='Best models and dev results written in a background thread, at most this many waiting '
+                             'to be written, 0 to write them in the training loop')
+
+    parser.add_argument('--state_every',
+                        type=int,
+                        default=0,
+                        help='Save the training state (params, optimizer, data position) every this many batches, '
+                             'to resume with --resume, 0 to disable')
+
+    parser.add_argument('--resume',
+                        type='bool',
+                        default=False,
+                        help='Continue training from the state saved with --state_every')
+
+    parser.add_argument('--data_format',
+                        type=str,
+                        default='json',
+                        choices=['json', 'jsonl', 'columnar'],
+                        help='Format of the model ready data, see data/data_args.py')
+
     parser.add_argument("--batch_dir",
                         type=str,
                         default="../data/batches/",
                         help="Directory to keep batched data on HDD"
                         )
 
+    parser.add_argument('--batch_format',
+                        type=str,
+                        default='shard',
+                        choices=['shard', 'npy'],
+                        help='shard: directory of memory mapped int32 arrays per batch file, npy: pickled lists')
+
+    parser.add_argument('--num_workers',
+                        type=int,
+                        default=1,
+                        help='Worker processes creating batch files in batch_data.py')
+
+    parser.add_argument('--bucket',
+                        type='bool',
+                        default=False,
+                        help='Pad each batch to its longest article (at most inp_len) instead of inp_len')
+
+    parser.add_argument('--token_budget',
+                        type=int,
+                        default=0,
+                        help='Fill each batch with articles up to this many padded tokens (articles x padded length) '
+                             'instead of --batch articles, 0 to disable')
+
+    parser.add_argument('--online',
+                        type='bool',
+                        default=False,
+                        help='Build the batches from the model ready data while training instead of reading --batch_dir, '
+                             'with --num_workers processes')
+
     parser.add_argument("--online_batch_size",
                         type=int,
                         default=10,
                         help="Number of batches to have loaded onto ram at a given time"
                         )
 
+    parser.add_argument('--prefetch',
+                        type=int,
+                        default=20,
+                        help='Training batches loaded ahead in a background thread, 0 to load them in the training loop')
+
     parser.add_argument("--num_files_train",
                         type=int,
                         default=12,
@@ -289,6 +349,12 @@ def get_args():
                         help="learning method"
                         )
 
+    parser.add_argument("--sparse_updates",
+                        type='bool',
+                        default=False,
+                        help="update only the word embeddings (and their accumulators) of the batch vocabulary"
+                        )
+
     parser.add_argument("--learning_rate",
                         type=float,
                         default=0.0001,
@@ -0,0 +1,218 @@
+import unittest
+
+import numpy as np
+
+import batch_data
+
+
+def loop_chunk_mask(lstch, max_len):
+    '''
+        create_chunk_mask before it was vectorized.
+    '''
+    fw_mask_ls = []
+    mask_chunk_sizes = []
+
+    for article in lstch:
+        num_w = 0
+        fw_mask = []
+        mask_csz = []
+
+        for c in article:
+            if c == 0:
+                continue
+
+            if num_w + c <= max_len:
+                fw_mask.extend([0]*(c-1))
+                fw_mask.append(1)
+                mask_csz.append(c)
+
+                num_w += c
+            else:
+                if num_w == max_len:
+                    break
+                elif num_w < max_len:
+                    fw_mask.extend([0] * (max_len - (num_w + 1)))
+                    fw_mask.append(1)
+
+                    mask_csz.append(max_len - num_w)
+                    break
+
+        if len(fw_mask) < max_len:
+            fw_mask.extend([0] * (max_len - (len(fw_mask) + 1)))
+            fw_mask.append(1)
+
+        mask_csz.extend([0]*(max_len - len(mask_csz)))
+        fw_mask_ls.append(fw_mask)
+        mask_chunk_sizes.append(mask_csz)
+
+    fw_mask_ls = np.column_stack([x for x in fw_mask_ls]).astype('int32')
+    mask_chunk_sizes = np.column_stack([x for x in mask_chunk_sizes]).astype('int32')
+
+    return fw_mask_ls, mask_chunk_sizes
+
+
+def loop_sentence_indexing(lstsc, max_len):
+    '''
+        sentence_indexing before it was vectorized.
+    '''
+    indexed_x = []
+
+    for x in lstsc:
+        single_doc = []
+        total_w = 0
+
+        for i in xrange(len(x)):
+            single_doc.extend([i+1]*x[i])
+            total_w +=x[i]
+
+            if total_w >= max_len:
+                break
+
+        indexed_x.append(single_doc)
+
+    return np.column_stack([np.pad(x[:max_len], (0, max_len - len(x) if len(x) <= max_len else 0), "constant",
+                                   constant_values=0).astype('int32') for x in indexed_x])
+
+
+def loop_unigram_masks(lstx, unigrams, max_len, stopwords):
+    '''
+        create_unigram_masks before it was vectorized, stopwords as the
+        (stopword set, punctuation set) of token ids.
+    '''
+    sw, punct = stopwords
+    masks = []
+
+    for i in xrange(len(lstx)):
+        len_x = len(lstx[i])
+        m = np.zeros((max_len,), dtype='int32')
+
+        for j in xrange(len_x - 1):
+            if j >= max_len:
+                break
+            w1 = lstx[i][j]
+            w2 = lstx[i][j+1]
+
+            if w1 in unigrams[i] and w2 in unigrams[i]:
+                if w1 in punct or w2 in punct or (w1 in sw and w2 in sw):
+                    continue
+
+                try:
+                    m[j] = 1
+                    m[j+1] = 1
+                except IndexError:
+                    continue
+
+        masks.append(m)
+
+    return masks
+
+
+def loop_chunk_masks(word_level_bm, bsz, max_len):
+    '''
+        create_chunk_masks before it was vectorized.
+    '''
+    masks = []
+
+    for i in xrange(len(word_level_bm)):
+        m = []
+        chunks = bsz[:, i]
+        gs_words = word_level_bm[i]
+        end = 0
+
+        for c in chunks:
+            begin = end
+            end = begin + c
+
+            use_cur_chunk = False
+
+            for j in range(begin, end):
+                if gs_words[j] > 0:
+                    use_cur_chunk = True
+                    break
+
+            if use_cur_chunk:
+                cur_chunk = [1] * c
+            else:
+                cur_chunk = [0] * c
+            m.extend(cur_chunk)
+
+        if len(m) < max_len:
+            m.extend([0]*(max_len - len(m)))
+
+        masks.append(m)
+
+    return np.asarray(masks, dtype='int32')
+
+
+def random_sizes(rng, total):
+    # sizes adding up to total, with zero sizes mixed in
+    sizes = []
+
+    while total > 0:
+        size = min(total, rng.randint(0, 6))
+        sizes.append(size)
+        total -= size
+
+    return sizes
+
+
+class BatchMaskTest(unittest.TestCase):
+
+    def assert_same_array(self, a, b):
+        self.assertEqual(a.dtype, b.dtype)
+        self.assertEqual(a.shape, b.shape)
+        self.assertTrue(a.flags['C_CONTIGUOUS'] and b.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.array_equal(a, b))
+
+    def test_chunk_mask_and_sentence_index(self):
+        rng = np.random.RandomState(2019)
+
+        for _ in xrange(1000):
+            max_len = rng.choice([1, 5, 20])
+            lengths = rng.randint(0, 2 * max_len + 1, size=rng.randint(1, 7))
+
+            lstch = [random_sizes(rng, l) for l in lengths]
+            lstsc = [random_sizes(rng, l) for l in lengths]
+
+            for a, b in zip(batch_data.create_chunk_mask(lstch, max_len), loop_chunk_mask(lstch, max_len)):
+                self.assert_same_array(a, b)
+
+            self.assert_same_array(batch_data.sentence_indexing(lstsc, max_len),
+                                   loop_sentence_indexing(lstsc, max_len))
+
+    def test_chunk_mask_exact_fit(self):
+        fw_mask, chunk_sizes = batch_data.create_chunk_mask([[2, 3], [0, 5, 1], []], 5)
+
+        self.assert_same_array(fw_mask, np.asarray([[0, 0, 0], [1, 0, 0], [0, 0, 0], [0, 0, 0], [1, 1, 1]], 'int32'))
+        self.assert_same_array(chunk_sizes, np.asarray([[2, 5, 0], [3, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]], 'int32'))
+
+    def test_overlap_masks(self):
+        rng = np.random.RandomState(2020)
+        vocab_size = 30
+
+        for _ in xrange(1000):
+            max_len = rng.choice([1, 5, 20])
+            lengths = rng.randint(1, 2 * max_len + 2, size=rng.randint(1, 7))
+
+            lstx = [list(rng.randint(0, vocab_size, size=l)) for l in lengths]
+            unigrams = [set(rng.randint(0, vocab_size, size=rng.randint(0, 20))) for _ in lengths]
+            lstch = [random_sizes(rng, l) for l in lengths]
+
+            stopword_table = rng.rand(vocab_size) < 0.3
+            punctuation_table = rng.rand(vocab_size) < 0.1
+            stopwords = (set(np.flatnonzero(stopword_table)), set(np.flatnonzero(punctuation_table)))
+
+            word_mask = batch_data.create_unigram_masks(lstx, unigrams, max_len,
+                                                        (stopword_table, punctuation_table), None)
+            loop_word_mask = loop_unigram_masks(lstx, unigrams, max_len, stopwords)
+
+            self.assert_same_array(word_mask, np.asarray(loop_word_mask, dtype='int32'))
+
+            _, bsz = batch_data.create_chunk_mask(lstch, max_len)
+
+            self.assert_same_array(batch_data.create_chunk_masks(word_mask, bsz, max_len),
+                                   loop_chunk_masks(loop_word_mask, bsz, max_len))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -244,6 +244,35 @@ class AttentionLayer(Layer):
             p.set_value(q.get_value())
 
 
+'''
+    Attention of the n questions of an article over its document, without
+    tiling the document states n times. The questions are (n * batch) x d,
+    question i * batch + j being asked about article j.
+'''
+def grouped_scores(h, q, n):
+    '''
+        h : inp_len x batch x d, q : (n * batch) x d -> n x batch x inp_len
+    '''
+    q = q.reshape((n, h.shape[1], h.shape[2])).dimshuffle((1, 2, 0))
+
+    # batch x inp_len x n
+    scores = T.batched_dot(h.dimshuffle((1, 0, 2)), q)
+
+    return scores.dimshuffle((2, 0, 1))
+
+
+def grouped_pool(alpha, h, n):
+    '''
+        alpha : (n * batch) x inp_len, h : inp_len x batch x d -> (n * batch) x d
+    '''
+    alpha = alpha.reshape((n, h.shape[1], h.shape[0])).dimshuffle((1, 0, 2))
+
+    # batch x n x d
+    o = T.batched_dot(alpha, h.dimshuffle((1, 0, 2)))
+
+    return o.dimshuffle((1, 0, 2)).reshape((n * h.shape[1], h.shape[2]))
+
+
 '''
     This class implements the attention layer described in
         A Neural Attention Model for Abstractive Sentence Summarization
@@ -254,21 +283,16 @@ class AttentionLayer(Layer):
 
 
 class Bilinear(Layer):
-    def __init__(self, n_d, batch_size, n):
-        self.batch_size, self.n, self.n_d = batch_size, n, n_d
+    def __init__(self, n_d, n):
+        self.n, self.n_d = n, n_d
         self.create_parameters()
 
     def create_parameters(self):
         self.w1 = create_shared(random_init((self.n_d*2, self.n_d*2)), name="w")
 
     def forward(self, h_final, h_y):
-        self.w1.dimshuffle(('x', 0, 1))
-        w1_tiled = T.tile(self.w1, (self.batch_size * self.n, 1, 1))
-
-        bilinear = T.batched_dot(h_final, w1_tiled)
-        inp_dot_hl = T.batched_dot(bilinear, h_y)
-
-        return inp_dot_hl
+        # h_x w1 h_y = h_x . (h_y w1^T), one matmul on the (n * batch) questions
+        return grouped_scores(h_final, T.dot(h_y, self.w1.T), self.n)
 
     @property
     def params(self):
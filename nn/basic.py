@@ -325,10 +325,12 @@ class EmbeddingLayer(object):
         embs            : a dictionary of (word, vector) pairs; these will be added to
                             the layer
         fix_init_embs   : whether to fix the initial word vectors loaded from embs
+        sparse          : train only the rows looked up in the batch; the ids are
+                            given to theano.function by givens()
 
     '''
 
-    def __init__(self, n_d, vocab, oov="<unk>", embs=None, fix_init_embs=True):
+    def __init__(self, n_d, vocab, oov="<unk>", embs=None, fix_init_embs=True, sparse=False):
 
         if embs is not None:
             lst_words = []
@@ -394,8 +396,14 @@ class EmbeddingLayer(object):
             self.oov_id = -1
 
         self.embeddings = create_shared(emb_vals)
+        self.sparse = sparse and self.init_end == -1
         if self.init_end > -1:
             self.embeddings_trainable = self.embeddings[self.init_end:]
+        elif self.sparse:
+            # sorted ids of the batch, a subtensor param for the optimizer
+            self.rows = T.ivector('rows')
+            self.lookups = []
+            self.embeddings_trainable = self.embeddings[self.rows]
         else:
             self.embeddings_trainable = self.embeddings
 
@@ -452,8 +460,23 @@ class EmbeddingLayer(object):
 
             a theano matrix of word embeddings
         '''
+        if self.sparse:
+            self.lookups.append(x)
+            return self.embeddings_trainable[T.extra_ops.searchsorted(self.rows, x)]
+
         return self.embeddings[x]
 
+    def givens(self):
+        '''
+            The ids looked up by forward() in place of the rows placeholder, to
+            pass as givens to theano.function
+        '''
+        if not self.sparse:
+            return dict()
+
+        ids = T.concatenate([x.ravel() for x in self.lookups])
+        return {self.rows: T.extra_ops.Unique()(ids)}
+
     @property
     def params(self):
         return [self.embeddings_trainable]
@@ -587,7 +610,32 @@ class LSTM(Layer):
 
                 return [ c_t, h_t ] as a single concatenated vector/matrix
         '''
-        n_in, n_out, activation = self.n_in, self.n_out, self.activation
+        W_x, W_h, b = self.fused_weights()
+
+        return self.forward_fused(T.dot(x, W_x) + b, hc, W_h)
+
+    def fused_weights(self):
+        '''
+            The weights of the four gates side by side (input, in, forget, out),
+            W_x : n_in x 4n_out, W_h : n_out x 4n_out and b : 4n_out. They are
+            built from the per gate parameters, which stay the ones trained and saved.
+        '''
+        n_in = self.n_in
+
+        W_x = T.concatenate([layer.W[:n_in] for layer in self.internal_layers], axis=1)
+        W_h = T.concatenate([layer.W[n_in:] for layer in self.internal_layers], axis=1)
+        b = T.concatenate([layer.b for layer in self.internal_layers])
+
+        return W_x, W_h, b
+
+    def forward_fused(self, xw, hc, W_h):
+        '''
+            Apply one recurrent step of LSTM given the input already projected,
+            xw = x W_x + b, so only h_tm1 W_h is left to compute in the step.
+            W_h comes from fused_weights, built once by the caller and passed
+            to the scan as a non sequence.
+        '''
+        n_out = self.n_out
 
         if hc.ndim > 1:
             c_tm1 = hc[:, :n_out]
@@ -596,11 +644,13 @@ class LSTM(Layer):
             c_tm1 = hc[:n_out]
             h_tm1 = hc[n_out:]
 
-        in_t = self.in_gate.forward(x, h_tm1)
-        forget_t = self.forget_gate.forward(x, h_tm1)
-        out_t = self.out_gate.forward(x, h_tm1)
+        gates = xw + T.dot(h_tm1, W_h)
 
-        c_t = forget_t * c_tm1 + in_t * self.input_layer.forward(x, h_tm1)
+        input_t, in_t, forget_t, out_t = [
+            layer.activation(gates[:, k * n_out:(k + 1) * n_out] if gates.ndim > 1 else gates[k * n_out:(k + 1) * n_out])
+            for k, layer in enumerate(self.internal_layers)]
+
+        c_t = forget_t * c_tm1 + in_t * input_t
         h_t = out_t * T.tanh(c_t)
 
         if hc.ndim > 1:
@@ -633,10 +683,14 @@ class LSTM(Layer):
                 h0 = T.zeros((x.shape[1], self.n_out * 2), dtype=theano.config.floatX)
             else:
                 h0 = T.zeros((self.n_out * 2,), dtype=theano.config.floatX)
+        W_x, W_h, b = self.fused_weights()
+
+        # the input part of every step at once, outside of the scan
         h, _ = theano.scan(
-            fn=self.forward,
-            sequences=x,
-            outputs_info=[h0]
+            fn=self.forward_fused,
+            sequences=T.dot(x, W_x) + b,
+            outputs_info=[h0],
+            non_sequences=[W_h]
         )
         if return_c:
             return h
@@ -5,7 +5,7 @@ from nn.basic import Layer
 from nn.basic import apply_dropout
 from nn.extended_layers import MaskedLSTM
 from nn.initialization import softmax, get_activation_by_name
-from nn.advanced import Bilinear
+from nn.advanced import Bilinear, grouped_scores, grouped_pool
 
 import numpy as np
 
@@ -68,7 +68,6 @@ class Encoder(object):
         layers.append(rnn_rv)
 
         mask_x = T.cast(T.neq(x, padding_id) * z, theano.config.floatX).dimshuffle((0, 1, 'x'))
-        tiled_x_mask = T.tile(mask_x, (args.n, 1)).dimshuffle((1, 0, 2))
 
         if args.use_generator_h:
             h_concat_x = self.generator.word_level_h
@@ -89,35 +88,34 @@ class Encoder(object):
 
             h_concat_x = T.concatenate([h_f_x, h_r_x[::-1]], axis=2)
 
-        softmax_mask = T.zeros_like(tiled_x_mask) - 1e8
-        self.softmax_mask = softmax_mask = softmax_mask * (tiled_x_mask - 1)
+        # batch x inp_len, shared by the n questions of an article
+        softmax_mask = T.zeros_like(mask_x) - 1e8
+        self.softmax_mask = softmax_mask = (softmax_mask * (mask_x - 1)).dimshuffle((1, 0, 2)).flatten(2)
 
         # 1 x (batch * n) x n_d -> (batch * n) x (2 * n_d) x 1
         h_concat_y = T.concatenate([h_f_y, h_r_y], axis=2).dimshuffle((1, 2, 0))
 
-        # inp_len x batch x n_d -> inp_len x batch x (2 * n_d)
-        # (batch * n) x inp_len x (2 * n_d)
-        gen_h_final = T.tile(h_concat_x, (args.n, 1)).dimshuffle((1, 0, 2))
+        # (batch * n) x (2 * n_d)
+        q_y = h_concat_y.flatten(2)
 
         if args.bilinear:
-            bilinear_l = Bilinear(n_d, x.shape[1], args.n)
-            inp_dot_hl = bilinear_l.forward(gen_h_final, h_concat_y)
+            bilinear_l = Bilinear(n_d, args.n)
+            inp_dot_hl = bilinear_l.forward(h_concat_x, q_y)
 
             layers.append(bilinear_l)
         else:
-            # (batch * n) x inp_len x 1
-            inp_dot_hl = T.batched_dot(gen_h_final, h_concat_y)
+            # n x batch x inp_len
+            inp_dot_hl = grouped_scores(h_concat_x, q_y, args.n)
 
         h_size = n_d * 2
 
-        inp_dot_hl = inp_dot_hl - softmax_mask
-        inp_dot_hl = inp_dot_hl.ravel()
+        inp_dot_hl = inp_dot_hl - softmax_mask.dimshuffle(('x', 0, 1))
 
         # (batch * n) x inp_len
         self.alpha = alpha = T.nnet.softmax(inp_dot_hl.reshape((args.n * x.shape[1], x.shape[0])))
 
         # (batch * n) x n_d * 2
-        o = T.batched_dot(alpha, gen_h_final)
+        o = grouped_pool(alpha, h_concat_x, args.n)
 
         output_size = h_size * 4
         h_concat_y = h_concat_y.reshape((o.shape[0], o.shape[1]))
@@ -238,7 +236,6 @@ class Encoder(object):
         layers.append(rnn_rv)
 
         mask_x = T.cast(T.neq(x, padding_id) * z, theano.config.floatX).dimshuffle((0, 1, 'x'))
-        tiled_x_mask = T.tile(mask_x, (args.n, 1)).dimshuffle((1, 0, 2))
 
         if args.use_generator_h:
             h_concat_x = self.generator.word_level_h
@@ -259,35 +256,34 @@ class Encoder(object):
 
             h_concat_x = T.concatenate([h_f_x, h_r_x[::-1]], axis=2)
 
-        softmax_mask = T.zeros_like(tiled_x_mask) - 1e8
-        self.softmax_mask = softmax_mask = softmax_mask * (tiled_x_mask - 1)
+        # batch x inp_len, shared by the n questions of an article
+        softmax_mask = T.zeros_like(mask_x) - 1e8
+        self.softmax_mask = softmax_mask = (softmax_mask * (mask_x - 1)).dimshuffle((1, 0, 2)).flatten(2)
 
         # 1 x (batch * n) x n_d -> (batch * n) x (2 * n_d) x 1
         h_concat_y = T.concatenate([h_f_y, h_r_y], axis=2).dimshuffle((1, 2, 0))
 
-        # inp_len x batch x n_d -> inp_len x batch x (2 * n_d)
-        # (batch * n) x inp_len x (2 * n_d)
-        gen_h_final = T.tile(h_concat_x, (args.n, 1)).dimshuffle((1, 0, 2))
+        # (batch * n) x (2 * n_d)
+        q_y = h_concat_y.flatten(2)
 
         if args.bilinear:
-            bilinear_l = Bilinear(n_d, x.shape[1], args.n)
-            inp_dot_hl = bilinear_l.forward(gen_h_final, h_concat_y)
+            bilinear_l = Bilinear(n_d, args.n)
+            inp_dot_hl = bilinear_l.forward(h_concat_x, q_y)
 
             layers.append(bilinear_l)
         else:
-            # (batch * n) x inp_len x 1
-            inp_dot_hl = T.batched_dot(gen_h_final, h_concat_y)
+            # n x batch x inp_len
+            inp_dot_hl = grouped_scores(h_concat_x, q_y, args.n)
 
         h_size = n_d * 2
 
-        inp_dot_hl = inp_dot_hl - softmax_mask
-        inp_dot_hl = inp_dot_hl.ravel()
+        inp_dot_hl = inp_dot_hl - softmax_mask.dimshuffle(('x', 0, 1))
 
         # (batch * n) x inp_len
         self.alpha = alpha = T.nnet.softmax(inp_dot_hl.reshape((args.n * x.shape[1], x.shape[0])))
 
         # (batch * n) x n_d * 2
-        o = T.batched_dot(alpha, gen_h_final)
+        o = grouped_pool(alpha, h_concat_x, args.n)
 
         if args.qa_performance == 'none':
             o = T.zeros_like(o)
@@ -394,7 +390,6 @@ class QAEncoder(object):
         if not args.qa_hl_only:
             self.x = x = T.imatrix('x')
             mask_x = T.cast(T.neq(x, padding_id), theano.config.floatX).dimshuffle((0, 1, 'x'))
-            tiled_x_mask = T.tile(mask_x, (args.n, 1)).dimshuffle((1, 0, 2))
 
             embs = embedding_layer.forward(x.ravel())
 
@@ -409,32 +404,31 @@ class QAEncoder(object):
 
             h_concat_x = T.concatenate([h_f_x, h_r_x[::-1]], axis=2)
 
-            softmax_mask = T.zeros_like(tiled_x_mask) - 1e8
-            self.softmax_mask = softmax_mask = softmax_mask * (tiled_x_mask - 1)
+            # batch x inp_len, shared by the n questions of an article
+            softmax_mask = T.zeros_like(mask_x) - 1e8
+            self.softmax_mask = softmax_mask = (softmax_mask * (mask_x - 1)).dimshuffle((1, 0, 2)).flatten(2)
 
-            # inp_len x batch x n_d -> inp_len x batch x (2 * n_d)
-            # (batch * n) x inp_len x (2 * n_d)
-            gen_h_final = T.tile(h_concat_x, (args.n, 1)).dimshuffle((1, 0, 2))
+            # (batch * n) x (2 * n_d)
+            q_y = h_concat_y.flatten(2)
 
             if args.bilinear:
-                bilinear_l = Bilinear(n_d, x.shape[1], args.n)
-                inp_dot_hl = bilinear_l.forward(gen_h_final, h_concat_y)
+                bilinear_l = Bilinear(n_d, args.n)
+                inp_dot_hl = bilinear_l.forward(h_concat_x, q_y)
 
                 layers.append(bilinear_l)
             else:
-                # (batch * n) x inp_len x 1
-                inp_dot_hl = T.batched_dot(gen_h_final, h_concat_y)
+                # n x batch x inp_len
+                inp_dot_hl = grouped_scores(h_concat_x, q_y, args.n)
 
             h_size = n_d * 2
 
-            inp_dot_hl = inp_dot_hl - softmax_mask
-            inp_dot_hl = inp_dot_hl.ravel()
+            inp_dot_hl = inp_dot_hl - softmax_mask.dimshuffle(('x', 0, 1))
 
             # (batch * n) x inp_len
             self.alpha = alpha = T.nnet.softmax(inp_dot_hl.reshape((args.n * x.shape[1], x.shape[0])))
 
             # (batch * n) x n_d * 2
-            o = T.batched_dot(alpha, gen_h_final)
+            o = grouped_pool(alpha, h_concat_x, args.n)
 
             output_size = h_size * 4
             h_concat_y = h_concat_y.reshape((o.shape[0], o.shape[1]))
@@ -7,8 +7,8 @@ from nn.initialization import get_activation_by_name
 
 
 class MaskedLSTM(LSTM):
-    def forward_m(self, x_t, mask_t, hc_tm1):
-        hc_t = super(MaskedLSTM, self).forward(x_t, hc_tm1)
+    def forward_m(self, xw_t, mask_t, hc_tm1, W_h):
+        hc_t = self.forward_fused(xw_t, hc_tm1, W_h)
         hc_t = mask_t * hc_t + (1 - mask_t) * hc_tm1
 
         return hc_t
@@ -19,10 +19,13 @@ class MaskedLSTM(LSTM):
                 h0 = T.zeros((x.shape[1], self.n_out*2), dtype=theano.config.floatX)
             else:
                 h0 = T.zeros((self.n_out * 2,), dtype=theano.config.floatX)
+        W_x, W_h, b = self.fused_weights()
+
         h, _ = theano.scan(
             fn=self.forward_m,
-            sequences=[x, mask],
-            outputs_info=[h0]
+            sequences=[T.dot(x, W_x) + b, mask],
+            outputs_info=[h0],
+            non_sequences=[W_h]
         )
 
         if return_c:
@@ -38,10 +41,13 @@ class MaskedLSTM(LSTM):
                 h0 = T.zeros((x.shape[1], self.n_out*2), dtype=theano.config.floatX)
             else:
                 h0 = T.zeros((self.n_out * 2,), dtype=theano.config.floatX)
+        W_x, W_h, b = self.fused_weights()
+
         h, _ = theano.scan(
             fn=self.forward_m,
-            sequences=[x, mask],
-            outputs_info=[h0]
+            sequences=[T.dot(x, W_x) + b, mask],
+            outputs_info=[h0],
+            non_sequences=[W_h]
         )
 
         if return_c:
@@ -72,9 +78,8 @@ class Sampler(LSTM):
                                     has_bias=True,
                                     clip_inp=True)
 
-    def _forward(self, x_t, x_tm1, posit_x_t, mask_t, hc_tm1):
-        x_tm1 = x_tm1 * mask_t
-        hc_t = super(Sampler, self).forward(x_tm1, hc_tm1)
+    def _forward(self, x_t, xw_tm1, posit_x_t, mask_t, hc_tm1, W_h, b):
+        hc_t = self.forward_fused(mask_t * xw_tm1 + b, hc_tm1, W_h)
 
         concat_in = T.concatenate([x_t, posit_x_t, hc_t], axis=1)
         a_t = self.fc_layer.forward(concat_in)
@@ -82,9 +87,8 @@ class Sampler(LSTM):
 
         return hc_t, pt
 
-    def _forward_inf(self, x_t, x_tm1, posit_x_t, mask_t, hc_tm1):
-        x_tm1 = x_tm1 * mask_t
-        hc_t = super(Sampler, self).forward(x_tm1, hc_tm1)
+    def _forward_inf(self, x_t, xw_tm1, posit_x_t, mask_t, hc_tm1, W_h, b):
+        hc_t = self.forward_fused(mask_t * xw_tm1 + b, hc_tm1, W_h)
 
         concat_in = T.concatenate([x_t, posit_x_t, hc_t], axis=1)
         a_t = self.fc_layer.forward(concat_in)
@@ -93,32 +97,44 @@ class Sampler(LSTM):
         mask_next = T.cast(T.round(pt, mode='half_away_from_zero'), theano.config.floatX).reshape((x_t.shape[0],))
         return mask_next.dimshuffle((0, 'x')), hc_t, pt
 
-    def _forward_sample(self, x_t, x_tm1, posit_x_t, mask_t, hc_tm1):
-        x_tm1 = x_tm1 * mask_t
-        hc_t = super(Sampler, self).forward(x_tm1, hc_tm1)
+    def _forward_sample(self, x_t, xw_tm1, posit_x_t, mask_t, hc_tm1, W_h, b):
+        hc_t = self.forward_fused(mask_t * xw_tm1 + b, hc_tm1, W_h)
 
         concat_in = T.concatenate([x_t, posit_x_t, hc_t], axis=1)
         a_t = self.fc_layer.forward(concat_in)
         pt = self.fc_layer_final.forward(a_t).ravel()
 
-        mask_next = T.cast(self.MRG_rng.binomial(size=pt.shape,
-                                           p=pt), theano.config.floatX)
-        mask_next = mask_next.reshape((-1,1))
-        return mask_next, hc_t
+        # the sample only feeds the next step as a constant, gradients go through pt
+        sample_t = theano.gradient.disconnected_grad(T.cast(self.MRG_rng.binomial(size=pt.shape,
+                                                                                  p=pt), theano.config.floatX))
+        logp_t = - T.nnet.binary_crossentropy(pt, sample_t)
 
-    def pt_forward_all(self, x, posit_x, mask):
-        h0 = T.zeros((x.shape[1], self.n_out*2), dtype=theano.config.floatX)
+        return sample_t.reshape((-1, 1)), hc_t, pt, logp_t
 
+    def project_shifted(self, x):
+        '''
+            x_tm1 W_x for every step at once (zero for the first one). The mask
+            is a 0/1 factor per article, so it is applied to the projection in
+            the step, followed by the bias.
+        '''
         padded = T.shape_padaxis(T.zeros_like(x[0]), axis=1).dimshuffle((1, 0, 2))
         x_shifted = T.concatenate([padded, x[:-1]], axis=0)
 
+        return T.dot(x_shifted, self.fused_weights()[0])
+
+    def pt_forward_all(self, x, posit_x, mask):
+        h0 = T.zeros((x.shape[1], self.n_out*2), dtype=theano.config.floatX)
+
+        xw_shifted = self.project_shifted(x)
+
         padded_mask = T.shape_padaxis(T.zeros_like(mask[0]), axis=1).dimshuffle((1, 0))
         mask = T.concatenate([padded_mask, mask[:-1]], axis=0).dimshuffle((0, 1, 'x'))
 
         o, _ = theano.scan(
             fn=self._forward,
-            sequences=[x, x_shifted, posit_x, mask],
-            outputs_info=[h0, None]
+            sequences=[x, xw_shifted, posit_x, mask],
+            outputs_info=[h0, None],
+            non_sequences=self.fused_weights()[1:]
         )
 
         new_probs = o[1].reshape((x.shape[0], x.shape[1]))
@@ -130,40 +146,32 @@ class Sampler(LSTM):
         if not inference:
             return self._forward_all_sample(x, posit_x, h0)
 
-        padded = T.shape_padaxis(T.zeros_like(x[0]), axis=1).dimshuffle((1, 0, 2))
-        x_shifted = T.concatenate([padded, x[:-1]], axis=0)
+        xw_shifted = self.project_shifted(x)
         mask = T.zeros(shape=(x.shape[1],)).dimshuffle((0, 'x'))
 
         o, _ = theano.scan(
             fn=self._forward_inf,
-            sequences=[x, x_shifted, posit_x],
-            outputs_info=[mask, h0, None]
+            sequences=[x, xw_shifted, posit_x],
+            outputs_info=[mask, h0, None],
+            non_sequences=self.fused_weights()[1:]
         )
 
         new_probs = o[2].reshape((x.shape[0], x.shape[1]))
         return new_probs
 
     def _forward_all_sample(self, x, posit_x, h0):
-        padded = T.shape_padaxis(T.zeros_like(x[0]), axis=1).dimshuffle((1, 0, 2))
-        x_shifted = T.concatenate([padded, x[:-1]], axis=0)
+        xw_shifted = self.project_shifted(x)
         mask = T.zeros(shape=(x.shape[1],)).dimshuffle((0, 'x'))
 
-        [s, _], updates = theano.scan(
+        [s, _, probs, logpz], updates = theano.scan(
             fn=self._forward_sample,
-            sequences=[x, x_shifted, posit_x],
-            outputs_info=[mask, h0]
-        )
-        samples = theano.gradient.disconnected_grad(s).reshape((x.shape[0], x.shape[1]))
-        padded_mask = T.shape_padaxis(T.zeros_like(samples[0]), axis=1).dimshuffle((1, 0))
-        mask_from_samples = T.concatenate([padded_mask, samples[:-1]], axis=0).dimshuffle((0, 1, 'x'))
-
-        [_, probs], _ = theano.scan(
-            fn=self._forward,
-            sequences=[x, x_shifted, posit_x, mask_from_samples],
-            outputs_info=[h0, None]
+            sequences=[x, xw_shifted, posit_x],
+            outputs_info=[mask, h0, None, None],
+            non_sequences=self.fused_weights()[1:]
         )
+        samples = s.reshape((x.shape[0], x.shape[1]))
 
-        return probs.reshape((x.shape[0], x.shape[1])), updates, samples
+        return probs, updates, samples, logpz
 
     def copy_params(self, from_obj):
         self.internal_layers = from_obj.internal_layers
@@ -67,16 +67,12 @@ class Generator(object):
         embs_p = embedding_layer_posit.forward(posit_x.ravel())
         self.embs_p = embs_p = embs_p.reshape((bm.shape[0], bm.shape[1], embedding_layer_posit.n_d))
 
-        reduced_p_embs, _ = theano.scan(fn=self.c_reduce,
-                                        sequences=[embs_p.dimshuffle((1, 0, 2)), self.fw_mask.dimshuffle((1, 0))])
-        reduced_p_embs = reduced_p_embs.dimshuffle((1, 0, 2))
+        reduced_p_embs = self.c_reduce(embs_p, self.fw_mask)
 
         if not self.args.word_level_c:
             new_bm = T.cast(bm, theano.config.floatX)
 
-            new_bm, _ = theano.scan(fn=self.bm_reduce,
-                                    sequences=[new_bm.dimshuffle((1, 0)), self.fw_mask.dimshuffle((1, 0))])
-            new_bm = new_bm.dimshuffle((1, 0))
+            new_bm = self.c_reduce(new_bm, self.fw_mask)
         else:
             new_bm = T.cast(bm, theano.config.floatX)
 
@@ -98,10 +94,7 @@ class Generator(object):
 
         sz = T.cast(T.round(new_probs, mode='half_away_from_zero'), theano.config.floatX)
 
-        z_pred_word_level, _ = theano.scan(fn=self.c_project,
-                                           sequences=[sz.dimshuffle((1, 0)), self.chunk_sizes.dimshuffle((1, 0))]
-                                           )
-        self.non_sampled_zpred = z = z_pred_word_level.dimshuffle((1, 0))
+        self.non_sampled_zpred = z = self.c_project(sz, self.chunk_sizes)
 
         self.zsum = T.sum(z, axis=0, dtype=theano.config.floatX)
         self.zdiff = T.sum(T.abs_(z[1:] - z[:-1]), axis=0, dtype=theano.config.floatX)
@@ -135,9 +128,7 @@ class Generator(object):
         embs_p = embedding_layer_posit.forward(posit_x.ravel())
         self.embs_p = embs_p = embs_p.reshape((bm.shape[0], bm.shape[1], embedding_layer_posit.n_d))
 
-        reduced_p_embs, _ = theano.scan(fn=self.c_reduce,
-                                        sequences=[embs_p.dimshuffle((1, 0, 2)), self.fw_mask.dimshuffle((1, 0))])
-        reduced_p_embs = reduced_p_embs.dimshuffle((1, 0, 2))
+        reduced_p_embs = self.c_reduce(embs_p, self.fw_mask)
 
         final_concat_d = self.size + embedding_layer_posit.n_d + 128 * 2
 
@@ -149,18 +140,15 @@ class Generator(object):
         if inference:
             probs = output_rnn.s_forward_all(self.h_final, reduced_p_embs, inference)
             samples = T.cast(T.round(probs, mode='half_away_from_zero'), theano.config.floatX)
+            logpz = - T.nnet.binary_crossentropy(probs, samples)
         else:
-            probs, updates, samples = output_rnn.s_forward_all(self.h_final, reduced_p_embs, inference)
+            probs, updates, samples, logpz = output_rnn.s_forward_all(self.h_final, reduced_p_embs, inference)
             self.sample_updates = updates
 
         self.chunk_samples = samples
 
-        z_pred_word_level, _ = theano.scan(fn=self.c_project,
-                                           sequences=[samples.dimshuffle((1, 0)),
-                                                      self.chunk_sizes.dimshuffle((1, 0))]
-                                           )
-        self.non_sampled_zpred = self.z_pred = z_pred_word_level = z_pred_word_level.dimshuffle((1, 0))
-        self.logpz = - T.nnet.binary_crossentropy(probs, samples) * self.pad_mask
+        self.non_sampled_zpred = self.z_pred = z_pred_word_level = self.c_project(samples, self.chunk_sizes)
+        self.logpz = logpz * self.pad_mask
         self.probz = probs
         self.samps = samples
 
@@ -230,15 +218,8 @@ class Generator(object):
 
         self.word_level_h = apply_dropout(T.concatenate([h1, h2], axis=2), self.dropout)
 
-        h1_red, _ = theano.scan(fn=self.c_reduce,
-                                sequences=[h1.dimshuffle((1, 0, 2)), fw_mask.dimshuffle((1, 0))]
-                                )
-        h2_red, _ = theano.scan(fn=self.c_reduce,
-                                sequences=[h2.dimshuffle((1, 0, 2)), rv_mask.dimshuffle((1, 0))]
-                                )
-
-        h1_red = h1_red.dimshuffle((1, 0, 2))
-        h2_red = h2_red.dimshuffle((1, 0, 2))
+        h1_red = self.c_reduce(h1, fw_mask)
+        h2_red = self.c_reduce(h2, rv_mask)
 
         h_final = T.concatenate([h1_red, h2_red], axis=2)
         size = n_d * 2
@@ -284,13 +265,9 @@ class Generator(object):
             padded_pooled = T.concatenate([pooled, zeros], axis=1)
             pool_out.append(padded_pooled)
 
-        c_flat = chunk_sizes.dimshuffle((1, 0))
         m_flat = rv_mask.dimshuffle((1, 0)).ravel()
 
-        c_rep, _ = theano.scan(fn=self.c_project,
-                               sequences=[c_flat,
-                                          c_flat])
-
+        c_rep = self.c_project(chunk_sizes, chunk_sizes).dimshuffle((1, 0))
         c_rep = c_rep.ravel() * m_flat
 
         all_chunks = [cnn_concat] + pool_out
@@ -308,26 +285,51 @@ class Generator(object):
             pooled_chunks.append(isolated_chunks.reshape((embs.shape[1], embs.shape[0], size)))
 
         h = pooled_chunks[0] + pooled_chunks[1] + pooled_chunks[2] + pooled_chunks[3] + pooled_chunks[4]
-        o1, _ = theano.scan(fn=self.c_reduce, sequences=[h, rv_mask.dimshuffle((1, 0))])
-
-        h_final = o1.dimshuffle((1, 0, 2))
+        h_final = self.c_reduce(h.dimshuffle((1, 0, 2)), rv_mask)
 
         return h_final, size
 
     def c_reduce(self, h, m):
-        a = h[(m > 0).nonzero()]
-        ze = T.zeros(shape=(h.shape[0] - a.shape[0], h.shape[1]))
+        '''
+            Moves the steps of h (inp_len x batch, or inp_len x batch x d) where m
+            is non zero to the front of each article, in order, and zero pads.
+            Done as one gather for the whole batch, the order of the steps comes
+            from sorting the kept positions ahead of the others.
+        '''
+        n_steps, n_batch = m.shape[0], m.shape[1]
+        positions = T.arange(n_steps).dimshuffle((0, 'x'))
+
+        kept = T.gt(m, 0)
+        order = T.argsort(T.switch(kept, positions, positions + n_steps), axis=0)
+        used = T.lt(positions, T.sum(kept, axis=0).dimshuffle(('x', 0)))
 
-        return T.concatenate([a, ze], axis=0)
+        flat_idx = (order * n_batch + T.arange(n_batch).dimshuffle(('x', 0))).ravel()
 
-    def bm_reduce(self, h, m):
-        a = h[(m > 0).nonzero()]
-        ze = T.zeros(shape=(h.shape[0] - a.shape[0],))
+        if h.ndim == 3:
+            a = h.reshape((n_steps * n_batch, h.shape[2]))[flat_idx].reshape(h.shape)
+            return a * used.dimshuffle((0, 1, 'x'))
 
-        return T.concatenate([a, ze], axis=0)
+        return h.ravel()[flat_idx].reshape(h.shape) * used
 
     def c_project(self, h, m):
-        valid_projection_truncated = T.repeat(h, m)
-        zs = T.zeros(shape=(h.shape[0] - valid_projection_truncated.shape[0],))
+        '''
+            Repeats entry k of each article of h (inp_len x batch) m[k] times, and
+            zero pads. Done as one gather for the whole batch, the entry each step
+            comes from counts the chunk ends (cumsum of m) at or before it.
+        '''
+        n_steps, n_batch = h.shape[0], h.shape[1]
+        positions = T.arange(n_steps).dimshuffle((0, 'x'))
+        columns = T.arange(n_batch).dimshuffle(('x', 0))
+
+        ends = T.cumsum(m, axis=0)
+
+        # one extra row for the chunks ending at the last step
+        chunk_ends = T.zeros(((n_steps + 1) * n_batch,), dtype='int32')
+        chunk_ends = T.inc_subtensor(chunk_ends[(ends * n_batch + columns).ravel()], T.gt(m, 0).ravel())
+
+        entries = T.cumsum(chunk_ends.reshape((n_steps + 1, n_batch))[:-1], axis=0)
+        used = T.lt(positions, ends[-1].dimshuffle(('x', 0)))
+
+        flat_idx = (T.minimum(entries, n_steps - 1) * n_batch + columns).ravel()
 
-        return T.concatenate([valid_projection_truncated, zs], axis=0)
\ No newline at end of file
+        return h.ravel()[flat_idx].reshape(h.shape) * used
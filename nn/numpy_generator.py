@@ -0,0 +1,246 @@
+'''
+    NumPy version of the Generator at inference, Model.ready_test followed by
+    Model.test, for scoring articles without building and compiling the theano
+    graph. It reads the generator params saved by Model.save_model and
+    computes the same non_sampled_zpred: the encoder (lstm or cnn), the chunk
+    reduction and the greedy recurrence of the Sampler, a batch at a time.
+'''
+
+import numpy as np
+
+from util import checkpoint_io
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def relu(x):
+    return x * (x > 0)
+
+
+def get_activation_by_name(name):
+    if name.lower() == "relu":
+        return relu
+    elif name.lower() == "sigmoid":
+        return sigmoid
+    elif name.lower() == "tanh":
+        return np.tanh
+    elif name.lower() == "none" or name.lower() == "linear":
+        return lambda x: x
+    else:
+        raise Exception(
+            "unknown activation type: {}".format(name)
+          )
+
+
+def c_reduce(h, m):
+    '''
+        As Generator.c_reduce : the steps of h (inp_len x batch [x d]) where m is
+        non zero, moved to the front of each article and zero padded.
+    '''
+    positions = np.arange(m.shape[0])[:, None]
+
+    kept = m > 0
+    order = np.argsort(np.where(kept, positions, positions + m.shape[0]), axis=0)
+    used = positions < kept.sum(axis=0)[None, :]
+
+    if h.ndim == 3:
+        return np.take_along_axis(h, order[:, :, None], axis=0) * used[:, :, None]
+
+    return np.take_along_axis(h, order, axis=0) * used
+
+
+def c_project(h, m):
+    '''
+        As Generator.c_project : entry k of each article of h (inp_len x batch)
+        repeated m[k] times, and zero padded.
+    '''
+    n_steps, n_batch = h.shape
+    positions = np.arange(n_steps)[:, None]
+    columns = np.arange(n_batch)[None, :]
+
+    ends = np.cumsum(m, axis=0)
+
+    chunk_ends = np.zeros((n_steps + 1, n_batch), dtype='int32')
+    np.add.at(chunk_ends, (ends, np.broadcast_to(columns, ends.shape)), m > 0)
+
+    entries = np.cumsum(chunk_ends[:-1], axis=0)
+    used = positions < ends[-1][None, :]
+
+    return h[np.minimum(entries, n_steps - 1), columns] * used
+
+
+class LSTM(object):
+    '''
+        LSTM of nn.basic from its params (W and b of the input layer, in, forget
+        and out gates), with the gates fused as in LSTM.fused_weights.
+    '''
+
+    def __init__(self, params, activation=np.tanh):
+        W = [params[k] for k in xrange(0, 8, 2)]
+        self.n_out = W[0].shape[1]
+        self.n_in = W[0].shape[0] - self.n_out
+        self.activation = activation
+
+        self.W_x = np.concatenate([w[:self.n_in] for w in W], axis=1)
+        self.W_h = np.concatenate([w[self.n_in:] for w in W], axis=1)
+        self.b = np.concatenate([params[k] for k in xrange(1, 8, 2)])
+
+    def forward(self, xw, c_tm1, h_tm1):
+        n_out = self.n_out
+        gates = xw + np.dot(h_tm1, self.W_h)
+
+        input_t = self.activation(gates[:, :n_out])
+        in_t = sigmoid(gates[:, n_out:2 * n_out])
+        forget_t = sigmoid(gates[:, 2 * n_out:3 * n_out])
+        out_t = sigmoid(gates[:, 3 * n_out:])
+
+        c_t = forget_t * c_tm1 + in_t * input_t
+        h_t = out_t * np.tanh(c_t)
+
+        return c_t, h_t
+
+    def forward_all(self, x):
+        xw = np.dot(x, self.W_x) + self.b
+
+        c = h = np.zeros((x.shape[1], self.n_out), dtype=x.dtype)
+        h_all = np.zeros((x.shape[0], x.shape[1], self.n_out), dtype=x.dtype)
+
+        for t in xrange(x.shape[0]):
+            c, h = self.forward(xw[t], c, h)
+            h_all[t] = h
+
+        return h_all
+
+
+class Sampler(LSTM):
+    '''
+        Sampler._forward_inf over all the steps : the chunk of step t goes in the
+        LSTM input only if the chunk of step t - 1 was selected.
+    '''
+
+    def __init__(self, params, fc_params, fc_final_params):
+        super(Sampler, self).__init__(params)
+        self.fc_W, self.fc_b = fc_params
+        self.fc_final_W, self.fc_final_b = fc_final_params
+
+    def forward_all(self, x, posit_x):
+        n_steps, n_batch = x.shape[0], x.shape[1]
+
+        # x_tm1 W_x, zero for the first step
+        xw_shifted = np.zeros((n_steps, n_batch, self.W_x.shape[1]), dtype=x.dtype)
+        xw_shifted[1:] = np.dot(x[:-1], self.W_x)
+
+        mask = np.zeros((n_batch, 1), dtype=x.dtype)
+        c = h = np.zeros((n_batch, self.n_out), dtype=x.dtype)
+        probs = np.zeros((n_steps, n_batch), dtype=x.dtype)
+
+        for t in xrange(n_steps):
+            c, h = self.forward(mask * xw_shifted[t] + self.b, c, h)
+
+            a_t = relu(np.dot(np.concatenate([x[t], posit_x[t], c, h], axis=1), self.fc_W) + self.fc_b)
+            pt = np.clip(sigmoid(np.dot(a_t, self.fc_final_W) + self.fc_final_b), 1e-7, 1.0 - 1e-7)
+
+            # round half away from zero, pt is positive
+            mask = np.floor(pt + 0.5)
+            probs[t] = pt[:, 0]
+
+        return probs
+
+
+class Generator(object):
+    '''
+        The Generator of nn.generator at inference, from the generator params of
+        a saved model, in the order of Generator.params.
+    '''
+
+    window_sizes = [1, 3, 5, 7]
+    pool_sizes = [2, 3, 4, 5]
+
+    def __init__(self, args, params):
+        self.args = args
+        params = [np.asarray(p) for p in params]
+
+        if args.generator_encoding == 'cnn':
+            n_enc = 2 * len(self.window_sizes)
+            self.filters = [(params[k], params[k + 1]) for k in xrange(0, n_enc, 2)]
+        else:
+            n_enc = 16
+            activation = get_activation_by_name(args.activation)
+            self.rnn_fw = LSTM(params[:8], activation)
+            self.rnn_rv = LSTM(params[8:16], activation)
+
+        self.sampler = Sampler(params[n_enc:n_enc + 8], params[n_enc + 8:n_enc + 10], params[n_enc + 10:n_enc + 12])
+        self.embeddings, self.embeddings_posit = params[n_enc + 12:n_enc + 14]
+
+    def forward(self, x, posit_x, fw_mask, chunk_sizes):
+        '''
+            non_sampled_zpred of Model.ready_test for one batch (inp_len x batch
+            arrays, as given to the test function).
+        '''
+        x, posit_x = np.asarray(x), np.asarray(posit_x)
+        fw_mask, chunk_sizes = np.asarray(fw_mask), np.asarray(chunk_sizes)
+
+        rv_mask = np.concatenate([np.ones((1, fw_mask.shape[1]), dtype=fw_mask.dtype), fw_mask[:-1]], axis=0)
+
+        embs = self.embeddings[x]
+
+        if self.args.generator_encoding == 'cnn':
+            h_final = self.cnn_encoding(embs, chunk_sizes, rv_mask)
+        else:
+            h1 = self.rnn_fw.forward_all(embs)
+            h2 = self.rnn_rv.forward_all(embs[::-1])[::-1]
+
+            h_final = np.concatenate([c_reduce(h1, fw_mask), c_reduce(h2, rv_mask)], axis=2)
+
+        reduced_p_embs = c_reduce(self.embeddings_posit[posit_x], fw_mask)
+
+        probs = self.sampler.forward_all(h_final, reduced_p_embs)
+        samples = np.floor(probs + 0.5)
+
+        return c_project(samples, chunk_sizes)
+
+    def cnn_encoding(self, embs, chunk_sizes, rv_mask):
+        n_steps = embs.shape[0]
+
+        conv_out = []
+        for filt, bias in self.filters:
+            window = filt.shape[2]
+            border = window / 2
+
+            padded = np.zeros((n_steps + 2 * border,) + embs.shape[1:], dtype=embs.dtype)
+            padded[border:border + n_steps] = embs
+
+            # conv2d flips the filter
+            out = bias + sum(np.dot(padded[k:k + n_steps], filt[:, :, window - 1 - k, 0].T) for k in xrange(window))
+            conv_out.append(out)
+
+        cnn_concat = relu(np.concatenate(conv_out, axis=2))
+
+        # chunk of size s starting at a step : the max over its s steps
+        all_chunks = [cnn_concat]
+        for p in self.pool_sizes:
+            pooled = np.zeros_like(cnn_concat)
+            if n_steps >= p:
+                pooled[:n_steps - p + 1] = np.max([cnn_concat[k:n_steps - p + 1 + k] for k in xrange(p)], axis=0)
+            all_chunks.append(pooled)
+
+        c_rep = c_project(chunk_sizes, chunk_sizes) * rv_mask
+
+        h = np.zeros_like(cnn_concat)
+        for m in xrange(len(all_chunks)):
+            h += all_chunks[m] * (c_rep == m + 1)[:, :, None]
+
+        return c_reduce(h, rv_mask)
+
+
+def load_generator(path):
+    '''
+        The Generator and training args of a model saved by Model.save_model,
+        full or pretrain, in either checkpoint format.
+    '''
+    loaded = checkpoint_io.load_model(path)
+    gparams, args = loaded[-2], loaded[-1]
+
+    return Generator(args, gparams), args
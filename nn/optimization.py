@@ -105,6 +105,15 @@ def get_subtensor_op_inputs(p):
     return origin, indexes
 
 
+def get_shared(p):
+    '''
+        The shared variable behind a param, also when it is a subtensor.
+    '''
+    if is_subtensor_op(p):
+        return get_subtensor_op_inputs(p)[0]
+    return p
+
+
 def get_similar_subtensor(matrix, indexes, param_op):
     '''
         So far there is only two possible subtensor operation used.
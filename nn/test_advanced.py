@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+import theano
+import theano.tensor as T
+
+from nn.advanced import Bilinear, grouped_scores, grouped_pool
+
+
+def tiled_states(h, n):
+    '''
+        The document states as the encoders tiled them before grouped_scores,
+        inp_len x batch x d -> (n * batch) x inp_len x d.
+    '''
+    return T.tile(h, (n, 1)).dimshuffle((1, 0, 2))
+
+
+def tiled_scores(h, q, n):
+    # (n * batch) x inp_len
+    return T.batched_dot(tiled_states(h, n), q.dimshuffle((0, 1, 'x'))).flatten(2)
+
+
+def tiled_pool(alpha, h, n):
+    return T.batched_dot(alpha, tiled_states(h, n))
+
+
+def tiled_bilinear(w1, h, q, n):
+    h_final = tiled_states(h, n)
+    w1_tiled = T.tile(w1, (h_final.shape[0], 1, 1))
+
+    bilinear = T.batched_dot(h_final, w1_tiled)
+
+    return T.batched_dot(bilinear, q.dimshuffle((0, 1, 'x'))).flatten(2)
+
+
+class GroupedAttentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(19)
+
+    def random(self, *shape):
+        return self.rng.randn(*shape).astype(theano.config.floatX)
+
+    def assert_close(self, new, old):
+        self.assertEqual(new.shape, old.shape)
+        self.assertTrue(np.allclose(new, old, rtol=1e-4, atol=1e-5))
+
+    def test_scores_and_pool(self):
+        h, q, alpha, w = T.tensor3(), T.matrix(), T.matrix(), T.matrix()
+        n = T.iscalar()
+
+        new_s = grouped_scores(h, q, n)
+        new_s = new_s.reshape((n * h.shape[1], h.shape[0]))
+        old_s = tiled_scores(h, q, n)
+
+        new_o, old_o = grouped_pool(alpha, h, n), tiled_pool(alpha, h, n)
+
+        cost_new = T.sum(new_s * alpha) + T.sum(new_o * w)
+        cost_old = T.sum(old_s * alpha) + T.sum(old_o * w)
+
+        f = theano.function([h, q, alpha, w, n], [new_s, old_s, new_o, old_o] +
+                            T.grad(cost_new, [h, q, alpha]) + T.grad(cost_old, [h, q, alpha]))
+
+        for inp_len, batch, d, n_q in [(1, 1, 2, 1), (6, 3, 4, 2), (9, 2, 5, 4)]:
+            out = f(self.random(inp_len, batch, d), self.random(n_q * batch, d),
+                    self.random(n_q * batch, inp_len), self.random(n_q * batch, d), n_q)
+
+            self.assert_close(out[0], out[1])
+            self.assert_close(out[2], out[3])
+
+            for new, old in zip(out[4:7], out[7:]):
+                self.assert_close(new, old)
+
+    def test_bilinear(self):
+        h, q = T.tensor3(), T.matrix()
+        inp_len, batch, d, n_q = 7, 3, 2, 3
+
+        layer = Bilinear(d, n_q)
+        layer.w1.set_value(self.random(2 * d, 2 * d))
+
+        new = layer.forward(h, q).reshape((n_q * h.shape[1], h.shape[0]))
+        old = tiled_bilinear(layer.w1, h, q, n_q)
+
+        f = theano.function([h, q], [new, old, T.grad(T.sum(new ** 2), layer.w1), T.grad(T.sum(old ** 2), layer.w1)])
+
+        out = f(self.random(inp_len, batch, 2 * d), self.random(n_q * batch, 2 * d))
+
+        self.assert_close(out[0], out[1])
+        self.assert_close(out[2], out[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+import numpy as np
+import theano
+import theano.tensor as T
+
+from nn.generator import Generator
+
+
+def scan_c_reduce(h, m):
+    '''
+        Generator.c_reduce before the batched gather, one article per step.
+    '''
+    def reduce_article(h, m):
+        a = h[(m > 0).nonzero()]
+        ze = T.zeros(shape=(h.shape[0] - a.shape[0],) + tuple(h.shape[i] for i in xrange(1, h.ndim)))
+        return T.concatenate([a, ze], axis=0)
+
+    if h.ndim == 3:
+        o, _ = theano.scan(fn=reduce_article, sequences=[h.dimshuffle((1, 0, 2)), m.dimshuffle((1, 0))])
+        return o.dimshuffle((1, 0, 2))
+
+    o, _ = theano.scan(fn=reduce_article, sequences=[h.dimshuffle((1, 0)), m.dimshuffle((1, 0))])
+    return o.dimshuffle((1, 0))
+
+
+def scan_c_project(h, m):
+    '''
+        Generator.c_project before the batched gather, one article per step.
+    '''
+    def project_article(h, m):
+        valid_projection_truncated = T.repeat(h, m)
+        zs = T.zeros(shape=(h.shape[0] - valid_projection_truncated.shape[0],))
+        return T.concatenate([valid_projection_truncated, zs], axis=0)
+
+    o, _ = theano.scan(fn=project_article, sequences=[h.dimshuffle((1, 0)), m.dimshuffle((1, 0))])
+    return o.dimshuffle((1, 0))
+
+
+def random_masks(rng, n_steps, n_batch):
+    m = (rng.rand(n_steps, n_batch) < 0.5).astype('int32')
+
+    # nothing kept and everything kept
+    m[:, 0] = 0
+    m[:, 1] = 1
+
+    return m
+
+
+def random_chunk_sizes(rng, n_steps, n_batch):
+    # chunk sizes of each article, ending anywhere up to n_steps, zeros after them
+    sizes = np.zeros((n_steps, n_batch), dtype='int32')
+
+    for j in xrange(n_batch):
+        total, k = rng.randint(0, n_steps + 1), 0
+
+        while total > 0:
+            sizes[k, j] = min(total, rng.randint(1, 4))
+            total -= sizes[k, j]
+            k += 1
+
+    return sizes
+
+
+class ChunkGatherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = Generator(None, None, None)
+        self.rng = np.random.RandomState(17)
+
+    def test_c_reduce(self):
+        h3, h2, m = T.tensor3(), T.matrix(), T.imatrix()
+        w = T.tensor3()
+
+        new3, old3 = self.generator.c_reduce(h3, m), scan_c_reduce(h3, m)
+        new2, old2 = self.generator.c_reduce(h2, m), scan_c_reduce(h2, m)
+
+        f = theano.function([h3, h2, m, w], [new3, old3, new2, old2,
+                                            T.grad(T.sum(new3 * w), h3), T.grad(T.sum(old3 * w), h3)])
+
+        for n_steps, n_batch in [(1, 2), (7, 4), (12, 5)]:
+            hv3 = self.rng.randn(n_steps, n_batch, 3).astype(theano.config.floatX)
+            hv2 = self.rng.randn(n_steps, n_batch).astype(theano.config.floatX)
+            wv = self.rng.randn(n_steps, n_batch, 3).astype(theano.config.floatX)
+
+            out = f(hv3, hv2, random_masks(self.rng, n_steps, n_batch), wv)
+
+            for new, old in zip(out[::2], out[1::2]):
+                self.assertEqual(new.shape, old.shape)
+                self.assertTrue(np.array_equal(new, old))
+
+    def test_c_project(self):
+        h, m = T.matrix(), T.imatrix()
+
+        f = theano.function([h, m], [self.generator.c_project(h, m), scan_c_project(h, m)])
+
+        for n_steps, n_batch in [(1, 2), (7, 4), (12, 5)]:
+            hv = self.rng.rand(n_steps, n_batch).astype(theano.config.floatX)
+
+            new, old = f(hv, random_chunk_sizes(self.rng, n_steps, n_batch))
+
+            self.assertEqual(new.shape, old.shape)
+            self.assertTrue(np.array_equal(new, old))
+
+
+if __name__ == '__main__':
+    unittest.main()
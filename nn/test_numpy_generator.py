@@ -0,0 +1,51 @@
+import argparse
+import cPickle as pickle
+import os
+import unittest
+
+import numpy as np
+
+from nn.numpy_generator import Generator
+
+'''
+    test_numpy_generator.pkl holds, for the lstm and cnn encodings, the
+    args and the shapes of the generator params, the seed and scale they were
+    drawn from, and batches with the non_sampled_zpred of Model.ready_test
+    (theano, floatX=float32) on them.
+'''
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_numpy_generator.pkl')
+
+
+def random_params(saved):
+    # drawn in the order of Generator.params, as for the theano outputs
+    rng = np.random.RandomState(saved['seed'])
+
+    return [(rng.randn(*shape) * saved['scale']).astype('float32') for shape in saved['shapes']]
+
+
+class NumpyGeneratorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(FIXTURE, 'rb') as f:
+            cls.saved = pickle.load(f)
+
+    def assert_same_z(self, encoding):
+        saved = self.saved[encoding]
+        generator = Generator(argparse.Namespace(**saved['args']), random_params(saved))
+
+        for batch in saved['batches']:
+            z = generator.forward(batch['x'], batch['posit_x'], batch['fw_mask'], batch['chunk_sizes'])
+
+            self.assertEqual(z.shape, batch['z'].shape)
+            self.assertTrue(np.array_equal(z, batch['z']))
+
+    def test_lstm(self):
+        self.assert_same_z('lstm')
+
+    def test_cnn(self):
+        self.assert_same_z('cnn')
+
+
+if __name__ == '__main__':
+    unittest.main()
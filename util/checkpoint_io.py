@@ -0,0 +1,197 @@
+import cPickle as pickle
+import gzip
+import json
+import os
+import struct
+from argparse import Namespace
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+MAGIC = 'SUMCKPT1'
+SUFFIX = '.ckpt'
+
+# every array starts on a multiple of ALIGN bytes, so it can be mapped in place
+ALIGN = 64
+
+
+def aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def to_str(obj):
+    # json gives unicode back, the args are plain str in the pickled models
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [to_str(v) for v in obj]
+
+    return obj
+
+
+@contextmanager
+def atomic_open(path, mode='wb'):
+    '''
+        open(path, mode) on a temporary file next to path, renamed to path once
+        written without error, so that path is never left partly written.
+    '''
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        with open(tmp, mode) as ofp:
+            yield ofp
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    os.rename(tmp, path)
+
+
+def write_checkpoint(path, groups, args, float16=False):
+    '''
+        One uncompressed file : MAGIC, the length of the JSON header, the header
+        (args, and the name, dtype, shape and offset of each array), then the
+        arrays. groups is a list of (name, list of arrays), e.g. the encoder and
+        generator params. With float16 the float arrays are stored as float16
+        and cast back to their dtype when read.
+    '''
+    entries = []
+    offset = 0
+
+    for group, arrays in groups:
+        for k, a in enumerate(arrays):
+            a = np.ascontiguousarray(a)
+            stored = np.float16 if float16 and a.dtype.kind == 'f' else a.dtype
+
+            entries.append(dict(name='{}.{}'.format(group, k), group=group, dtype=a.dtype.str,
+                                stored=np.dtype(stored).str, shape=a.shape, offset=offset))
+            offset = aligned(offset + a.size * np.dtype(stored).itemsize)
+
+    header = json.dumps(dict(args=vars(args), groups=[g for g, _ in groups], arrays=entries))
+    data_start = aligned(len(MAGIC) + 8 + len(header))
+
+    with atomic_open(path) as ofp:
+        ofp.write(MAGIC)
+        ofp.write(struct.pack('<Q', len(header)))
+        ofp.write(header)
+
+        arrays = [a for _, group_arrays in groups for a in group_arrays]
+        for entry, a in zip(entries, arrays):
+            ofp.seek(data_start + entry['offset'])
+            ofp.write(np.ascontiguousarray(a, dtype=entry['stored']).tobytes())
+
+        # pads the last array up to its aligned end
+        ofp.truncate(data_start + offset)
+
+
+def is_checkpoint(path):
+    with open(path, 'rb') as ifp:
+        return ifp.read(len(MAGIC)) == MAGIC
+
+
+def read_checkpoint(path, mmap=True):
+    '''
+        (OrderedDict group -> list of arrays, args) of a file from write_checkpoint.
+        With mmap the arrays are read only views of the file, except the float16
+        ones, which are cast back to their dtype.
+    '''
+    with open(path, 'rb') as ifp:
+        assert ifp.read(len(MAGIC)) == MAGIC, path + ' is not a checkpoint'
+        header_len, = struct.unpack('<Q', ifp.read(8))
+        header = json.loads(ifp.read(header_len))
+
+    data_start = aligned(len(MAGIC) + 8 + header_len)
+
+    if mmap:
+        data = np.memmap(path, dtype='uint8', mode='r', offset=data_start)
+    else:
+        data = np.fromfile(path, dtype='uint8')[data_start:]
+
+    groups = OrderedDict((g, []) for g in header['groups'])
+
+    for entry in header['arrays']:
+        stored = np.dtype(entry['stored'])
+        shape = tuple(entry['shape'])
+        n_bytes = int(np.prod(shape)) * stored.itemsize
+
+        a = data[entry['offset']:entry['offset'] + n_bytes].view(stored).reshape(shape)
+        if stored != np.dtype(entry['dtype']):
+            a = a.astype(entry['dtype'])
+
+        groups[entry['group']].append(a)
+
+    args = Namespace(**dict((str(k), to_str(v)) for k, v in header['args'].iteritems()))
+
+    return groups, args
+
+
+def model_path(path, checkpoint_format):
+    # the file name save_model writes to for a format
+    if checkpoint_format != 'pkl':
+        return path if path.endswith(SUFFIX) else path + SUFFIX
+
+    if path.endswith(".pkl.gz"):
+        return path
+    if path.endswith(".pkl"):
+        return path + ".gz"
+
+    return path + ".pkl.gz"
+
+
+def save_model(path, groups, args, checkpoint_format='pkl'):
+    '''
+        Saves the param groups and args as a gzipped pickle (pkl) or a checkpoint
+        file (ckpt, or ckpt16 with float16 weights), through a temporary file.
+        Returns the file name.
+    '''
+    path = model_path(path, checkpoint_format)
+
+    if checkpoint_format == 'pkl':
+        with atomic_open(path) as ofp, gzip.GzipFile(path, "wb", fileobj=ofp) as fout:
+            pickle.dump(
+                tuple(arrays for _, arrays in groups) + (args,),
+                fout,
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+    else:
+        write_checkpoint(path, groups, args, float16=(checkpoint_format == 'ckpt16'))
+
+    return path
+
+
+def load_model(path):
+    '''
+        The saved tuple, (encoder params, generator params, args) or for a
+        pretrained generator (generator params, args), from either format.
+    '''
+    if not os.path.exists(path):
+        if os.path.exists(path + SUFFIX):
+            path += SUFFIX
+        elif path.endswith(".pkl"):
+            path += ".gz"
+        else:
+            path += ".pkl.gz"
+
+    if is_checkpoint(path):
+        groups, args = read_checkpoint(path)
+        return tuple(groups.values()) + (args,)
+
+    with gzip.open(path, "rb") as fin:
+        return pickle.load(fin)
+
+
+def save_state(path, state):
+    '''
+        Pickles a training state (a dict of arrays and python values) without
+        compression, through a temporary file.
+    '''
+    with atomic_open(path) as ofp:
+        pickle.dump(state, ofp, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_state(path):
+    with open(path, 'rb') as ifp:
+        return pickle.load(ifp)